@@ -20,8 +20,17 @@ Module.register("MMM-Facial-Recognition", {
         // (on other platforms this is always true automatically)
         // This parameter is not used right now, code always uses usb webcam
         useUSBCam: true,
-        // Recognition interval in milliseconds (smaller number = faster but CPU intens!)
+        // Recognition interval in milliseconds (smaller number = faster but CPU intens!).
+        // Used by the "adaptive" scheduler while a face is present or a login is pending
         interval: 1000,
+        // "fixed" - constant 200 ms pause after every frame (the original behaviour),
+        // "adaptive" - frame period follows interval/idleInterval and includes processing time
+        schedulerPolicy: "fixed",
+        // Frame period in milliseconds when no face was seen for idleAfter seconds
+        idleInterval: 2000,
+        idleAfter: 10,
+        // Max share of time spent on processing frames (0..1), e.g. 0.5 on Raspberry Pi
+        cpuCap: 1.0,
         // Logout delay after last recognition so that a user does not get instantly logged out
         // if he turns away from the mirror for a few seconds
         logoutDelay: 15,
@@ -33,8 +42,85 @@ Module.register("MMM-Facial-Recognition", {
         welcomeMessage: true,
         // Send CURRENT_USER event to other modules
         broadcastEvents: false,
+        // Face detection runs only when the changed area of the camera frame is at least
+        // this many pixels (0 - disabled, every frame goes to the face detection)
+        motionDetectionThreshold: 0,
+        // Seconds the face detection keeps running after the motion stopped
+        motionStopDelay: 10,
+        // Search faces only around the faces of the previous frame, the whole frame
+        // is scanned every roiFullScanEvery frames or when no face was found around
+        roiDetection: false,
+        roiFullScanEvery: 10,
+        // Follow faces between frames and reuse the identity of an already recognized face.
+        // The face is recognized again when it moved or after the given amount of frames/seconds
+        faceTracking: false,
+        faceTrackingMaxFrames: 30,
+        faceTrackingMaxSeconds: 5,
         // Show debug information
-        debug: true
+        debug: true,
+        // How camera frames are processed: "serial" - one step after another,
+        // "pipelined" - capture, detection and inference run in parallel threads
+        pipelineMode: "serial",
+        // Where FaceNet runs: "ncs" - Movidius stick, "cv_dnn" - CPU via OpenCV dnn,
+        // "fake" - deterministic embeddings for tests and benchmarks
+        inferenceBackend: "ncs",
+        // Backend specific options, e.g. { modelFile: "facenet.pb", threads: 2 } for "cv_dnn".
+        // "ncs" uses every attached stick ({ devices: "all" }), faces are dispatched
+        // { dispatch: "round_robin" } or { dispatch: "least_busy" }
+        inferenceBackendOptions: {},
+        // How faces are found: "haar_alt2", "haar_alt", "haar_default" - Haar cascades,
+        // "lbp" - LBP cascade (fastest, less accurate, needs lbpcascade_frontalface_improved.xml from
+        // https://github.com/opencv/opencv/tree/master/data/lbpcascades in the python folder),
+        // "dnn_ssd" - OpenCV SSD face detector (needs model files)
+        faceDetector: "haar_alt2",
+        // e.g. { scaleFactor: 1.1, minNeighbors: 5, minSize: [30, 30] } for cascades,
+        // { confidence: 0.5, inputSize: 300, minSize: [30, 30] } for "dnn_ssd"
+        faceDetectorOptions: {},
+        // Seconds between "metrics" messages with stage latencies and counters, 0 - disabled
+        metricsInterval: 0,
+        // Recognize a directory (searched recursively) or glob of images instead of the camera frames.
+        // Results are appended to batchOutput as JSON lines, batchWorkers: 0 - one process per CPU
+        batchImages: null,
+        batchOutput: "batch_results.jsonl",
+        batchWorkers: 0,
+        // "info" or "debug" - every frame logs found faces and distances (a lot of output)
+        logLevel: "info",
+        // Seconds, messages from python are sent together. Login and logout are sent immediately
+        ipcFlushInterval: 0.5,
+        // Photos added to or deleted from validated_images are picked up without restart. Changes are
+        // noticed by inotify (python inotify_simple package) or by checking the folder every given seconds.
+        // 0 - photos are loaded only at startup
+        galleryWatchInterval: 0,
+        // How faces are compared with validated images: "exact" - with every photo,
+        // "ivf" - only with photos of the closest clusters (for tens of thousands of photos)
+        galleryIndex: "exact",
+        // e.g. { lists: 200, probe: 8, pqSubvectors: 16, rerank: 64 } for "ivf",
+        // more probed lists - higher recall, slower search. See IvfGalleryIndexBenchmark.py
+        galleryIndexOptions: {},
+        // Camera index or path of a video file / glob of images (e.g. "/home/pi/replay/*.jpg")
+        // which is replayed in real time instead of the camera
+        cameraSource: 0,
+        // Worker processes for the face detection (0 - detect in the main process). Used when roiDetection is off.
+        // "alternate" - frames are spread over the workers, needs pipelineMode "pipelined"
+        // "scale_bands" - every worker looks for its range of face sizes, lowers the latency of one frame
+        detectionWorkers: 0,
+        detectionPoolMode: "alternate",
+        // Once a user is logged in, the identity is re-verified after reverifyInterval seconds, the interval
+        // doubles after every successful re-verification up to reverifyMaxInterval. 0 - infer every frame.
+        // In between only presence is checked: "detection" - face detection, "motion" - motion detection
+        reverifyInterval: 0,
+        reverifyMaxInterval: 30,
+        presenceCheck: "detection",
+        // Gallery of representative photos made by GalleryCompactor.py (e.g. "validated_images/compact_gallery.npz").
+        // Empty - every validated image is compared with every face
+        compactGallery: "",
+        // Detector parameters tuned for this machine by DetectorTuner.py. Ignored when the file does not exist,
+        // faceDetectorOptions override it
+        detectorTuning: "detector_tuning.json",
+        // Several cameras in one process sharing the inference backend, e.g. [0, {id: "hall", source: 2, budget: 2}].
+        // Every camera has its own login state, its events carry "source" (the id or the position in the list).
+        // budget - inferred frames per second of the camera (0 - unlimited). Empty - cameraSource is used
+        cameraSources: []
     },
 
     /* initialize */
@@ -13,6 +13,11 @@ const { PythonShell } = require("python-shell");
 
 let pythonStarted = false;
 
+// Events of cameraSources carry the camera id
+function sourceSuffix (message) {
+    return message.source === undefined ? "" : ` at camera ${message.source}`;
+}
+
 module.exports = nodeHelper.create({
 
     start () {
@@ -31,21 +36,24 @@ module.exports = nodeHelper.create({
             if (payload.messageType) {
                 switch (payload.messageType) {
                 case "log":
+                case "debug":
                     console.log(`[${self.name}] ${payload.message}`);
                     break;
                 case "login":
-                    console.log(`[${self.name}] User ${payload.message.user} with confidence ${payload.message.distance} logged in.`);
+                    console.log(`[${self.name}] User ${payload.message.user} with confidence ${payload.message.distance} logged in${sourceSuffix(payload.message)}.`);
                     self.sendSocketNotification("user", {
                         action: "FACIAL_RECOGNITION_LOGIN",
                         user: payload.message.user,
-                        distance: payload.message.distance
+                        distance: payload.message.distance,
+                        source: payload.message.source
                     });
                     break;
                 case "logout":
-                    console.log(`[${self.name}] User ${payload.message.user} logged out.`);
+                    console.log(`[${self.name}] User ${payload.message.user} logged out${sourceSuffix(payload.message)}.`);
                     self.sendSocketNotification("user", {
                         action: "FACIAL_RECOGNITION_LOGOUT",
-                        user: payload.message.user
+                        user: payload.message.user,
+                        source: payload.message.source
                     });
                     break;
                 case "matchResults":
@@ -53,10 +61,20 @@ module.exports = nodeHelper.create({
                         console.log(`[${self.name}] Number of matched users ${payload.message.matchedFaces.length}`);
                         self.sendSocketNotification("user", {
                             action: "FACIAL_MATCH_RESULTS",
-                            matchedFaces: payload.message.matchedFaces
+                            matchedFaces: payload.message.matchedFaces,
+                            source: payload.message.source
                         });
                     }
                     break;
+                case "startup":
+                    console.log(`[${self.name}] Startup: first frame after ${payload.message.timeToFirstFrame} ms, first recognition after ${payload.message.timeToFirstRecognition} ms ${JSON.stringify(payload.message.milestones)}`);
+                    break;
+                case "metrics":
+                    console.log(`[${self.name}] Metrics for ${payload.message.interval} s: ${JSON.stringify(payload.message.counters)}`);
+                    for (const [stage, histogram] of Object.entries(payload.message.histograms)) {
+                        console.log(`[${self.name}]   ${stage}: count ${histogram.count}, mean ${histogram.mean} ms, p50 <= ${histogram.p50} ms, p95 <= ${histogram.p95} ms, max ${histogram.max} ms`);
+                    }
+                    break;
                 default:
                     console.log(`[${self.name}] Unsupported message was received with type "${payload.messageType}" and message "${payload.message}".`);
                 }
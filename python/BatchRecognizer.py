@@ -0,0 +1,161 @@
+import argparse
+import collections
+import concurrent.futures
+import fnmatch
+import glob
+import json
+import os
+import time
+import cv2
+import numpy
+from typing import Iterator, List, Optional, Tuple
+from FaceDetector import FaceDetector
+from GalleryIndex import GalleryIndex
+from InferenceBackend import InferenceBackend
+from MatchedFace import MatchedFace
+from PreprocessingEngine import PreprocessingEngine
+
+# Result of a worker: image path, padded face rects, float16 face tensor (None if there is no face), error
+DetectedImage = Tuple[str, List[Tuple[int, int, int, int]], Optional[numpy.ndarray], Optional[str]]
+
+
+# Recognizes faces on a directory (or a recursive glob) of images. Images are decoded, searched for faces
+# and preprocessed in a process pool, crops of several images are sent to the inference backend in one batch.
+# Results are appended to a JSON lines file in the order of the images, one line per image:
+# {"path": "...", "faces": [{"rect": [left, top, right, bottom], "matchedFaces": [{...}]}], "error": null}
+# Only a few images per worker are in flight at any time, so memory does not depend on the amount of images
+class BatchRecognizer:
+    IMAGE_EXTENSIONS = ("*.jpg", "*.jpeg", "*.png")
+    # Faces sent to the inference backend in one infer_batch call
+    BATCH_SIZE = 16
+    # Images submitted to the pool and not written yet, per worker
+    IN_FLIGHT_PER_WORKER = 4
+
+    # Per process buffers of the workers
+    WORKER_ENGINE = None
+
+    def __init__(self, output_path: str, workers: int = None, batch_size: int = BATCH_SIZE):
+        self.output_path = output_path
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.images = 0
+        self.faces = 0
+        self.errors = 0
+
+    # Streams image paths of the directory (recursively) or of the glob, the listing is never kept in memory
+    @staticmethod
+    def iter_image_paths(images: str) -> Iterator[str]:
+        if os.path.isdir(images):
+            for dir_path, dir_names, file_names in os.walk(images):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if any(fnmatch.fnmatch(file_name.lower(), ext) for ext in BatchRecognizer.IMAGE_EXTENSIONS):
+                        yield os.path.join(dir_path, file_name)
+        else:
+            yield from glob.iglob(images, recursive=True)
+
+    # Workers must not print, stdout of the python process is the channel to node
+    @staticmethod
+    def init_worker(engine_name: str, engine_options: dict, tuning: dict, network_width: int,
+                    network_height: int) -> None:
+        FaceDetector.send_to_node = lambda message_type, message: None
+        FaceDetector.configure(engine_name, engine_options)
+        FaceDetector.apply_tuning(tuning)
+        BatchRecognizer.WORKER_ENGINE = PreprocessingEngine(network_width, network_height,
+                                                            FaceDetector.OPTIMIZED_WIDTH)
+
+    @staticmethod
+    def detect_image(path: str) -> DetectedImage:
+        try:
+            image = cv2.imread(path)
+            if image is None:
+                return path, [], None, "Cannot read image"
+            engine = BatchRecognizer.WORKER_ENGINE
+            face_rects = FaceDetector.detect_faces(image, engine)
+            if not face_rects:
+                return path, [], None, None
+            # The engine buffers are reused by the next image, the result is copied while pickled
+            return path, face_rects, engine.preprocess_faces(image, face_rects), None
+        except (cv2.error, RuntimeError) as e:
+            return path, [], None, str(e)
+
+    # Infers and matches the collected faces, then writes their images in the original order
+    def _flush(self, pending: List[DetectedImage], gallery: GalleryIndex, backend: InferenceBackend, output) -> None:
+        from VideoFaceMatcher import VideoFaceMatcher
+        tensors = [tensor for _, _, tensor, _ in pending if tensor is not None]
+        user_distances = []
+        if tensors:
+            user_distances = gallery.min_distances_batch(backend.infer_batch(numpy.concatenate(tensors)))
+        position = 0
+        for path, face_rects, _, error in pending:
+            faces = []
+            for face_rect, distances in zip(face_rects, user_distances[position:position + len(face_rects)]):
+                matched_faces = sorted((MatchedFace(user_login, distance) for user_login, distance in distances.items()
+                                        if distance <= VideoFaceMatcher.FACE_MATCH_THRESHOLD), key=lambda x: x.distance)
+                faces.append({"rect": list(face_rect), "matchedFaces": [mf.__dict__ for mf in matched_faces]})
+            position += len(face_rects)
+            output.write(json.dumps({"path": path, "faces": faces, "error": error}) + "\n")
+            self.images += 1
+            self.faces += len(face_rects)
+            if error is not None:
+                self.errors += 1
+        output.flush()
+
+    def run(self, image_paths: Iterator[str], gallery: GalleryIndex, backend: InferenceBackend) -> None:
+        from VideoFaceMatcher import VideoFaceMatcher
+        started = time.time()
+        max_in_flight = self.workers * BatchRecognizer.IN_FLIGHT_PER_WORKER
+        in_flight = collections.deque()
+        pending = []
+        pending_faces = 0
+        with open(self.output_path, mode="a") as output, \
+                concurrent.futures.ProcessPoolExecutor(
+                    self.workers, initializer=BatchRecognizer.init_worker,
+                    initargs=(FaceDetector.ENGINE_NAME, FaceDetector.ENGINE_OPTIONS, FaceDetector.tuning(),
+                              VideoFaceMatcher.NETWORK_WIDTH, VideoFaceMatcher.NETWORK_HEIGHT)) as pool:
+            image_paths = iter(image_paths)
+            exhausted = False
+            while in_flight or not exhausted:
+                while not exhausted and len(in_flight) < max_in_flight:
+                    path = next(image_paths, None)
+                    if path is None:
+                        exhausted = True
+                    else:
+                        in_flight.append(pool.submit(BatchRecognizer.detect_image, path))
+                if not in_flight:
+                    break
+                # Results are taken in the submission order, so the output follows the input
+                detected = in_flight.popleft().result()
+                pending.append(detected)
+                pending_faces += len(detected[1])
+                if pending_faces >= self.batch_size or len(pending) >= max_in_flight:
+                    self._flush(pending, gallery, backend, output)
+                    pending = []
+                    pending_faces = 0
+            if pending:
+                self._flush(pending, gallery, backend, output)
+        elapsed = time.time() - started
+        VideoFaceMatcher.send_to_node("log", "Batch: {} image(s), {} face(s), {} error(s) in {:.1f} s ({:.1f} images/s)"
+                                      .format(self.images, self.faces, self.errors, elapsed,
+                                              self.images / elapsed if elapsed else 0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognize faces on a directory of images")
+    parser.add_argument("images", help="directory (searched recursively) or glob, recursive ** is supported")
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSON lines file, results are appended")
+    parser.add_argument("--backend", default=InferenceBackend.NCS, help="ncs, cv_dnn or fake")
+    parser.add_argument("--backend-options", default="{}", help="backend options as JSON")
+    parser.add_argument("--workers", type=int, help="decode and detection processes, CPU count by default")
+    parser.add_argument("--batch-size", type=int, default=BatchRecognizer.BATCH_SIZE)
+    args = parser.parse_args()
+    images = os.path.abspath(args.images)
+    output_path = os.path.abspath(args.output)
+    # Classifier, models and validated images are relative to this folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    from VideoFaceMatcher import VideoFaceMatcher
+    matcher = VideoFaceMatcher()
+    matcher.inference_backend = InferenceBackend.create(args.backend, json.loads(args.backend_options))
+    matcher.batch_recognizer = BatchRecognizer(output_path, args.workers, args.batch_size)
+    matcher.batch_images = images
+    matcher.initialize()
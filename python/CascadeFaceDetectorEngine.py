@@ -0,0 +1,79 @@
+import os
+import cv2
+import numpy
+from typing import List, Tuple
+from FaceDetectorEngine import FaceDetectorEngine
+
+
+# OpenCV cascade classifier (Haar or LBP) on the downscaled grayscale frame
+class CascadeFaceDetectorEngine(FaceDetectorEngine):
+    # opencv-python ships only Haar cascades, LBP ones are downloaded into the python folder of the module
+    LBP_CASCADES_URL = "https://github.com/opencv/opencv/tree/master/data/lbpcascades"
+    CLASSIFIERS = {
+        FaceDetectorEngine.HAAR_DEFAULT: "haarcascade_frontalface_default.xml",
+        FaceDetectorEngine.HAAR_ALT: "haarcascade_frontalface_alt.xml",
+        FaceDetectorEngine.HAAR_ALT2: "haarcascade_frontalface_alt2.xml",
+        FaceDetectorEngine.LBP: "lbpcascade_frontalface_improved.xml",
+    }
+
+    def __init__(self, classifier: str, scale_factor: float, min_neighbors: int, min_size: Tuple[int, int],
+                 optimized_width: int):
+        self.classifier = classifier
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.optimized_width = optimized_width
+        self.detector = cv2.CascadeClassifier(CascadeFaceDetectorEngine.find_classifier(classifier))
+        if self.detector.empty():
+            raise RuntimeError("Cannot load classifier \"{}\"".format(classifier))
+
+    # The classifier is looked up in the current folder first and then in the data folder of opencv-python
+    @staticmethod
+    def find_classifier(classifier: str) -> str:
+        if os.path.isfile(classifier):
+            return classifier
+        cv2_data = getattr(cv2, "data", None)
+        if cv2_data is not None and os.path.isfile(os.path.join(cv2_data.haarcascades, classifier)):
+            return os.path.join(cv2_data.haarcascades, classifier)
+        if classifier == CascadeFaceDetectorEngine.CLASSIFIERS[FaceDetectorEngine.LBP]:
+            raise RuntimeError("Cannot find classifier file \"{}\", download it from {} into {}".format(
+                classifier, CascadeFaceDetectorEngine.LBP_CASCADES_URL, os.getcwd()))
+        raise RuntimeError("Cannot find classifier file \"{}\"".format(classifier))
+
+    def find_faces(self, source_image: numpy.ndarray, preprocessing=None) -> List[Tuple[int, int, int, int]]:
+        source_image_width = source_image.shape[1]
+        if preprocessing is not None:
+            gray = preprocessing.to_detector_gray(source_image)
+        else:
+            # convert the input frame from (1) BGR to grayscale (for face detection)
+            import imutils
+            gray = cv2.cvtColor(source_image, cv2.COLOR_BGR2GRAY)
+            gray = imutils.resize(gray, width=self.optimized_width)
+        scale_factor = source_image_width / self.optimized_width
+        # detect faces in the grayscale frame
+        face_rects = self.detector.detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                                    minNeighbors=self.min_neighbors, minSize=self.min_size,
+                                                    flags=cv2.CASCADE_SCALE_IMAGE)
+
+        return [(int(x * scale_factor), int(y * scale_factor), int(w * scale_factor), int(h * scale_factor))
+                for (x, y, w, h) in face_rects]
+
+    def find_faces_in_region(self, region_image: numpy.ndarray, scale: float, min_size: int,
+                             max_size: int) -> List[Tuple[int, int, int, int]]:
+        gray = cv2.cvtColor(region_image, cv2.COLOR_BGR2GRAY)
+        if scale != 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        face_rects = self.detector.detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                                    minNeighbors=self.min_neighbors,
+                                                    minSize=(min_size, min_size), maxSize=(max_size, max_size),
+                                                    flags=cv2.CASCADE_SCALE_IMAGE)
+        return [(int(x / scale), int(y / scale), int(w / scale), int(h / scale)) for (x, y, w, h) in face_rects]
+
+    def settings(self) -> dict:
+        return {
+            "classifier": self.classifier,
+            "optimized_width": self.optimized_width,
+            "scale_factor": self.scale_factor,
+            "min_neighbors": self.min_neighbors,
+            "min_size": list(self.min_size),
+        }
@@ -0,0 +1,58 @@
+import numpy
+from typing import Dict, List
+from GalleryIndex import GalleryIndex
+
+
+# Per-user centroid prefilter in front of the exact search. Every row of a user lies within radius r of
+# the user centroid c, so |p - g| >= |p - c| - r and the rows of the user are compared with the probe
+# only when (|p - c| - r)^2 is within match_threshold. Pruned users could not be matched anyway, so
+# the matching decisions are the same as with GalleryIndex. Like IvfGalleryIndex, pruned users are left
+# out of the result. Pays off for compacted galleries of many users (see GalleryCompactor)
+class CentroidGalleryIndex(GalleryIndex):
+    # float32 rounding must never prune a user which is exactly on the threshold
+    TOLERANCE = 1e-4
+
+    # centroids - {user_login: centroid}, the mean of the user rows by default
+    def __init__(self, user_logins: List[str], embeddings: numpy.ndarray, match_threshold: float,
+                 centroids: Dict[str, numpy.ndarray] = None):
+        super().__init__(user_logins, embeddings)
+        self.match_threshold = match_threshold
+        # Rows compared with probes, for the comparisons per frame statistics
+        self.compared_rows = 0
+        self.probes = 0
+        if not self.users:
+            self.centroids = numpy.empty((0, 0), dtype=numpy.float32)
+            self.radii = numpy.empty(0, dtype=numpy.float32)
+            return
+        counts = numpy.diff(numpy.append(self.segment_starts, len(self.user_ids)))
+        means = numpy.add.reduceat(self.embeddings, self.segment_starts, axis=0) / counts[:, numpy.newaxis]
+        centroids = centroids or {}
+        self.centroids = numpy.stack([numpy.asarray(centroids[user_login], dtype=numpy.float32).ravel()
+                                      if user_login in centroids else means[user_id]
+                                      for user_id, user_login in enumerate(self.users)]).astype(numpy.float32)
+        diff = self.embeddings - self.centroids[self.user_ids]
+        self.radii = numpy.maximum.reduceat(numpy.sqrt(numpy.einsum("ij,ij->i", diff, diff)), self.segment_starts)
+
+    # Users which may be within match_threshold of every probe, shape (probes, users)
+    def candidate_users(self, probes: numpy.ndarray) -> numpy.ndarray:
+        diff = probes[:, numpy.newaxis, :] - self.centroids[numpy.newaxis, :, :]
+        centroid_distances = numpy.sqrt(numpy.einsum("pud,pud->pu", diff, diff))
+        lower_bounds = numpy.maximum(centroid_distances - self.radii[numpy.newaxis, :], 0) ** 2
+        return lower_bounds <= self.match_threshold + CentroidGalleryIndex.TOLERANCE
+
+    def min_distances_batch(self, test_outputs: numpy.ndarray) -> List[Dict[str, float]]:
+        if not self.users or numpy.shape(test_outputs)[1] != self.dimension:
+            return super().min_distances_batch(test_outputs)
+        probes = numpy.asarray(test_outputs, dtype=numpy.float32).reshape(-1, self.dimension)
+        results = []
+        for probe, candidates in zip(probes, self.candidate_users(probes)):
+            rows = candidates[self.user_ids]
+            diff = self.embeddings[rows] - probe
+            distances = numpy.einsum("ij,ij->i", diff, diff)
+            user_distances = numpy.full(len(self.users), numpy.inf, dtype=numpy.float32)
+            numpy.minimum.at(user_distances, self.user_ids[rows], distances)
+            self.compared_rows += len(distances)
+            self.probes += 1
+            results.append({self.users[user_id]: float(user_distances[user_id])
+                            for user_id in numpy.flatnonzero(candidates)})
+        return results
@@ -0,0 +1,47 @@
+import hashlib
+import os
+import cv2
+import numpy
+from InferenceBackend import InferenceBackend
+
+
+# FaceNet model (frozen TensorFlow .pb or .onnx) executed by OpenCV dnn module on CPU.
+# Slower than the stick but works on any machine
+class CvDnnInferenceBackend(InferenceBackend):
+    MODEL_FILENAME = "facenet.pb"
+    # Amount of CPU threads used by OpenCV, 0 - OpenCV decides itself
+    THREADS = 0
+
+    def __init__(self, model_filename: str = MODEL_FILENAME, threads: int = THREADS):
+        self.model_filename = model_filename
+        self.threads = threads
+        self.net = None
+        self.hash = None
+
+    def open(self) -> None:
+        model_file_name = os.path.abspath(self.model_filename)
+        if not os.path.isfile(model_file_name):
+            raise RuntimeError('Cannot find model file "{}"'.format(model_file_name))
+        if self.threads:
+            cv2.setNumThreads(self.threads)
+        with open(model_file_name, mode="rb") as f:
+            self.hash = hashlib.sha1(f.read()).hexdigest()
+        self.net = cv2.dnn.readNet(model_file_name)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def infer(self, face: numpy.ndarray) -> numpy.ndarray:
+        return self.infer_batch(face[numpy.newaxis])[0]
+
+    # All faces are calculated in one forward pass
+    def infer_batch(self, face_tensor: numpy.ndarray) -> numpy.ndarray:
+        # NHWC -> NCHW expected by cv2.dnn
+        blob = numpy.ascontiguousarray(face_tensor.transpose((0, 3, 1, 2)), dtype=numpy.float32)
+        self.net.setInput(blob)
+        return self.net.forward().reshape(len(face_tensor), -1)
+
+    def model_hash(self) -> str:
+        return self.hash
+
+    def close(self) -> None:
+        self.net = None
@@ -0,0 +1,203 @@
+import concurrent.futures
+import os
+import threading
+import cv2
+import numpy
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Tuple
+from FaceDetector import FaceDetector
+from FaceDetectorEngine import FaceDetectorEngine
+from FaceTracker import FaceTracker
+from PreprocessingEngine import PreprocessingEngine
+
+# x, y, width, height in coordinates of the source image
+Face = Tuple[int, int, int, int]
+
+
+# Runs the face detection in worker processes, so all cores of the Pi are used instead of one thread.
+# Frames are copied once into shared memory slots, workers attach to them by name (no pickled images).
+# alternate   - every frame goes to one worker, several frames are detected at the same time.
+#               Pays off only when frames are submitted before the previous result is taken (pipelined mode)
+# scale_bands - every worker scans the whole frame for its own range of face sizes, the rects are merged
+#               with non-maximum suppression. Lowers the latency of a single frame (serial mode as well)
+# submit() returns a Future of the padded face rects (left, top, right, bottom), callers take results
+# in the submission order, so frames reach the inference in the order they were captured
+class DetectionPool:
+    ALTERNATE = "alternate"
+    SCALE_BANDS = "scale_bands"
+    # Frames in flight per worker in the alternate mode, submit() blocks when all slots are busy
+    SLOTS_PER_WORKER = 2
+    # Rects of neighbouring bands with at least this IoU are the same face
+    MERGE_IOU = 0.3
+    # Bands overlap by this amount of detectMultiScale steps. Otherwise faces near a band boundary
+    # collect fewer neighbours (minNeighbors) than in the full scan and are lost
+    BAND_OVERLAP_STEPS = 2
+
+    # Per process state of the workers: detector buffers and attached shared memory blocks by name
+    WORKER_ENGINE = None
+    WORKER_BLOCKS = {}
+    # Attached blocks kept open in a worker, the parent reallocates a slot only when the frame size grows
+    WORKER_MAX_BLOCKS = 16
+
+    def __init__(self, workers: int, mode: str = ALTERNATE):
+        if mode not in (DetectionPool.ALTERNATE, DetectionPool.SCALE_BANDS):
+            raise ValueError("Unknown detection pool mode \"{}\"".format(mode))
+        if mode == DetectionPool.SCALE_BANDS and FaceDetector.ENGINE_NAME == FaceDetectorEngine.DNN_SSD:
+            raise ValueError("Scale bands need a cascade face detector")
+        self.workers = workers
+        self.mode = mode
+        slots = workers * DetectionPool.SLOTS_PER_WORKER if mode == DetectionPool.ALTERNATE \
+            else DetectionPool.SLOTS_PER_WORKER
+        self.blocks = [None] * slots
+        self.free_slots = list(range(slots))
+        self.slot_available = threading.Condition()
+        self.executor = None
+        self.frames = 0
+
+    # Workers must not print, stdout of the python process is the channel to node
+    @staticmethod
+    def init_worker(engine_name: str, engine_options: dict, tuning: dict) -> None:
+        FaceDetector.send_to_node = lambda message_type, message: None
+        FaceDetector.configure(engine_name, engine_options)
+        FaceDetector.apply_tuning(tuning)
+        # Parallelism comes from the processes, OpenCV threads of every worker would compete for the same cores
+        cv2.setNumThreads(1)
+        # Only the detector buffers are used, the network size does not matter
+        DetectionPool.WORKER_ENGINE = PreprocessingEngine(1, 1, FaceDetector.OPTIMIZED_WIDTH)
+
+    @staticmethod
+    def attach(name: str, shape: Tuple[int, ...]) -> numpy.ndarray:
+        block = DetectionPool.WORKER_BLOCKS.get(name)
+        if block is None:
+            if len(DetectionPool.WORKER_BLOCKS) >= DetectionPool.WORKER_MAX_BLOCKS:
+                DetectionPool.WORKER_BLOCKS.pop(next(iter(DetectionPool.WORKER_BLOCKS))).close()
+            block = shared_memory.SharedMemory(name=name)
+            DetectionPool.WORKER_BLOCKS[name] = block
+        return numpy.ndarray(shape, dtype=numpy.uint8, buffer=block.buf)
+
+    @staticmethod
+    def detect_frame(name: str, shape: Tuple[int, ...]) -> List[Face]:
+        image = DetectionPool.attach(name, shape)
+        return FaceDetector.get_engine().find_faces(image, DetectionPool.WORKER_ENGINE)
+
+    # min_size and max_size are face sizes in the frame scaled by scale
+    @staticmethod
+    def detect_band(name: str, shape: Tuple[int, ...], scale: float, min_size: int, max_size: int) -> List[Face]:
+        image = DetectionPool.attach(name, shape)
+        return FaceDetector.get_engine().find_faces_in_region(image, scale, min_size, max_size)
+
+    # Splits face sizes min_size..max_size into bands with the same detection cost. A pyramid level
+    # for face size s has 1/s^2 of the pixels, so the cost of sizes a..b is proportional to 1/a^2 - 1/b^2.
+    # Returns [(min, max)], the small faces get narrow bands
+    @staticmethod
+    def scale_bands(bands: int, min_size: int, max_size: int, scale_factor: float) -> List[Tuple[int, int]]:
+        if max_size <= min_size:
+            return [(min_size, max_size)]
+        step = (1 / min_size ** 2 - 1 / max_size ** 2) / bands
+        bounds = [min_size] + [int(round((1 / min_size ** 2 - step * i) ** -0.5)) for i in range(1, bands)] + \
+                 [max_size]
+        overlap = scale_factor ** DetectionPool.BAND_OVERLAP_STEPS
+        return [(bounds[i], min(int(bounds[i + 1] * overlap) + 1, max_size)) for i in range(bands)
+                if bounds[i] < bounds[i + 1]]
+
+    # The same face found by two bands becomes one rect with averaged coordinates
+    @staticmethod
+    def merge_faces(faces: List[Face], iou_threshold: float = MERGE_IOU) -> List[Face]:
+        groups = []
+        for face in sorted(faces, key=lambda f: f[2] * f[3], reverse=True):
+            rect = (face[0], face[1], face[0] + face[2], face[1] + face[3])
+            for group in groups:
+                if FaceTracker.iou(group[0], rect) >= iou_threshold:
+                    group.append(rect)
+                    break
+            else:
+                groups.append([rect])
+        merged = []
+        for group in groups:
+            left, top, right, bottom = numpy.mean(group, axis=0)
+            merged.append((int(left), int(top), int(right - left), int(bottom - top)))
+        return merged
+
+    # Forks the workers and waits until they loaded the detector. Must be called before other threads of
+    # the process start, a forked worker gets locks held by them (e.g. logging, camera) locked forever
+    def start(self) -> None:
+        # Workers register attached shared memory with the tracker of the parent instead of starting their own
+        resource_tracker.ensure_running()
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers, initializer=DetectionPool.init_worker,
+            initargs=(FaceDetector.ENGINE_NAME, FaceDetector.ENGINE_OPTIONS, FaceDetector.tuning()))
+        # With fork all workers are created on the first task
+        self.executor.submit(os.getpid).result()
+
+    # Copies the image into a free slot, blocks while all slots are in use
+    def _acquire_slot(self, image: numpy.ndarray) -> int:
+        with self.slot_available:
+            self.slot_available.wait_for(lambda: self.free_slots)
+            slot = self.free_slots.pop(0)
+        block = self.blocks[slot]
+        if block is None or block.size < image.nbytes:
+            if block is not None:
+                block.close()
+                block.unlink()
+            block = shared_memory.SharedMemory(create=True, size=image.nbytes)
+            self.blocks[slot] = block
+        numpy.ndarray(image.shape, dtype=numpy.uint8, buffer=block.buf)[...] = image
+        return slot
+
+    def _release_slot(self, slot: int) -> None:
+        with self.slot_available:
+            self.free_slots.append(slot)
+            self.slot_available.notify()
+
+    def submit(self, image: numpy.ndarray) -> concurrent.futures.Future:
+        if self.executor is None:
+            raise RuntimeError("Detection pool is not started")
+        (image_height, image_width) = image.shape[:2]
+        slot = self._acquire_slot(image)
+        name = self.blocks[slot].name
+        self.frames += 1
+        if self.mode == DetectionPool.ALTERNATE:
+            tasks = [self.executor.submit(DetectionPool.detect_frame, name, image.shape)]
+        else:
+            scale = FaceDetector.OPTIMIZED_WIDTH / image_width
+            options = FaceDetector.ENGINE_OPTIONS
+            bands = DetectionPool.scale_bands(self.workers, options.get("minSize", FaceDetector.MIN_SIZE)[0],
+                                              int(min(image_width, image_height) * scale),
+                                              options.get("scaleFactor", FaceDetector.SCALE_FACTOR))
+            tasks = [self.executor.submit(DetectionPool.detect_band, name, image.shape, scale, min_size, max_size)
+                     for min_size, max_size in bands]
+
+        result = concurrent.futures.Future()
+        remaining = [len(tasks)]
+        lock = threading.Lock()
+
+        def task_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self._release_slot(slot)
+            try:
+                faces = [face for task in tasks for face in task.result()]
+                if len(tasks) > 1:
+                    faces = DetectionPool.merge_faces(faces)
+                face_rects = [FaceDetector.pad_face(face, image_width, image_height) for face in faces]
+            except BaseException as e:
+                result.set_exception(e)
+                return
+            FaceDetector.send_to_node("debug", "Found {} face(s)".format(len(face_rects)))
+            result.set_result(face_rects)
+
+        for task in tasks:
+            task.add_done_callback(task_done)
+        return result
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        for slot, block in enumerate(self.blocks):
+            if block is not None:
+                block.close()
+                block.unlink()
+                self.blocks[slot] = None
@@ -0,0 +1,81 @@
+import argparse
+import collections
+import glob
+import os
+import time
+import cv2
+import numpy
+from DetectionPool import DetectionPool
+from FaceDetector import FaceDetector
+from FaceTracker import FaceTracker
+from RoiFaceDetectorBenchmark import MATCH_IOU, read_video, synthetic_frames
+
+# FPS of the face detection in the main process and in DetectionPool with 1..N workers.
+# Frames are submitted ahead (like the pipelined mode does) and results are taken in the frame order.
+# Rects of the main process are the reference for the recall
+# Usage: python3 DetectionPoolBenchmark.py --video frames.avi --workers 4
+#        python3 DetectionPoolBenchmark.py --frames "recorded/*.jpg"
+# Without arguments a synthetic sequence is made by moving validated images over a 640x480 frame
+
+
+def recall(reference, detected) -> float:
+    expected = sum(len(rects) for rects in reference)
+    found = sum(1 for ref_rects, rects in zip(reference, detected)
+                for rect in ref_rects if any(FaceTracker.iou(rect, d) >= MATCH_IOU for d in rects))
+    return found / expected if expected else 1.0
+
+
+def run_pool(frames, workers: int, mode: str):
+    pool = DetectionPool(workers, mode)
+    try:
+        # Workers load the classifier before the measurement
+        pool.start()
+        in_flight = collections.deque()
+        detected = []
+        started = time.perf_counter()
+        for frame in frames:
+            in_flight.append(pool.submit(frame))
+            if len(in_flight) > workers:
+                detected.append(in_flight.popleft().result())
+        detected += [future.result() for future in in_flight]
+        return len(frames) / (time.perf_counter() - started), detected
+    finally:
+        pool.close()
+
+
+def run(frames, max_workers: int):
+    FaceDetector.get_engine()
+    started = time.perf_counter()
+    reference = [FaceDetector.detect_faces(frame) for frame in frames]
+    single_fps = len(frames) / (time.perf_counter() - started)
+
+    print("frames: {}, faces: {}, cores: {}".format(len(frames), sum(len(r) for r in reference), os.cpu_count()))
+    print("{:>12} {:>8} {:>8} {:>8} {:>8}".format("mode", "workers", "FPS", "speedup", "recall"))
+    print("{:>12} {:>8} {:8.2f} {:8.2f} {:8.3f}".format("main", 0, single_fps, 1.0, 1.0))
+    for mode in (DetectionPool.ALTERNATE, DetectionPool.SCALE_BANDS):
+        for workers in range(1, max_workers + 1):
+            fps, detected = run_pool(frames, workers, mode)
+            print("{:>12} {:>8} {:8.2f} {:8.2f} {:8.3f}".format(mode, workers, fps, fps / single_fps,
+                                                                 recall(reference, detected)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Face detection FPS with 1..N detection worker processes")
+    parser.add_argument("--video", help="video file with recorded frames")
+    parser.add_argument("--frames", help="glob of recorded frame images")
+    parser.add_argument("--count", type=int, default=100, help="amount of synthetic frames")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="the largest amount of workers")
+    args = parser.parse_args()
+    video = os.path.abspath(args.video) if args.video else None
+    frames = os.path.abspath(args.frames) if args.frames else None
+    # Classifier and validated images are relative to this folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    FaceDetector.send_to_node = lambda message_type, message: None
+    if video:
+        source = read_video(video)
+    elif frames:
+        source = (cv2.imread(path) for path in sorted(glob.glob(frames)))
+    else:
+        source = synthetic_frames(args.count)
+    # Frames are decoded before the measurement, so the decoding is not part of the detection FPS
+    run([numpy.ascontiguousarray(frame) for frame in source], args.workers)
@@ -0,0 +1,221 @@
+import argparse
+import itertools
+import json
+import os
+import time
+import cv2
+import numpy
+from typing import List, Tuple
+from CascadeFaceDetectorEngine import CascadeFaceDetectorEngine
+from FaceDetector import FaceDetector
+from FaceTracker import FaceTracker
+
+# Tunes the face detector for the machine it runs on. Detection width, scaleFactor, minNeighbors, minSize
+# and PADDING are swept over labelled sample frames, every configuration gets its per-frame latency and
+# recall/precision against the labels. Of the Pareto-best configurations (no other one is faster and
+# finds more faces with fewer false ones) that fit the per-frame budget, the one with the best F1 wins.
+# It is written to detector_tuning.json which FaceDetector loads at startup (see detectorTuning).
+# Labels are JSON lines, one frame per line: {"path": "frame.jpg", "faces": [[left, top, right, bottom]]}
+# with rects of the whole head like the crops sent to the network. Output of BatchRecognizer.py has
+# the same format ({"faces": [{"rect": [...]}]}) and can be used after the rects were reviewed.
+# Run it on the target machine, latencies of another machine are meaningless.
+# Usage: python3 DetectorTuner.py labels.jsonl --budget 250
+
+# left, top, right, bottom
+Rect = Tuple[int, int, int, int]
+
+
+class DetectorTuner:
+    OUTPUT = "detector_tuning.json"
+    WIDTHS = [240, 320, 400, 480, 640]
+    SCALE_FACTORS = [1.05, 1.1, 1.2, 1.3]
+    MIN_NEIGHBORS = [3, 4, 5, 6]
+    MIN_SIZES = [20, 30, 40]
+    PADDINGS = [0, 5, 10, 15, 20, 25]
+    # Detected rect counts as the labelled face when IoU is at least this value
+    MATCH_IOU = 0.5
+    # detectMultiScale groups the candidates with this eps, the same grouping is done here for every minNeighbors
+    GROUP_EPS = 0.2
+
+    def __init__(self, classifier: str, frames: List[Tuple[numpy.ndarray, List[Rect]]], repeat: int = 1):
+        self.detector = cv2.CascadeClassifier(CascadeFaceDetectorEngine.find_classifier(classifier))
+        if self.detector.empty():
+            raise RuntimeError("Cannot load classifier \"{}\"".format(classifier))
+        self.frames = frames
+        self.repeat = repeat
+
+    # Reads the labels, frames which cannot be read are skipped
+    @staticmethod
+    def load_labels(labels_path: str) -> List[Tuple[numpy.ndarray, List[Rect]]]:
+        frames = []
+        labels_dir = os.path.dirname(os.path.abspath(labels_path))
+        with open(labels_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                label = json.loads(line)
+                image = cv2.imread(os.path.join(labels_dir, label["path"]))
+                if image is None:
+                    print("Cannot read {}, skipped".format(label["path"]))
+                    continue
+                faces = [tuple(face["rect"] if isinstance(face, dict) else face) for face in label["faces"]]
+                frames.append((image, faces))
+        return frames
+
+    # Runs the cascade once without grouping (minNeighbors=0) and groups the candidates for every
+    # minNeighbors afterwards, exactly like detectMultiScale does. Returns {min_neighbors: (per-frame
+    # latencies in ms, per-frame faces (x, y, w, h) in source coordinates)}
+    def measure(self, width: int, scale_factor: float, min_size: int, min_neighbors_list: List[int]) -> dict:
+        results = {min_neighbors: ([], []) for min_neighbors in min_neighbors_list}
+        for image, _ in self.frames:
+            (image_height, image_width) = image.shape[:2]
+            scale = image_width / width
+            for repeat in range(self.repeat):
+                started = time.perf_counter()
+                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                gray = cv2.resize(gray, (width, int(image_height / scale)), interpolation=cv2.INTER_AREA)
+                candidates = self.detector.detectMultiScale(gray, scaleFactor=scale_factor, minNeighbors=0,
+                                                            minSize=(min_size, min_size),
+                                                            flags=cv2.CASCADE_SCALE_IMAGE)
+                detect_ms = (time.perf_counter() - started) * 1000
+                for min_neighbors in min_neighbors_list:
+                    started = time.perf_counter()
+                    if len(candidates):
+                        grouped, _ = cv2.groupRectangles([list(rect) for rect in candidates], min_neighbors,
+                                                         DetectorTuner.GROUP_EPS)
+                    else:
+                        grouped = []
+                    latencies, faces = results[min_neighbors]
+                    latencies.append(detect_ms + (time.perf_counter() - started) * 1000)
+                    if repeat == 0:
+                        faces.append([(int(x * scale), int(y * scale), int(w * scale), int(h * scale))
+                                      for (x, y, w, h) in grouped])
+        return results
+
+    # Detected faces padded by padding are matched one to one with the labels, the best IoU first.
+    # Returns matched, detected and labelled face counts and the sum of IoU of the matches
+    def score(self, faces: List[List[Tuple[int, int, int, int]]], padding: int) -> Tuple[int, int, int, float]:
+        matched = detected = labelled = 0
+        iou_sum = 0.0
+        for (image, labels), frame_faces in zip(self.frames, faces):
+            (image_height, image_width) = image.shape[:2]
+            rects = [FaceDetector.pad_face(face, image_width, image_height, padding) for face in frame_faces]
+            pairs = sorted(((FaceTracker.iou(rect, label), i, j) for i, rect in enumerate(rects)
+                            for j, label in enumerate(labels)), reverse=True)
+            used_rects = set()
+            used_labels = set()
+            for iou, i, j in pairs:
+                if iou < DetectorTuner.MATCH_IOU:
+                    break
+                if i in used_rects or j in used_labels:
+                    continue
+                used_rects.add(i)
+                used_labels.add(j)
+                iou_sum += iou
+            matched += len(used_rects)
+            detected += len(rects)
+            labelled += len(labels)
+        return matched, detected, labelled, iou_sum
+
+    def sweep(self, widths, scale_factors, min_neighbors_list, min_sizes, paddings) -> List[dict]:
+        results = []
+        for width, scale_factor, min_size in itertools.product(widths, scale_factors, min_sizes):
+            for min_neighbors, (latencies, faces) in self.measure(width, scale_factor, min_size,
+                                                                  min_neighbors_list).items():
+                # Padding does not change the latency, the one which fits the labels best is taken
+                best = max(((self.score(faces, padding), padding) for padding in paddings),
+                           key=lambda item: (item[0][0], item[0][3]))
+                (matched, detected, labelled, iou_sum), padding = best
+                recall = matched / labelled if labelled else 1.0
+                precision = matched / detected if detected else 1.0
+                results.append({
+                    "optimizedWidth": width,
+                    "scaleFactor": scale_factor,
+                    "minNeighbors": min_neighbors,
+                    "minSize": [min_size, min_size],
+                    "padding": padding,
+                    "latencyMs": round(float(numpy.mean(latencies)), 2),
+                    "p95Ms": round(float(numpy.percentile(latencies, 95)), 2),
+                    "recall": round(recall, 4),
+                    "precision": round(precision, 4),
+                    "f1": round(2 * recall * precision / (recall + precision), 4) if recall + precision else 0.0,
+                    "meanIou": round(iou_sum / matched, 4) if matched else 0.0,
+                })
+            print("width {}, scaleFactor {}, minSize {}: done".format(width, scale_factor, min_size))
+        return results
+
+    # Configurations which no other configuration beats in latency, recall and precision at once
+    @staticmethod
+    def pareto_front(results: List[dict]) -> List[dict]:
+        def dominates(a: dict, b: dict) -> bool:
+            no_worse = a["p95Ms"] <= b["p95Ms"] and a["recall"] >= b["recall"] and a["precision"] >= b["precision"]
+            better = a["p95Ms"] < b["p95Ms"] or a["recall"] > b["recall"] or a["precision"] > b["precision"]
+            return no_worse and better
+        return [result for result in results if not any(dominates(other, result) for other in results)]
+
+    # The best F1 (then the fastest) of the Pareto front within the budget. When nothing fits the budget
+    # the fastest configuration is returned
+    @staticmethod
+    def select(results: List[dict], budget_ms: float) -> Tuple[dict, bool]:
+        front = DetectorTuner.pareto_front(results)
+        fitting = [result for result in front if result["p95Ms"] <= budget_ms]
+        if not fitting:
+            return min(results, key=lambda result: result["p95Ms"]), False
+        return max(fitting, key=lambda result: (result["f1"], result["meanIou"], -result["p95Ms"])), True
+
+
+def print_results(results: List[dict]) -> None:
+    print("{:>6} {:>6} {:>5} {:>5} {:>4} {:>8} {:>8} {:>7} {:>9} {:>6}".format(
+        "width", "scale", "neigh", "size", "pad", "mean ms", "p95 ms", "recall", "precision", "f1"))
+    for r in sorted(results, key=lambda result: result["p95Ms"]):
+        print("{:6d} {:6.2f} {:5d} {:5d} {:4d} {:8.2f} {:8.2f} {:7.3f} {:9.3f} {:6.3f}".format(
+            r["optimizedWidth"], r["scaleFactor"], r["minNeighbors"], r["minSize"][0], r["padding"],
+            r["latencyMs"], r["p95Ms"], r["recall"], r["precision"], r["f1"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune face detector parameters for a per-frame time budget")
+    parser.add_argument("labels", help="JSON lines with frame paths (relative to the file) and face rects")
+    parser.add_argument("--budget", type=float, required=True, help="per-frame detection budget, ms (p95)")
+    parser.add_argument("--detector", default=FaceDetector.ENGINE_NAME, help="cascade to tune, e.g. haar_alt2, lbp")
+    parser.add_argument("--output", help="config file loaded by FaceDetector, {} by default"
+                        .format(DetectorTuner.OUTPUT))
+    parser.add_argument("--widths", type=int, nargs="+", default=DetectorTuner.WIDTHS)
+    parser.add_argument("--scale-factors", type=float, nargs="+", default=DetectorTuner.SCALE_FACTORS)
+    parser.add_argument("--min-neighbors", type=int, nargs="+", default=DetectorTuner.MIN_NEIGHBORS)
+    parser.add_argument("--min-sizes", type=int, nargs="+", default=DetectorTuner.MIN_SIZES)
+    parser.add_argument("--paddings", type=int, nargs="+", default=DetectorTuner.PADDINGS)
+    parser.add_argument("--repeat", type=int, default=1, help="detections of every frame for the latency")
+    parser.add_argument("--results", help="JSON file for all measured configurations")
+    args = parser.parse_args()
+    labels_path = os.path.abspath(args.labels)
+    output_path = os.path.abspath(args.output) if args.output else None
+    results_path = os.path.abspath(args.results) if args.results else None
+    # Classifier and the default output are relative to this folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    output_path = output_path or os.path.abspath(DetectorTuner.OUTPUT)
+    if args.detector not in CascadeFaceDetectorEngine.CLASSIFIERS:
+        parser.error("only cascade detectors can be tuned: {}".format(
+            ", ".join(CascadeFaceDetectorEngine.CLASSIFIERS)))
+
+    sample_frames = DetectorTuner.load_labels(labels_path)
+    if not sample_frames:
+        parser.error("no labelled frames in {}".format(labels_path))
+    tuner = DetectorTuner(CascadeFaceDetectorEngine.CLASSIFIERS[args.detector], sample_frames, args.repeat)
+    all_results = tuner.sweep(args.widths, args.scale_factors, args.min_neighbors, args.min_sizes, args.paddings)
+    print("Pareto front of {} configurations on {} frames:".format(len(all_results), len(sample_frames)))
+    print_results(DetectorTuner.pareto_front(all_results))
+    best, fits = DetectorTuner.select(all_results, args.budget)
+    if not fits:
+        print("No configuration fits {} ms, the fastest one is taken".format(args.budget))
+    tuning = {key: best[key] for key in ("optimizedWidth", "scaleFactor", "minNeighbors", "minSize", "padding")}
+    tuning["engine"] = args.detector
+    tuning["budgetMs"] = args.budget
+    tuning["measured"] = {key: best[key] for key in ("latencyMs", "p95Ms", "recall", "precision", "f1", "meanIou")}
+    with open(output_path, mode="w") as f:
+        json.dump(tuning, f, indent=2)
+    print("Selected: {}".format(tuning))
+    print("Written to {}".format(output_path))
+    if results_path:
+        with open(results_path, mode="w") as f:
+            json.dump(all_results, f, indent=2)
@@ -0,0 +1,62 @@
+import os
+import cv2
+import numpy
+from typing import List, Tuple
+from FaceDetectorEngine import FaceDetectorEngine
+
+
+# OpenCV face detector (Caffe ResNet-10 SSD) executed by cv2.dnn on CPU. More robust to pose and light
+# than cascades. Model files are not part of the module, see
+# https://github.com/opencv/opencv/tree/master/samples/dnn/face_detector
+class DnnFaceDetectorEngine(FaceDetectorEngine):
+    PROTOTXT = "deploy.prototxt"
+    MODEL = "res10_300x300_ssd_iter_140000.caffemodel"
+    # Minimal detection confidence, 0..1
+    CONFIDENCE = 0.5
+    # The network was trained on 300x300 images, smaller size is faster but misses small faces
+    INPUT_SIZE = 300
+    # Mean BGR values of the training set
+    MEAN = (104.0, 177.0, 123.0)
+
+    def __init__(self, prototxt: str, model: str, confidence: float, input_size: int, min_size: Tuple[int, int]):
+        for path in (prototxt, model):
+            if not os.path.isfile(path):
+                raise RuntimeError("Cannot find model file \"{}\"".format(path))
+        self.prototxt = prototxt
+        self.model = model
+        self.confidence = confidence
+        self.input_size = input_size
+        self.min_size = min_size
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+
+    def _detect(self, image: numpy.ndarray) -> List[Tuple[int, int, int, int]]:
+        (height, width) = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(image, 1.0, (self.input_size, self.input_size), DnnFaceDetectorEngine.MEAN)
+        self.net.setInput(blob)
+        # (1, 1, detections, 7): image id, class, confidence, left, top, right, bottom (relative)
+        detections = self.net.forward()[0, 0]
+        faces = []
+        for detection in detections[detections[:, 2] >= self.confidence]:
+            x1 = max(int(detection[3] * width), 0)
+            y1 = max(int(detection[4] * height), 0)
+            x2 = min(int(detection[5] * width), width)
+            y2 = min(int(detection[6] * height), height)
+            if x2 > x1 and y2 > y1:
+                faces.append((x1, y1, x2 - x1, y2 - y1))
+        return faces
+
+    def find_faces(self, source_image: numpy.ndarray, preprocessing=None) -> List[Tuple[int, int, int, int]]:
+        return [face for face in self._detect(source_image)
+                if face[2] >= self.min_size[0] and face[3] >= self.min_size[1]]
+
+    def find_faces_in_region(self, region_image: numpy.ndarray, scale: float, min_size: int,
+                             max_size: int) -> List[Tuple[int, int, int, int]]:
+        return [face for face in self._detect(region_image) if min_size <= face[2] * scale <= max_size]
+
+    def settings(self) -> dict:
+        return {
+            "model": self.model,
+            "confidence": self.confidence,
+            "input_size": self.input_size,
+            "min_size": list(self.min_size),
+        }
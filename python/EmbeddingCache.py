@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import numpy
+from typing import Callable, Dict, List
+from FaceDetector import print_to_console
+from ValidatedImage import ValidatedImage
+
+
+# Keeps inference results of the validated images between runs. Embeddings are stored in .npy file
+# (loaded with mmap) and the index in .json file next to it. Entry key consists of the image content hash
+# and the hash of the settings (graph file hash + detector and preprocessing settings). So only new or
+# changed photos are sent to the inference device, entries of deleted photos are evicted on save.
+class EmbeddingCache:
+    CACHE_NAME = "embeddings_cache"
+    VERSION = 1
+
+    # Print to console from static methods by default
+    send_to_node = print_to_console
+
+    def __init__(self, cache_dir: str, settings: Dict):
+        self.matrix_path = os.path.join(cache_dir, EmbeddingCache.CACHE_NAME + ".npy")
+        self.index_path = os.path.join(cache_dir, EmbeddingCache.CACHE_NAME + ".json")
+        self.settings_hash = hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        sha1 = hashlib.sha1()
+        with open(path, mode="rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def entry_key(self, content_hash: str) -> str:
+        return "{}:{}".format(content_hash, self.settings_hash)
+
+    # Returns {entry key: row} and matrix opened with mmap. Broken or outdated cache is ignored
+    def _load(self):
+        if not (os.path.isfile(self.index_path) and os.path.isfile(self.matrix_path)):
+            return {}, None
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get("version") != EmbeddingCache.VERSION:
+                return {}, None
+            matrix = numpy.load(self.matrix_path, mmap_mode="r")
+            entries = {key: row for key, row in index["entries"].items() if row < len(matrix)}
+            return entries, matrix
+        except (OSError, ValueError, KeyError) as e:
+            EmbeddingCache.send_to_node("log", "Embedding cache is ignored: {}".format(e))
+            return {}, None
+
+    # Writes to temporary files first, so a killed process never leaves half written cache
+    def _save(self, keys: List[str], embeddings: numpy.ndarray):
+        index = {"version": EmbeddingCache.VERSION, "entries": {key: row for row, key in enumerate(keys)}}
+        with open(self.matrix_path + ".tmp", mode="wb") as f:
+            numpy.save(f, embeddings)
+        with open(self.index_path + ".tmp", mode="w") as f:
+            json.dump(index, f)
+        os.replace(self.matrix_path + ".tmp", self.matrix_path)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    # Fills inference of every validated image. calculate_inference(image) is called only for cache misses
+    def fill(self, validated_images: List[ValidatedImage],
+             calculate_inference: Callable[[ValidatedImage], numpy.ndarray]) -> None:
+        entries, matrix = self._load()
+        keys = []
+        rows = []
+        stored_keys = set()
+        changed = False
+        for img in validated_images:
+            key = self.entry_key(EmbeddingCache.file_hash(img.image_path))
+            if key in entries:
+                self.hits += 1
+                img.inference = numpy.array(matrix[entries[key]])
+            elif key in stored_keys:
+                # The same photo copied to several folders, calculated already
+                self.hits += 1
+                img.inference = rows[keys.index(key)]
+            else:
+                self.misses += 1
+                changed = True
+                img.inference = calculate_inference(img)
+                # Unreadable photo (e.g. still being copied), not cached so it is tried again next time
+                if img.inference is None:
+                    continue
+            if key not in stored_keys:
+                stored_keys.add(key)
+                keys.append(key)
+                rows.append(numpy.asarray(img.inference, dtype=numpy.float32).ravel())
+
+        evicted = len(set(entries) - stored_keys)
+        EmbeddingCache.send_to_node("log", "Embedding cache: {} hit(s), {} miss(es), {} evicted"
+                                    .format(self.hits, self.misses, evicted))
+        if changed or evicted:
+            embeddings = numpy.stack(rows) if rows else numpy.empty((0, 0), dtype=numpy.float32)
+            try:
+                self._save(keys, embeddings)
+            except OSError as e:
+                EmbeddingCache.send_to_node("log", "Cannot save embedding cache: {}".format(e))
@@ -1,7 +1,9 @@
-import cv2
-import imutils
+import json
+import os
+import threading
 import numpy
 from typing import List, Tuple
+from FaceDetectorEngine import FaceDetectorEngine
 
 
 # message can be anything (strings or even object)
@@ -15,50 +17,152 @@ class FaceDetector:
     # Scale down the original image before analyze in order to decrease CPU load on raspberry
     OPTIMIZED_WIDTH = 400
 
-    # CLASSIFIER = "haarcascade_frontalface_default.xml"        # [INFO] approx. FPS: 1.07
-    # CLASSIFIER = "haarcascade_frontalface_alt.xml"            # [INFO] approx. FPS: 0.81
-    CLASSIFIER = "haarcascade_frontalface_alt2.xml"             # [INFO] approx. FPS: 1.39
-    DETECTOR = None
+    # Engine which finds faces, see FaceDetectorEngine.NAMES. Options are engine specific
+    ENGINE_NAME = FaceDetectorEngine.HAAR_ALT2
+    ENGINE_OPTIONS = {}
+    # Engines are not thread-safe (cv2.CascadeClassifier, cv2.dnn nets), every thread which detects faces
+    # (camera loop, pipeline detect stage, cameras of MultiCameraMatcher, GalleryWatcher) has its own one.
+    # ENGINE_VERSION changes with the settings, engines of older settings are recreated
+    THREAD_ENGINES = threading.local()
+    ENGINE_VERSION = 0
+    # Engines created ahead by preload_engine(), taken by the first threads which need one
+    PRELOADED_ENGINES = []
+    ENGINES_LOCK = threading.Lock()
+    # detectMultiScale parameters, used when faceDetectorOptions does not override them
+    SCALE_FACTOR = 1.1
+    MIN_NEIGHBORS = 5
+    MIN_SIZE = (30, 30)
 
     # Print to console from static methods by default
     send_to_node = print_to_console
 
+    # Select the engine by name, it is created on the first detection
     @staticmethod
-    def detect_faces(source_image: numpy.ndarray) -> List[Tuple[int, int, int, int]]:
-        # Have to use delayed loading because when this class is imported from node js
-        # the current CWD is not set yet correctly at this moment
-        if FaceDetector.DETECTOR is None:
-            FaceDetector.send_to_node("log", "Initializing face detector (classifier)")
-            FaceDetector.DETECTOR = cv2.CascadeClassifier(FaceDetector.CLASSIFIER)
+    def configure(engine_name: str, engine_options: dict = None) -> None:
+        FaceDetector.ENGINE_NAME = engine_name
+        FaceDetector.ENGINE_OPTIONS = engine_options or {}
+        FaceDetector.reset_engines()
 
+    # Everything which changes the detected rects (used to invalidate cached embeddings)
+    @staticmethod
+    def settings() -> dict:
+        return {
+            "engine": FaceDetector.ENGINE_NAME,
+            "engine_options": FaceDetector.ENGINE_OPTIONS,
+            "padding": FaceDetector.PADDING,
+            "optimized_width": FaceDetector.OPTIMIZED_WIDTH,
+            "scale_factor": FaceDetector.SCALE_FACTOR,
+            "min_neighbors": FaceDetector.MIN_NEIGHBORS,
+            "min_size": list(FaceDetector.MIN_SIZE),
+        }
+
+    # Parameters which DetectorTuner.py tunes for the machine, in the format of its config file
+    @staticmethod
+    def tuning() -> dict:
+        return {
+            "engine": FaceDetector.ENGINE_NAME,
+            "optimizedWidth": FaceDetector.OPTIMIZED_WIDTH,
+            "scaleFactor": FaceDetector.SCALE_FACTOR,
+            "minNeighbors": FaceDetector.MIN_NEIGHBORS,
+            "minSize": list(FaceDetector.MIN_SIZE),
+            "padding": FaceDetector.PADDING,
+        }
+
+    # Worker processes get the tuning of the parent this way, class attributes survive only fork
+    @staticmethod
+    def apply_tuning(tuning: dict) -> None:
+        FaceDetector.OPTIMIZED_WIDTH = int(tuning["optimizedWidth"])
+        FaceDetector.SCALE_FACTOR = float(tuning["scaleFactor"])
+        FaceDetector.MIN_NEIGHBORS = int(tuning["minNeighbors"])
+        FaceDetector.MIN_SIZE = tuple(tuning["minSize"])
+        FaceDetector.PADDING = int(tuning["padding"])
+        FaceDetector.reset_engines()
+
+    @staticmethod
+    def reset_engines() -> None:
+        with FaceDetector.ENGINES_LOCK:
+            FaceDetector.ENGINE_VERSION += 1
+            FaceDetector.PRELOADED_ENGINES = []
+
+    # Loads the file written by DetectorTuner.py. faceDetectorOptions of the config still override it.
+    # Returns False when there is no file or it was tuned for another engine
+    @staticmethod
+    def load_tuning(path: str) -> bool:
+        if not path or not os.path.isfile(path):
+            return False
+        try:
+            with open(path) as f:
+                tuning = json.load(f)
+            if tuning.get("engine") != FaceDetector.ENGINE_NAME:
+                FaceDetector.send_to_node("log", "Detector tuning {} is for {}, ignored"
+                                          .format(path, tuning.get("engine")))
+                return False
+            FaceDetector.apply_tuning(tuning)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            FaceDetector.send_to_node("log", "Detector tuning {} is ignored: {}".format(path, e))
+            return False
+        FaceDetector.send_to_node("log", "Detector tuning loaded from {}: {}".format(path, FaceDetector.tuning()))
+        return True
+
+    # Have to use delayed loading because when this class is imported from node js
+    # the current CWD is not set yet correctly at this moment
+    @staticmethod
+    def get_engine() -> FaceDetectorEngine:
+        local = FaceDetector.THREAD_ENGINES
+        if getattr(local, "version", None) != FaceDetector.ENGINE_VERSION:
+            with FaceDetector.ENGINES_LOCK:
+                version = FaceDetector.ENGINE_VERSION
+                engine = FaceDetector.PRELOADED_ENGINES.pop() if FaceDetector.PRELOADED_ENGINES else None
+            local.engine = engine or FaceDetector.create_engine()
+            local.version = version
+        return local.engine
+
+    # Loads the model while other initialization steps run, the first thread which detects faces takes it
+    @staticmethod
+    def preload_engine() -> None:
+        with FaceDetector.ENGINES_LOCK:
+            version = FaceDetector.ENGINE_VERSION
+        engine = FaceDetector.create_engine()
+        with FaceDetector.ENGINES_LOCK:
+            if version == FaceDetector.ENGINE_VERSION:
+                FaceDetector.PRELOADED_ENGINES.append(engine)
+
+    @staticmethod
+    def create_engine() -> FaceDetectorEngine:
+        FaceDetector.send_to_node("log", "Initializing face detector ({}) for thread {}".format(
+            FaceDetector.ENGINE_NAME, threading.current_thread().name))
+        return FaceDetectorEngine.create(FaceDetector.ENGINE_NAME, FaceDetector.ENGINE_OPTIONS)
+
+    # preprocessing is an optional PreprocessingEngine which reuses the grayscale buffers between frames
+    @staticmethod
+    def detect_faces(source_image: numpy.ndarray, preprocessing=None) -> List[Tuple[int, int, int, int]]:
         (source_image_height, source_image_width) = source_image.shape[:2]
-        # convert the input frame from (1) BGR to grayscale (for face detection)
-        gray = cv2.cvtColor(source_image, cv2.COLOR_BGR2GRAY)
-        gray = imutils.resize(gray, width=FaceDetector.OPTIMIZED_WIDTH)
-        scale_factor = source_image_width / FaceDetector.OPTIMIZED_WIDTH
-        # detect faces in the grayscale frame
-        face_rects = FaceDetector.DETECTOR.detectMultiScale(gray, scaleFactor=1.1,
-                                                            minNeighbors=5, minSize=(30, 30),
-                                                            flags=cv2.CASCADE_SCALE_IMAGE)
-
-        output_face_rects = []
-        for face in face_rects:
-            x, y, w, h = face
-            x = int(x * scale_factor)
-            y = int(y * scale_factor)
-            w = int(w * scale_factor)
-            h = int(h * scale_factor)
-            # Expand the detected face boundaries to have more padding and include the whole head
-            # Or if the rectangle boundary falls outside the window cut it off at the edge
-            width_padding = int(w * FaceDetector.PADDING / 100)
-            height_padding = int(h * FaceDetector.PADDING / 100)
-            x1 = max(x - width_padding, 0)
-            y1 = max(y - height_padding, 0)
-            x2 = min(x + w + width_padding, source_image_width)
-            y2 = min(y + h + height_padding, source_image_height)
-            # left, top, right, bottom
-            output_face_rects.append((x1, y1, x2, y2))
-
-        FaceDetector.send_to_node("log", "Found {} face(s)".format(len(output_face_rects)))
+        output_face_rects = [FaceDetector.pad_face(face, source_image_width, source_image_height)
+                             for face in FaceDetector.find_faces(source_image, preprocessing)]
+
+        FaceDetector.send_to_node("debug", "Found {} face(s)".format(len(output_face_rects)))
 
         return output_face_rects
+
+    # Faces (x, y, width, height) without padding in coordinates of the source image
+    @staticmethod
+    def find_faces(source_image: numpy.ndarray, preprocessing=None) -> List[Tuple[int, int, int, int]]:
+        return FaceDetector.get_engine().find_faces(source_image, preprocessing)
+
+    # Expand the detected face boundaries to have more padding and include the whole head
+    # Or if the rectangle boundary falls outside the window cut it off at the edge
+    # padding is in percent, PADDING by default
+    # Returns left, top, right, bottom
+    @staticmethod
+    def pad_face(face: Tuple[int, int, int, int], source_image_width: int,
+                 source_image_height: int, padding: int = None) -> Tuple[int, int, int, int]:
+        x, y, w, h = face
+        if padding is None:
+            padding = FaceDetector.PADDING
+        width_padding = int(w * padding / 100)
+        height_padding = int(h * padding / 100)
+        x1 = max(x - width_padding, 0)
+        y1 = max(y - height_padding, 0)
+        x2 = min(x + w + width_padding, source_image_width)
+        y2 = min(y + h + height_padding, source_image_height)
+        return x1, y1, x2, y2
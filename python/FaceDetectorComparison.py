@@ -0,0 +1,64 @@
+import argparse
+import glob
+import json
+import os
+import time
+import cv2
+import numpy
+from FaceDetector import FaceDetector
+from FaceDetectorEngine import FaceDetectorEngine
+
+# Compares face detector engines on the same images: detection latency and amount of found faces.
+# Engines which cannot be created (e.g. missing model files) are reported and skipped.
+# Usage: python3 FaceDetectorComparison.py --images "recorded/*.jpg"
+#        python3 FaceDetectorComparison.py --engines haar_alt2 lbp --options '{"minNeighbors": 3}'
+# Without --images the validated images are used
+
+
+def compare(engine_names, options: dict, image_paths, repeat: int):
+    images = [(path, cv2.imread(path)) for path in image_paths]
+    images = [(path, image) for path, image in images if image is not None]
+    print("{} image(s)".format(len(images)))
+    print("{:>14} {:>10} {:>10} {:>10} {:>8} {:>12}".format("engine", "p50 ms", "p95 ms", "mean ms", "faces",
+                                                              "no face"))
+    for name in engine_names:
+        try:
+            engine = FaceDetectorEngine.create(name, options)
+        except RuntimeError as e:
+            print("{:>14} skipped: {}".format(name, e))
+            continue
+        latencies = []
+        faces = 0
+        images_without_face = 0
+        for _, image in images:
+            # the first call warms up the engine, it is not measured
+            found = engine.find_faces(image)
+            for _ in range(repeat):
+                started = time.perf_counter()
+                engine.find_faces(image)
+                latencies.append((time.perf_counter() - started) * 1000)
+            faces += len(found)
+            if not found:
+                images_without_face += 1
+        if not latencies:
+            continue
+        p50, p95 = numpy.percentile(latencies, [50, 95])
+        print("{:>14} {:10.2f} {:10.2f} {:10.2f} {:>8} {:>12}".format(name, p50, p95, numpy.mean(latencies), faces,
+                                                                       images_without_face))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency and detection counts of the face detector engines")
+    parser.add_argument("--images", help="glob of images, recursive ** is supported")
+    parser.add_argument("--engines", nargs="+", default=FaceDetectorEngine.NAMES, choices=FaceDetectorEngine.NAMES)
+    parser.add_argument("--options", default="{}", help="engine options as JSON, the same as faceDetectorOptions")
+    parser.add_argument("--repeat", type=int, default=3, help="measured detections per image")
+    args = parser.parse_args()
+    images_mask = os.path.abspath(args.images) if args.images else None
+    # Classifiers and validated images are relative to this folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    FaceDetector.send_to_node = lambda message_type, message: None
+    if images_mask is None:
+        from VideoFaceMatcher import VideoFaceMatcher
+        images_mask = VideoFaceMatcher.VALIDATED_IMAGES_MASK
+    compare(args.engines, json.loads(args.options), sorted(glob.glob(images_mask, recursive=True)), args.repeat)
@@ -0,0 +1,58 @@
+import abc
+import numpy
+from typing import List, Tuple
+
+
+# Finds faces (x, y, width, height) on BGR images. Engines are created by name with create().
+# Concrete engines: CascadeFaceDetectorEngine (Haar and LBP cascades), DnnFaceDetectorEngine (SSD)
+class FaceDetectorEngine(abc.ABC):
+    # Haar cascades with approx. FPS measured on Raspberry Pi 3 at 400 px width
+    HAAR_DEFAULT = "haar_default"   # approx. FPS: 1.07
+    HAAR_ALT = "haar_alt"           # approx. FPS: 0.81
+    HAAR_ALT2 = "haar_alt2"         # approx. FPS: 1.39
+    # LBP features are integer based and much cheaper on ARM, but less accurate
+    LBP = "lbp"
+    # OpenCV face detector (ResNet-10 SSD), needs the model files
+    DNN_SSD = "dnn_ssd"
+
+    NAMES = [HAAR_DEFAULT, HAAR_ALT, HAAR_ALT2, LBP, DNN_SSD]
+
+    # Faces in coordinates of the source image. preprocessing is an optional PreprocessingEngine
+    @abc.abstractmethod
+    def find_faces(self, source_image: numpy.ndarray, preprocessing=None) -> List[Tuple[int, int, int, int]]:
+        pass
+
+    # Faces in a region of the frame (coordinates of the region). The region is scaled by scale before
+    # the search, min_size and max_size are face sizes in the scaled region
+    @abc.abstractmethod
+    def find_faces_in_region(self, region_image: numpy.ndarray, scale: float, min_size: int,
+                             max_size: int) -> List[Tuple[int, int, int, int]]:
+        pass
+
+    # Everything which changes the found faces
+    @abc.abstractmethod
+    def settings(self) -> dict:
+        pass
+
+    # options are taken from the MagicMirror config (faceDetectorOptions), missing ones use FaceDetector defaults.
+    # Raises RuntimeError when the model file of the engine is missing
+    @staticmethod
+    def create(name: str, options: dict = None) -> 'FaceDetectorEngine':
+        options = options or {}
+        # Imported here to avoid circular import, engines take defaults from FaceDetector
+        from FaceDetector import FaceDetector
+        if name == FaceDetectorEngine.DNN_SSD:
+            from DnnFaceDetectorEngine import DnnFaceDetectorEngine
+            return DnnFaceDetectorEngine(options.get("prototxt", DnnFaceDetectorEngine.PROTOTXT),
+                                         options.get("model", DnnFaceDetectorEngine.MODEL),
+                                         options.get("confidence", DnnFaceDetectorEngine.CONFIDENCE),
+                                         options.get("inputSize", DnnFaceDetectorEngine.INPUT_SIZE),
+                                         tuple(options.get("minSize", FaceDetector.MIN_SIZE)))
+        from CascadeFaceDetectorEngine import CascadeFaceDetectorEngine
+        if name not in CascadeFaceDetectorEngine.CLASSIFIERS:
+            raise ValueError("Unknown face detector \"{}\"".format(name))
+        return CascadeFaceDetectorEngine(options.get("classifier", CascadeFaceDetectorEngine.CLASSIFIERS[name]),
+                                         options.get("scaleFactor", FaceDetector.SCALE_FACTOR),
+                                         options.get("minNeighbors", FaceDetector.MIN_NEIGHBORS),
+                                         tuple(options.get("minSize", FaceDetector.MIN_SIZE)),
+                                         FaceDetector.OPTIMIZED_WIDTH)
@@ -0,0 +1,141 @@
+import itertools
+import threading
+import time
+import numpy
+from typing import List, Tuple
+from FaceDetector import print_to_console
+from MatchedFace import MatchedFace
+
+
+# Face followed across frames. Keeps the embedding and the matched users of the last inference
+class FaceTrack:
+    def __init__(self, track_id: int, rect: Tuple[int, int, int, int]):
+        self.track_id = track_id
+        self.rect = rect
+        self.embedding = None
+        self.matched_faces = []
+        # rect, frame counter and time of the last inference
+        self.embedded_rect = None
+        self.frames_since_embedding = 0
+        self.embedded_at = 0.0
+        self.missed_frames = 0
+        self.frames = 0
+        self.cache_hits = 0
+        self.reverifications = 0
+
+
+# Associates face rects of consecutive frames by IoU, so a person standing in front of the mirror
+# is embedded only when the track is new, the face moved too much or the cached identity got too old.
+# In the pipelined mode the infer stage updates the tracks while the main thread stores identities,
+# every access to the tracks holds lock
+class FaceTracker:
+    # Minimal IoU of the rects from consecutive frames to be the same face
+    MATCH_IOU = 0.3
+    # Re-embed when IoU between the current rect and the rect used for the last inference is lower
+    DRIFT_IOU = 0.6
+    # Track is removed after it was not detected in this many frames
+    MAX_MISSED_FRAMES = 2
+
+    # Print to console from static methods by default
+    send_to_node = print_to_console
+
+    # max_frames and max_seconds limit how long the cached identity is trusted
+    def __init__(self, max_frames: int = 30, max_seconds: float = 5.0):
+        self.max_frames = max_frames
+        self.max_seconds = max_seconds
+        self.tracks = []
+        self.track_ids = itertools.count(1)
+        self.total_cache_hits = 0
+        self.total_reverifications = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def iou(rect1: Tuple[int, int, int, int], rect2: Tuple[int, int, int, int]) -> float:
+        left = max(rect1[0], rect2[0])
+        top = max(rect1[1], rect2[1])
+        right = min(rect1[2], rect2[2])
+        bottom = min(rect1[3], rect2[3])
+        intersection = max(right - left, 0) * max(bottom - top, 0)
+        union = (rect1[2] - rect1[0]) * (rect1[3] - rect1[1]) + (rect2[2] - rect2[0]) * (rect2[3] - rect2[1]) \
+            - intersection
+        return intersection / union if union > 0 else 0.0
+
+    # Returns the track of every face rect (in the same order). Pairs with the highest IoU are taken first
+    def update(self, face_rects: List[Tuple[int, int, int, int]]) -> List[FaceTrack]:
+        with self.lock:
+            return self._update(face_rects)
+
+    def _update(self, face_rects: List[Tuple[int, int, int, int]]) -> List[FaceTrack]:
+        pairs = sorted(((FaceTracker.iou(track.rect, rect), track_index, rect_index)
+                        for track_index, track in enumerate(self.tracks)
+                        for rect_index, rect in enumerate(face_rects)), reverse=True)
+        rect_tracks = [None] * len(face_rects)
+        used_tracks = set()
+        for iou, track_index, rect_index in pairs:
+            if iou < FaceTracker.MATCH_IOU:
+                break
+            if track_index in used_tracks or rect_tracks[rect_index] is not None:
+                continue
+            used_tracks.add(track_index)
+            rect_tracks[rect_index] = self.tracks[track_index]
+
+        for track_index, track in enumerate(self.tracks):
+            if track_index not in used_tracks:
+                track.missed_frames += 1
+        for track in self.tracks:
+            if track.missed_frames > FaceTracker.MAX_MISSED_FRAMES:
+                self._report_track(track)
+        self.tracks = [track for track in self.tracks if track.missed_frames <= FaceTracker.MAX_MISSED_FRAMES]
+
+        for rect_index, rect in enumerate(face_rects):
+            track = rect_tracks[rect_index]
+            if track is None:
+                track = FaceTrack(next(self.track_ids), rect)
+                self.tracks.append(track)
+                rect_tracks[rect_index] = track
+            track.rect = rect
+            track.missed_frames = 0
+            track.frames += 1
+            track.frames_since_embedding += 1
+        return rect_tracks
+
+    # Decides if the track needs a fresh inference. Counts cache hits otherwise
+    def needs_embedding(self, track: FaceTrack) -> bool:
+        with self.lock:
+            return self._needs_embedding(track)
+
+    def _needs_embedding(self, track: FaceTrack) -> bool:
+        if track.embedding is None:
+            return True
+        if track.frames_since_embedding > self.max_frames \
+                or time.time() - track.embedded_at > self.max_seconds \
+                or FaceTracker.iou(track.rect, track.embedded_rect) < FaceTracker.DRIFT_IOU:
+            track.reverifications += 1
+            self.total_reverifications += 1
+            return True
+        track.cache_hits += 1
+        self.total_cache_hits += 1
+        return False
+
+    # rect is the face rect the embedding was calculated for, the track may have moved on since then
+    def store(self, track: FaceTrack, embedding: numpy.ndarray, matched_faces: List[MatchedFace],
+              rect: Tuple[int, int, int, int] = None) -> None:
+        with self.lock:
+            track.embedding = embedding
+            track.matched_faces = matched_faces
+            track.embedded_rect = rect or track.rect
+            track.frames_since_embedding = 0
+            track.embedded_at = time.time()
+
+    def _report_track(self, track: FaceTrack) -> None:
+        FaceTracker.send_to_node("log", "Track {} ({}) ended after {} frames: {} cache hits, {} re-verifications"
+                                 .format(track.track_id, track.matched_faces, track.frames,
+                                         track.cache_hits, track.reverifications))
+
+    def report(self) -> None:
+        with self.lock:
+            tracks = list(self.tracks)
+        for track in tracks:
+            self._report_track(track)
+        FaceTracker.send_to_node("log", "Face tracker: {} cache hits, {} re-verifications"
+                                 .format(self.total_cache_hits, self.total_reverifications))
@@ -1,8 +1,12 @@
+# Imported first, it remembers when the process started
+from StartupTimeline import StartupTimeline
 import os
 import traceback
 import signal
 import sys
 from MMConfig import MMConfig
+from NodeChannel import NodeChannel
+from MultiCameraMatcher import MultiCameraMatcher
 from VideoFaceMatcherLoggedUser import VideoFaceMatcherLoggedUser as VideoFaceMatcher
 # from VideoFaceMatcherShowInWindow import VideoFaceMatcherShowInWindow as VideoFaceMatcher
 
@@ -11,15 +15,22 @@ from VideoFaceMatcherLoggedUser import VideoFaceMatcherLoggedUser as VideoFaceMa
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 MMConfig.to_node("log", "Changed current working dir to {}".format(os.getcwd()))
 
+# Messages are filtered by log level and batched, login/logout go out immediately
+channel = NodeChannel(MMConfig.get_log_level(), MMConfig.get_ipc_flush_interval())
+
+
 # message can be anything (strings or even object)
 def send_to_node(message_type: str, message):
-    MMConfig.to_node(message_type, message)
+    channel.send(message_type, message)
 
 try:
 
     MMConfig.to_node("log", "Facial recognition started...")
 
-    faceMatcher = VideoFaceMatcher(5000, send_to_node)
+    if MMConfig.get_camera_sources():
+        faceMatcher = MultiCameraMatcher(5000, send_to_node)
+    else:
+        faceMatcher = VideoFaceMatcher(5000, send_to_node)
     # faceMatcher = VideoFaceMatcher(send_to_node)
 
     def shutdown():
@@ -30,7 +41,11 @@ try:
 
     signal.signal(signal.SIGINT, shutdown)
 
-    faceMatcher.initialize()
+    faceMatcher.configure(MMConfig)
+    try:
+        faceMatcher.initialize()
+    finally:
+        channel.close()
 except:
     exc_type, exc_value, exc_traceback = sys.exc_info()
     MMConfig.to_node("log", "Unhandled exception: {}".format(traceback.format_exception(exc_type, exc_value, exc_traceback)))
@@ -28,6 +28,7 @@ try:
 
     signal.signal(signal.SIGINT, shutdown)
 
+    faceMatcher.configure(MMConfig)
     faceMatcher.initialize()
 except:
     exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -0,0 +1,161 @@
+import collections
+import threading
+import time
+import numpy
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+from FaceDetector import print_to_console
+from InferenceBackend import InferenceBackend
+
+
+# Face crops of one source waiting for the inference, the backend of every camera of MultiCameraMatcher.
+# Calls block until the scheduler served them. The shared backend is opened and closed by its owner
+class ScheduledInferenceBackend(InferenceBackend):
+    def __init__(self, scheduler: 'FairInferenceScheduler', source_id: str, budget: float):
+        self.scheduler = scheduler
+        self.source_id = source_id
+        self.budget = budget
+        # (face tensor, future, submission time)
+        self.pending = collections.deque()
+        # The source is over its budget until then
+        self.next_allowed = 0.0
+        self.frames = 0
+        self.faces = 0
+        self.waited = 0.0
+        self.max_waited = 0.0
+
+    def infer(self, face: numpy.ndarray) -> numpy.ndarray:
+        return self.infer_batch(face[numpy.newaxis])[0]
+
+    def infer_batch(self, face_tensor: numpy.ndarray) -> numpy.ndarray:
+        return self.scheduler.submit(self, face_tensor).result()
+
+    def model_hash(self) -> str:
+        return self.scheduler.backend.model_hash()
+
+
+# Multiplexes face crops of several cameras onto one inference backend (one NCS stick or device pool).
+# Crops are served in rounds by one thread: a round takes the oldest request of every waiting source once,
+# starting with the source after the last one served, and sends them to the backend as one batch. So a
+# camera with many faces cannot starve the others and the device gets fewer calls. budget limits frames
+# per second a source sends to the inference (0 - unlimited), a source over its budget is left out of
+# the rounds until its next frame is due
+class FairInferenceScheduler:
+    # Faces per backend call, a round stops taking sources when the next one does not fit.
+    # The first request of a round is always taken
+    MAX_BATCH = 8
+
+    # Print to console from static methods by default
+    send_to_node = print_to_console
+
+    def __init__(self, backend: InferenceBackend, max_batch: int = MAX_BATCH):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.clients = []
+        # The next round starts with this client
+        self.next_client = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.rounds = 0
+        self.batched_faces = 0
+
+    def client(self, source_id: str, budget: float = 0) -> ScheduledInferenceBackend:
+        client = ScheduledInferenceBackend(self, source_id, budget)
+        with self.condition:
+            self.clients.append(client)
+        return client
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._serve, name="inference-scheduler", daemon=True)
+        self.thread.start()
+
+    def submit(self, client: ScheduledInferenceBackend, face_tensor: numpy.ndarray) -> Future:
+        future = Future()
+        with self.condition:
+            if self.stopped:
+                future.set_exception(RuntimeError("Inference scheduler is stopped"))
+                return future
+            client.pending.append((face_tensor, future, time.time()))
+            self.condition.notify()
+        return future
+
+    # Requests of the next round and the seconds until a source over its budget is due (None - nothing waits)
+    def _next_round(self, now: float) -> Tuple[List[Tuple[ScheduledInferenceBackend, tuple]], Optional[float]]:
+        batch = []
+        faces = 0
+        due = None
+        for offset in range(len(self.clients)):
+            index = (self.next_client + offset) % len(self.clients)
+            client = self.clients[index]
+            if not client.pending:
+                continue
+            if client.next_allowed > now:
+                due = min(due, client.next_allowed - now) if due is not None else client.next_allowed - now
+                continue
+            face_tensor = client.pending[0][0]
+            if batch and faces + len(face_tensor) > self.max_batch:
+                break
+            batch.append((client, client.pending.popleft()))
+            faces += len(face_tensor)
+            if client.budget:
+                client.next_allowed = now + 1 / client.budget
+            self.next_client = index + 1
+        return batch, due
+
+    def _serve(self) -> None:
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopped:
+                        for client in self.clients:
+                            while client.pending:
+                                client.pending.popleft()[1].set_exception(
+                                    RuntimeError("Inference scheduler is stopped"))
+                        return
+                    batch, due = self._next_round(time.time())
+                    if batch:
+                        break
+                    self.condition.wait(due)
+            self._infer(batch)
+
+    # One backend call for the whole round, the embeddings are split back by source
+    def _infer(self, batch: List[Tuple[ScheduledInferenceBackend, tuple]]) -> None:
+        started = time.time()
+        for client, (face_tensor, _, submitted) in batch:
+            client.frames += 1
+            client.faces += len(face_tensor)
+            client.waited += started - submitted
+            client.max_waited = max(client.max_waited, started - submitted)
+        self.rounds += 1
+        self.batched_faces += sum(len(face_tensor) for _, (face_tensor, _, _) in batch)
+        try:
+            test_outputs = self.backend.infer_batch(numpy.concatenate([face_tensor for _, (face_tensor, _, _)
+                                                                       in batch]))
+        except Exception as e:
+            for _, (_, future, _) in batch:
+                future.set_exception(e)
+            return
+        position = 0
+        for _, (face_tensor, future, _) in batch:
+            future.set_result(test_outputs[position:position + len(face_tensor)])
+            position += len(face_tensor)
+
+    def stop(self) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def report(self) -> None:
+        faces_per_call = self.batched_faces / self.rounds if self.rounds else 0
+        FairInferenceScheduler.send_to_node("log", "Inference scheduler: {} backend calls, {:.2f} faces per call"
+                                            .format(self.rounds, faces_per_call))
+        for client in self.clients:
+            FairInferenceScheduler.send_to_node("log", "Source {}: {} frames ({} faces) inferred, waited {:.1f} ms "
+                                                       "on average, {:.1f} ms max, budget {}".format(
+                client.source_id, client.frames, client.faces,
+                client.waited / client.frames * 1000 if client.frames else 0, client.max_waited * 1000,
+                "{} FPS".format(client.budget) if client.budget else "unlimited"))
@@ -0,0 +1,25 @@
+import hashlib
+import time
+import numpy
+from InferenceBackend import InferenceBackend
+
+
+# Deterministic embeddings derived from the hash of the face pixels. The same image always gets
+# the same embedding, different images get different ones. For tests and benchmarks without NCS stick
+class FakeInferenceBackend(InferenceBackend):
+    # The same size as FaceNet output
+    EMBEDDING_SIZE = 128
+
+    # latency simulates the time the device spends on one face, seconds
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def infer(self, face: numpy.ndarray) -> numpy.ndarray:
+        if self.latency:
+            time.sleep(self.latency)
+        # float16 rounding keeps the same hash for values the real device would not distinguish anyway
+        digest = hashlib.sha1(numpy.ascontiguousarray(face, dtype=numpy.float16).tobytes()).digest()
+        rnd = numpy.random.default_rng(int.from_bytes(digest[:8], "little"))
+        embedding = rnd.standard_normal(FakeInferenceBackend.EMBEDDING_SIZE).astype(numpy.float32)
+        # FaceNet embeddings are L2 normalized
+        return embedding / numpy.linalg.norm(embedding)
@@ -0,0 +1,227 @@
+import collections
+import threading
+import time
+import numpy
+from typing import Callable, List, Optional, Tuple
+from FaceDetector import print_to_console
+
+
+# Camera frame travelling through the pipeline stages. Every stage fills its own fields
+class Frame:
+    def __init__(self, sequence: int, image: numpy.ndarray):
+        self.sequence = sequence
+        self.timestamp = time.time()
+        self.image = image
+        self.face_rects = []
+        self.test_outputs = None
+        # Indexes of faces sent to inference. Filled when FaceTracker is used: track of every face rect
+        self.embed_indexes = []
+        self.tracks = []
+        # Future of the face rects while they are calculated by DetectionPool
+        self.detection = None
+        # The inference was skipped, identities of the last re-verification are reused (ReverificationSchedule)
+        self.reused_identity = False
+
+
+# Bounded queue which never blocks the producer. When it is full the oldest item is dropped,
+# so a slow stage always receives the most recent frame instead of a backlog of stale ones
+class DropOldestQueue:
+    def __init__(self, max_size: int):
+        self.items = collections.deque(maxlen=max_size)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item) -> None:
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify_all()
+
+    # Returns None when the queue was closed or nothing arrived during timeout
+    def get(self, timeout: float = None):
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            # wake up producer waiting in wait_empty
+            self.condition.notify_all()
+            return item
+
+    # Returns False if the queue still has items after timeout
+    def wait_empty(self, timeout: float = None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.items or self.closed, timeout)
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+# Timings of the stages and end-to-end latency of the frames. Used by both serial and pipelined loops
+class PipelineStats:
+    # Amount of the latest latencies used for percentiles
+    WINDOW = 1000
+
+    def __init__(self):
+        self.started = time.time()
+        self.stage_names = []
+        self.processed = {}
+        self.busy = {}
+        self.dropped = {}
+        self.latencies = collections.deque(maxlen=PipelineStats.WINDOW)
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            if stage not in self.processed:
+                self.stage_names.append(stage)
+                self.processed[stage] = 0
+                self.busy[stage] = 0.0
+            self.processed[stage] += 1
+            self.busy[stage] += seconds
+
+    def record_latency(self, frame: Frame) -> None:
+        with self.lock:
+            self.latencies.append(time.time() - frame.timestamp)
+
+    def set_dropped(self, stage: str, dropped: int) -> None:
+        with self.lock:
+            self.dropped[stage] = dropped
+
+    def report(self, send_to_node) -> None:
+        with self.lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            for stage in self.stage_names:
+                processed = self.processed[stage]
+                send_to_node("log", "Stage {}: {:.2f} frames/s, {:.1f} ms/frame, busy {:.0f}%, dropped {}".format(
+                    stage, processed / elapsed, self.busy[stage] / processed * 1000,
+                    self.busy[stage] / elapsed * 100, self.dropped.get(stage, 0)))
+            if self.latencies:
+                p50, p95 = numpy.percentile(self.latencies, [50, 95]) * 1000
+                send_to_node("log", "End-to-end latency: p50 {:.1f} ms, p95 {:.1f} ms".format(p50, p95))
+
+
+# Runs capture -> worker stages -> sink, every stage in its own thread connected by DropOldestQueue.
+# While one stage is busy with frame N the previous stage is already processing frame N+1.
+# The sink runs in the calling thread because some renderers (cv2.imshow) work only in the main thread
+class FramePipeline:
+    QUEUE_SIZE = 2
+    # How often stage statistics are sent to node, seconds
+    REPORT_INTERVAL = 60
+
+    # Print to console from static methods by default
+    send_to_node = print_to_console
+
+    # read_frame returns the next camera image or None
+    # stages is a list of (name, function(frame)) executed in order
+    # sink is called with every frame which passed all stages
+    # frame_delay(processing) returns the pause before the next capture, processing is the time the latest
+    # finished frame spent from capture to sink (pauses are not included, so the delay does not feed back
+    # on itself). None - frames are captured as fast as the detection takes them
+    def __init__(self, read_frame: Callable[[], Optional[numpy.ndarray]],
+                 stages: List[Tuple[str, Callable[[Frame], None]]],
+                 sink: Tuple[str, Callable[[Frame], None]], frame_delay: Callable[[float], float] = None):
+        self.read_frame = read_frame
+        self.stages = stages
+        self.sink = sink
+        self.frame_delay = frame_delay
+        self.queues = [DropOldestQueue(FramePipeline.QUEUE_SIZE) for _ in range(len(stages) + 1)]
+        self.stats = PipelineStats()
+        self.stopped = threading.Event()
+        # Exception of the capture or a stage thread, run() stops the pipeline and raises it
+        self.error = None
+        # Capture to sink time of the latest finished frame, seconds
+        self.last_processing = 0.0
+
+    # Capture and stage threads stop the whole pipeline when they fail, otherwise the sink would wait
+    # for frames forever
+    def _fail(self, error: BaseException) -> None:
+        if self.error is None:
+            self.error = error
+        self.stopped.set()
+
+    # Camera stream returns the latest image immediately, so the next image is read only when
+    # the detection stage took the previous one. Otherwise capture would spin and steal CPU from other stages
+    def _capture(self) -> None:
+        sequence = 0
+        try:
+            while not self.stopped.is_set():
+                if not self.queues[0].wait_empty(timeout=0.5):
+                    continue
+                if self.frame_delay is not None and self.stopped.wait(self.frame_delay(self.last_processing)):
+                    break
+                started = time.time()
+                image = self.read_frame()
+                if image is not None:
+                    sequence += 1
+                    self.queues[0].put(Frame(sequence, image))
+                    self.stats.record("capture", time.time() - started)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self.queues[0].close()
+
+    def _run_stage(self, index: int) -> None:
+        name, func = self.stages[index]
+        input_queue = self.queues[index]
+        output_queue = self.queues[index + 1]
+        try:
+            while True:
+                frame = input_queue.get()
+                if frame is None:
+                    break
+                started = time.time()
+                func(frame)
+                self.stats.record(name, time.time() - started)
+                output_queue.put(frame)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            output_queue.close()
+
+    def _run_sink(self, should_stop: Callable[[], bool]) -> None:
+        name, func = self.sink
+        last_report = time.time()
+        while not should_stop() and self.error is None:
+            frame = self.queues[-1].get(timeout=0.5)
+            if frame is not None:
+                started = time.time()
+                func(frame)
+                self.stats.record(name, time.time() - started)
+                self.stats.record_latency(frame)
+                self.last_processing = time.time() - frame.timestamp
+            if time.time() - last_report > FramePipeline.REPORT_INTERVAL:
+                self.report()
+                last_report = time.time()
+
+    def report(self) -> None:
+        stage_names = [name for name, _ in self.stages] + [self.sink[0]]
+        for name, queue in zip(stage_names, self.queues):
+            self.stats.set_dropped(name, queue.dropped)
+        self.stats.report(FramePipeline.send_to_node)
+
+    # Blocks until should_stop() returns True. An exception of any stage stops the pipeline and is raised here
+    def run(self, should_stop: Callable[[], bool]) -> PipelineStats:
+        threads = [threading.Thread(target=self._capture, name="capture", daemon=True)]
+        threads += [threading.Thread(target=self._run_stage, args=(i,), name=name, daemon=True)
+                    for i, (name, _) in enumerate(self.stages)]
+        for thread in threads:
+            thread.start()
+        try:
+            self._run_sink(should_stop)
+        finally:
+            self.stopped.set()
+            for queue in self.queues:
+                queue.close()
+            for thread in threads:
+                thread.join()
+            self.report()
+        if self.error is not None:
+            FramePipeline.send_to_node("log", "Pipeline stopped: {}".format(self.error))
+            raise self.error
+        return self.stats
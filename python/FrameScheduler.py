@@ -0,0 +1,58 @@
+import abc
+import time
+
+
+# Decides how long to wait before the next camera frame
+class FrameScheduler(abc.ABC):
+    FIXED = "fixed"
+    ADAPTIVE = "adaptive"
+
+    # Called after every processed frame with what was seen on it
+    def notify(self, face_present: bool, login_pending: bool) -> None:
+        return
+
+    # elapsed is the time already spent on the current frame, seconds
+    @abc.abstractmethod
+    def next_delay(self, elapsed: float) -> float:
+        pass
+
+    def wait(self, elapsed: float) -> None:
+        delay = self.next_delay(elapsed)
+        if delay > 0:
+            time.sleep(delay)
+
+
+# The original behaviour: the same pause after every frame regardless of the processing time
+class FixedRateScheduler(FrameScheduler):
+    INTERVAL = 0.2
+
+    def __init__(self, interval: float = INTERVAL):
+        self.interval = interval
+
+    def next_delay(self, elapsed: float) -> float:
+        return self.interval
+
+
+# Keeps the frame period at interval (processing time included) while a face is present or a login
+# is pending, slows down to idle_interval when no face was seen for idle_after seconds.
+# cpu_cap (0..1] limits the share of time spent on processing, e.g. 0.5 - at least as long pause as processing
+class AdaptiveScheduler(FrameScheduler):
+    def __init__(self, interval: float, idle_interval: float, idle_after: float, cpu_cap: float = 1.0):
+        self.interval = interval
+        self.idle_interval = max(idle_interval, interval)
+        self.idle_after = idle_after
+        self.cpu_cap = min(max(cpu_cap, 0.01), 1.0)
+        self.last_activity = time.time()
+
+    def notify(self, face_present: bool, login_pending: bool) -> None:
+        if face_present or login_pending:
+            self.last_activity = time.time()
+
+    def is_idle(self) -> bool:
+        return time.time() - self.last_activity > self.idle_after
+
+    def next_delay(self, elapsed: float) -> float:
+        period = self.idle_interval if self.is_idle() else self.interval
+        delay = max(period - elapsed, 0.0)
+        # processing / (processing + delay) <= cpu_cap
+        return max(delay, elapsed * (1 / self.cpu_cap - 1))
@@ -0,0 +1,287 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import cv2
+import numpy
+from typing import Dict, List, Optional, Tuple
+from CentroidGalleryIndex import CentroidGalleryIndex
+from EmbeddingCache import EmbeddingCache
+from FaceDetector import FaceDetector, print_to_console
+from GalleryIndex import GalleryIndex
+from InferenceBackend import InferenceBackend
+from IvfGalleryIndex import IvfGalleryIndex
+from ValidatedImage import ValidatedImage
+
+# Enrollment command which compacts the gallery of validated images. Photos are decoded, searched for
+# the face and preprocessed in a process pool, then embedded in batches. Near-duplicate photos of a user
+# (closer than epsilon) are dropped and at most `prototypes` representative photos are kept per user:
+# the photos closest to the k-means cluster centers of the user. With --centroids the mean of all photos
+# of the user is stored as well and the recognizer skips users whose centroid is too far (CentroidGalleryIndex).
+# The recognizer loads the written file instead of the validated images when compactGallery is set.
+# Every HOLDOUT_EVERY-th photo is held out first, to report how the accuracy changed
+# Usage: python3 GalleryCompactor.py --backend ncs --prototypes 5 --epsilon 0.1 --centroids
+
+
+class GalleryCompactor:
+    OUTPUT = "validated_images/compact_gallery.npz"
+    VERSION = 2
+    PROTOTYPES = 5
+    # Squared distance, a quarter of FACE_MATCH_THRESHOLD
+    EPSILON = 0.1
+    HOLDOUT_EVERY = 5
+    # Faces sent to the inference backend in one infer_batch call
+    BATCH_SIZE = 16
+
+    # Print to console from static methods by default
+    send_to_node = print_to_console
+
+    def __init__(self, prototypes: int = PROTOTYPES, epsilon: float = EPSILON, centroids: bool = False,
+                 seed: int = 0):
+        self.prototypes = prototypes
+        self.epsilon = epsilon
+        self.centroids = centroids
+        self.rnd = numpy.random.default_rng(seed)
+
+    # Workers must not print, stdout of the python process is the channel to node
+    @staticmethod
+    def init_worker(engine_name: str, engine_options: dict, tuning: dict) -> None:
+        FaceDetector.send_to_node = lambda message_type, message: None
+        FaceDetector.configure(engine_name, engine_options)
+        FaceDetector.apply_tuning(tuning)
+
+    # The same face crop as VideoFaceMatcher.run_inference sends to the device for a validated image
+    @staticmethod
+    def preprocess_image(path: str) -> Optional[numpy.ndarray]:
+        from VideoFaceMatcher import VideoFaceMatcher
+        image = cv2.imread(path)
+        if image is None:
+            return None
+        return VideoFaceMatcher.preprocess_image(image)[0].astype(numpy.float16)
+
+    # Fills inference of every validated image, unreadable images keep None
+    def embed(self, validated_images: List[ValidatedImage], backend: InferenceBackend, workers: int = None) -> None:
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=GalleryCompactor.init_worker,
+                initargs=(FaceDetector.ENGINE_NAME, FaceDetector.ENGINE_OPTIONS, FaceDetector.tuning())) as pool:
+            tensors = pool.map(GalleryCompactor.preprocess_image, [img.image_path for img in validated_images],
+                               chunksize=4)
+            batch = []
+            for img, tensor in zip(validated_images, tensors):
+                if tensor is None:
+                    GalleryCompactor.send_to_node("log", "Cannot read {}".format(img.image_path))
+                    continue
+                batch.append((img, tensor))
+                if len(batch) == GalleryCompactor.BATCH_SIZE:
+                    GalleryCompactor.infer_batch(batch, backend)
+                    batch = []
+            if batch:
+                GalleryCompactor.infer_batch(batch, backend)
+
+    @staticmethod
+    def infer_batch(batch: List[Tuple[ValidatedImage, numpy.ndarray]], backend: InferenceBackend) -> None:
+        outputs = backend.infer_batch(numpy.stack([tensor for _, tensor in batch]))
+        for (img, _), output in zip(batch, outputs):
+            img.inference = output
+
+    # Rows which are not closer than epsilon to an already kept row, in the original order
+    def deduplicate(self, embeddings: numpy.ndarray) -> List[int]:
+        kept = []
+        for row, embedding in enumerate(embeddings):
+            if kept:
+                diff = embeddings[kept] - embedding
+                if numpy.min(numpy.einsum("ij,ij->i", diff, diff)) < self.epsilon:
+                    continue
+            kept.append(row)
+        return kept
+
+    # Representative rows of one user: near duplicates are dropped, the rest is clustered by k-means
+    # into `prototypes` clusters and the row closest to every cluster center is kept (a real photo, not a mean)
+    def select_prototypes(self, embeddings: numpy.ndarray) -> List[int]:
+        unique = self.deduplicate(embeddings)
+        if len(unique) <= self.prototypes:
+            return unique
+        data = embeddings[unique]
+        centers, assignment = IvfGalleryIndex.kmeans(data, self.prototypes, self.rnd)
+        selected = set()
+        for cluster, center in enumerate(centers):
+            members = numpy.flatnonzero(assignment == cluster)
+            if not len(members):
+                continue
+            diff = data[members] - center
+            selected.add(unique[members[numpy.argmin(numpy.einsum("ij,ij->i", diff, diff))]])
+        return sorted(selected)
+
+    # Returns user logins and embeddings of the prototypes and {user_login: centroid of all photos}
+    def compact(self, validated_images: List[ValidatedImage]) -> Tuple[List[str], numpy.ndarray, Dict]:
+        by_user = {}
+        for img in validated_images:
+            if img.inference is not None:
+                embedding = numpy.asarray(img.inference, dtype=numpy.float32).ravel()
+                by_user.setdefault(img.user_login, []).append(embedding)
+        user_logins = []
+        rows = []
+        centroids = {}
+        for user_login, user_embeddings in by_user.items():
+            embeddings = numpy.stack(user_embeddings)
+            for row in self.select_prototypes(embeddings):
+                user_logins.append(user_login)
+                rows.append(embeddings[row])
+            if self.centroids:
+                centroids[user_login] = embeddings.mean(axis=0)
+        return user_logins, numpy.stack(rows) if rows else numpy.empty((0, 0), dtype=numpy.float32), centroids
+
+    @staticmethod
+    def settings_hash(settings: dict) -> str:
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+    # Identifies the set of validated images: (path, content hash) of every photo. A photo which was added,
+    # deleted, changed or moved to another user changes it
+    @staticmethod
+    def photos_hash(validated_images: List[ValidatedImage]) -> str:
+        photos = sorted((os.path.normpath(img.image_path), EmbeddingCache.file_hash(img.image_path))
+                        for img in validated_images)
+        return hashlib.sha1(json.dumps(photos).encode("utf-8")).hexdigest()
+
+    # settings are VideoFaceMatcher.embedding_settings, the recognizer ignores a gallery of another model.
+    # validated_images are the photos the gallery was made of
+    @staticmethod
+    def save(path: str, user_logins: List[str], embeddings: numpy.ndarray, centroids: Dict, settings: dict,
+             validated_images: List[ValidatedImage]) -> None:
+        centroid_logins = sorted(centroids)
+        with open(path + ".tmp", mode="wb") as f:
+            numpy.savez(f, version=GalleryCompactor.VERSION, settings=GalleryCompactor.settings_hash(settings),
+                        photos=GalleryCompactor.photos_hash(validated_images),
+                        user_logins=numpy.array(user_logins, dtype=str), embeddings=embeddings,
+                        centroid_logins=numpy.array(centroid_logins, dtype=str),
+                        centroids=numpy.array([centroids[user_login] for user_login in centroid_logins],
+                                              dtype=numpy.float32))
+        os.replace(path + ".tmp", path)
+
+    # Returns None when the file is missing, broken, made with other settings or of other photos than
+    # validated_images (a user was added or deleted since). index_class and index_options are used when
+    # the file has no centroids
+    @staticmethod
+    def load(path: str, validated_images: List[ValidatedImage], settings: dict, match_threshold: float,
+             index_class=GalleryIndex, index_options: dict = None) -> Optional[GalleryIndex]:
+        if not os.path.isfile(path):
+            GalleryCompactor.send_to_node("log", "Compacted gallery {} does not exist".format(path))
+            return None
+        try:
+            with numpy.load(path) as data:
+                if int(data["version"]) != GalleryCompactor.VERSION \
+                        or str(data["settings"]) != GalleryCompactor.settings_hash(settings):
+                    GalleryCompactor.send_to_node("log", "Compacted gallery {} was made with other settings, "
+                                                         "run GalleryCompactor.py again".format(path))
+                    return None
+                if str(data["photos"]) != GalleryCompactor.photos_hash(validated_images):
+                    GalleryCompactor.send_to_node("log", "Validated images changed since {} was made, the full "
+                                                         "gallery is used. Run GalleryCompactor.py again".format(path))
+                    return None
+                user_logins = [str(user_login) for user_login in data["user_logins"]]
+                embeddings = data["embeddings"]
+                centroids = {str(user_login): centroid
+                             for user_login, centroid in zip(data["centroid_logins"], data["centroids"])}
+        except (OSError, ValueError, KeyError) as e:
+            GalleryCompactor.send_to_node("log", "Compacted gallery {} is ignored: {}".format(path, e))
+            return None
+        GalleryCompactor.send_to_node("log", "Compacted gallery: {} prototypes of {} users".format(
+            len(user_logins), len(set(user_logins))))
+        if centroids:
+            return CentroidGalleryIndex(user_logins, embeddings, match_threshold, centroids)
+        return index_class(user_logins, embeddings, **(index_options or {}))
+
+    # Every HOLDOUT_EVERY-th photo of users with several photos, starting with the second one
+    @staticmethod
+    def split_holdout(validated_images: List[ValidatedImage]) -> Tuple[List[ValidatedImage], List[ValidatedImage]]:
+        train = []
+        holdout = []
+        seen = {}
+        for img in validated_images:
+            index = seen.get(img.user_login, 0)
+            seen[img.user_login] = index + 1
+            (holdout if index % GalleryCompactor.HOLDOUT_EVERY == 1 else train).append(img)
+        return train, holdout
+
+    # Share of held-out photos matched to their own user, to somebody else and to nobody
+    @staticmethod
+    def evaluate(gallery: GalleryIndex, holdout: List[ValidatedImage], match_threshold: float) -> dict:
+        images = [img for img in holdout if img.inference is not None]
+        correct = wrong = 0
+        if images and len(gallery):
+            probes = numpy.stack([numpy.asarray(img.inference, dtype=numpy.float32).ravel() for img in images])
+            for img, distances in zip(images, gallery.min_distances_batch(probes)):
+                matched = [(distance, user_login) for user_login, distance in distances.items()
+                           if distance <= match_threshold]
+                if matched:
+                    if min(matched)[1] == img.user_login:
+                        correct += 1
+                    else:
+                        wrong += 1
+        total = max(len(images), 1)
+        return {"photos": len(images), "correct": correct / total, "wrong": wrong / total,
+                "rejected": (len(images) - correct - wrong) / total}
+
+    def build_index(self, validated_images: List[ValidatedImage], match_threshold: float) -> GalleryIndex:
+        user_logins, embeddings, centroids = self.compact(validated_images)
+        if centroids:
+            return CentroidGalleryIndex(user_logins, embeddings, match_threshold, centroids)
+        return GalleryIndex(user_logins, embeddings)
+
+    # Comparisons of one face with the gallery: rows plus the centroids of the prefilter
+    @staticmethod
+    def comparisons_per_face(gallery: GalleryIndex) -> float:
+        if isinstance(gallery, CentroidGalleryIndex) and gallery.probes:
+            return gallery.compared_rows / gallery.probes + len(gallery.users)
+        return len(gallery)
+
+    def run(self, backend: InferenceBackend, output_path: str, workers: int = None) -> None:
+        from VideoFaceMatcher import VideoFaceMatcher
+        threshold = VideoFaceMatcher.FACE_MATCH_THRESHOLD
+        validated_images = VideoFaceMatcher.load_validated_image_list()
+        self.embed(validated_images, backend, workers)
+
+        train, holdout = GalleryCompactor.split_holdout(validated_images)
+        full_gallery = GalleryIndex.from_validated_images(train)
+        compact_gallery = self.build_index(train, threshold)
+        full_accuracy = GalleryCompactor.evaluate(full_gallery, holdout, threshold)
+        compact_accuracy = GalleryCompactor.evaluate(compact_gallery, holdout, threshold)
+        print("Held-out photos: {}".format(full_accuracy["photos"]))
+        print("{:>10} {:>8} {:>12} {:>8} {:>8} {:>8}".format("gallery", "rows", "comparisons", "correct",
+                                                              "wrong", "rejected"))
+        for name, gallery, accuracy in (("full", full_gallery, full_accuracy),
+                                        ("compact", compact_gallery, compact_accuracy)):
+            print("{:>10} {:8d} {:12.1f} {:8.3f} {:8.3f} {:8.3f}".format(
+                name, len(gallery), GalleryCompactor.comparisons_per_face(gallery), accuracy["correct"],
+                accuracy["wrong"], accuracy["rejected"]))
+
+        # The written gallery is made of all photos, the held-out ones included
+        user_logins, embeddings, centroids = self.compact(validated_images)
+        embedded = sum(1 for img in validated_images if img.inference is not None)
+        GalleryCompactor.save(output_path, user_logins, embeddings, centroids,
+                              VideoFaceMatcher.embedding_settings(backend.model_hash()), validated_images)
+        print("{} photos of {} users compacted to {} prototypes ({} comparisons per face saved), written to {}"
+              .format(embedded, len(set(user_logins)), len(user_logins), embedded - len(user_logins), output_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact the gallery of validated images to prototypes")
+    parser.add_argument("--output", default=GalleryCompactor.OUTPUT, help="compacted gallery file (.npz)")
+    parser.add_argument("--backend", default=InferenceBackend.NCS, help="ncs, cv_dnn or fake")
+    parser.add_argument("--backend-options", default="{}", help="backend options as JSON")
+    parser.add_argument("--prototypes", type=int, default=GalleryCompactor.PROTOTYPES, help="photos kept per user")
+    parser.add_argument("--epsilon", type=float, default=GalleryCompactor.EPSILON,
+                        help="squared distance below which photos are duplicates")
+    parser.add_argument("--centroids", action="store_true", help="store user centroids for the prefilter")
+    parser.add_argument("--workers", type=int, help="decode and detection processes, CPU count by default")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    # Classifier, models and validated images are relative to this folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    inference_backend = InferenceBackend.create(args.backend, json.loads(args.backend_options))
+    inference_backend.open()
+    try:
+        GalleryCompactor(args.prototypes, args.epsilon, args.centroids).run(inference_backend, output, args.workers)
+    finally:
+        inference_backend.close()
@@ -0,0 +1,82 @@
+import numpy
+from typing import Dict, List
+from ValidatedImage import ValidatedImage
+
+
+# Keeps embeddings of all validated images in one contiguous matrix together with a parallel
+# array of user ids. Rows are grouped by user (in order of the first appearance), so the per-user
+# minimum distance is calculated by a single numpy.minimum.reduceat call instead of a python loop.
+class GalleryIndex:
+    # Distance reported when embeddings cannot be compared (the same value the old loop used)
+    NO_MATCH_DISTANCE = 100
+
+    def __init__(self, user_logins: List[str], embeddings: numpy.ndarray):
+        embeddings = numpy.asarray(embeddings, dtype=numpy.float32)
+        if embeddings.ndim != 2:
+            embeddings = embeddings.reshape(len(user_logins), -1)
+
+        # user id is the order of the first appearance of the login
+        self.users = []
+        user_id_by_login = {}
+        row_user_ids = numpy.empty(len(user_logins), dtype=numpy.int32)
+        for row, user_login in enumerate(user_logins):
+            if user_login not in user_id_by_login:
+                user_id_by_login[user_login] = len(self.users)
+                self.users.append(user_login)
+            row_user_ids[row] = user_id_by_login[user_login]
+
+        # Stable sort keeps the original order of images inside every user group
+        order = numpy.argsort(row_user_ids, kind="stable")
+        self.user_ids = row_user_ids[order]
+        self.embeddings = numpy.ascontiguousarray(embeddings[order])
+        # ||g||^2 is the same for every probe, calculate it once
+        self.squared_norms = numpy.einsum("ij,ij->i", self.embeddings, self.embeddings)
+        # Index of the first row of every user, required by reduceat
+        self.segment_starts = numpy.searchsorted(self.user_ids, numpy.arange(len(self.users)))
+
+    # options are passed to the constructor of the subclass (e.g. IvfGalleryIndex)
+    @classmethod
+    def from_validated_images(cls, validated_images: List[ValidatedImage], **options) -> 'GalleryIndex':
+        images = [img for img in validated_images if img.inference is not None]
+        if not images:
+            return cls([], numpy.empty((0, 0), dtype=numpy.float32), **options)
+        embeddings = numpy.stack([numpy.asarray(img.inference, dtype=numpy.float32).ravel() for img in images])
+        return cls([img.user_login for img in images], embeddings, **options)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @property
+    def dimension(self) -> int:
+        return self.embeddings.shape[1]
+
+    # Squared euclidean distances between every probe and every gallery row, shape (probes, gallery).
+    # Uses ||g - p||^2 = ||g||^2 - 2 g.p + ||p||^2 so the heavy part is one matrix multiplication
+    def squared_distances(self, probes: numpy.ndarray) -> numpy.ndarray:
+        probes = numpy.asarray(probes, dtype=numpy.float32).reshape(-1, self.dimension)
+        probe_norms = numpy.einsum("ij,ij->i", probes, probes)
+        distances = probes @ self.embeddings.T
+        distances *= -2
+        distances += self.squared_norms[numpy.newaxis, :]
+        distances += probe_norms[:, numpy.newaxis]
+        # Rounding errors can make distance of the same vectors slightly negative
+        return numpy.maximum(distances, 0, out=distances)
+
+    # Minimum distance per user for every probe, shape (probes, users). Columns follow self.users
+    def user_min_distances(self, probes: numpy.ndarray) -> numpy.ndarray:
+        distances = self.squared_distances(probes)
+        return numpy.minimum.reduceat(distances, self.segment_starts, axis=1)
+
+    # The same result as the old faces_match loop: {user_login: min distance}
+    def min_distances(self, test_output: numpy.ndarray) -> Dict[str, float]:
+        return self.min_distances_batch(numpy.reshape(test_output, (1, -1)))[0]
+
+    # {user_login: min distance} for every row of test_outputs, all probes are compared in one call
+    def min_distances_batch(self, test_outputs: numpy.ndarray) -> List[Dict[str, float]]:
+        if not self.users:
+            return [{} for _ in range(len(test_outputs))]
+        if numpy.shape(test_outputs)[1] != self.dimension:
+            return [{user_login: GalleryIndex.NO_MATCH_DISTANCE for user_login in self.users}
+                    for _ in range(len(test_outputs))]
+        return [{user_login: float(distance) for user_login, distance in zip(self.users, user_distances)}
+                for user_distances in self.user_min_distances(test_outputs)]
@@ -0,0 +1,65 @@
+import argparse
+import time
+import numpy
+from GalleryIndex import GalleryIndex
+
+# Scales how the gallery matching cost grows with the number of validated images.
+# Compares the old per-element python loop with the vectorized GalleryIndex.
+# Usage: python3 GalleryIndexBenchmark.py --sizes 10 100 1000 10000 100000
+
+# FaceNet (facenet_celeb_ncs.graph) returns 128 floats
+EMBEDDING_SIZE = 128
+# Typical amount of photos per user in validated_images
+IMAGES_PER_USER = 10
+# The old loop needs seconds for big galleries, it is skipped above this size
+LEGACY_MAX_SIZE = 2000
+
+
+# Copy of the matching loop which was used before GalleryIndex
+def legacy_faces_match(user_logins, embeddings, test_output):
+    user_distances = {}
+    for user_login, inference in zip(user_logins, embeddings):
+        total_diff = 0
+        for output_index in range(0, len(inference)):
+            total_diff += numpy.square(inference[output_index] - test_output[output_index])
+        if user_login not in user_distances:
+            user_distances[user_login] = 100
+        if total_diff < user_distances[user_login]:
+            user_distances[user_login] = total_diff
+    return user_distances
+
+
+def measure(func, repeat: int) -> float:
+    func()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def run(sizes, repeat: int):
+    rnd = numpy.random.default_rng(0)
+    print("{:>8} {:>8} {:>12} {:>12} {:>10}".format("images", "users", "legacy ms", "vector ms", "speedup"))
+    for size in sizes:
+        embeddings = rnd.standard_normal((size, EMBEDDING_SIZE)).astype(numpy.float16)
+        user_logins = ["user{}".format(i // IMAGES_PER_USER) for i in range(size)]
+        test_output = rnd.standard_normal(EMBEDDING_SIZE).astype(numpy.float16)
+
+        gallery = GalleryIndex(user_logins, embeddings)
+        vector_ms = measure(lambda: gallery.min_distances(test_output), repeat)
+        if size <= LEGACY_MAX_SIZE:
+            legacy_ms = measure(lambda: legacy_faces_match(user_logins, embeddings, test_output), 1)
+            legacy = "{:12.3f}".format(legacy_ms)
+            speedup = "{:9.1f}x".format(legacy_ms / vector_ms)
+        else:
+            legacy = "{:>12}".format("-")
+            speedup = "{:>10}".format("-")
+        print("{:>8} {:>8} {} {:12.3f} {}".format(size, len(gallery.users), legacy, vector_ms, speedup))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the gallery matching")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
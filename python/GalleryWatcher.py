@@ -0,0 +1,116 @@
+import glob
+import os
+import threading
+import time
+from typing import Callable, Dict, Tuple
+from FaceDetector import print_to_console
+from GalleryIndex import GalleryIndex
+
+
+# Watches validated_images/<user>/ and rebuilds the gallery in a background thread when photos are added,
+# changed or deleted. Uses inotify when inotify_simple is installed, polls mtimes otherwise.
+# build_gallery embeds only new or changed photos (EmbeddingCache), on_change receives the new gallery
+# and swaps it with a single assignment, so the camera loop never waits for the rebuild
+class GalleryWatcher:
+    POLL_INTERVAL = 5.0
+    # Copying a photo takes a moment, changes are collected for this long before the rebuild
+    SETTLE_TIME = 1.0
+
+    # Print to console from static methods by default
+    send_to_node = print_to_console
+
+    def __init__(self, images_dir: str, images_mask: str, build_gallery: Callable[[], GalleryIndex],
+                 on_change: Callable[[GalleryIndex], None], poll_interval: float = POLL_INTERVAL):
+        self.images_dir = images_dir
+        self.images_mask = images_mask
+        self.build_gallery = build_gallery
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.files = {}
+        self.stopped = threading.Event()
+        self.thread = None
+        self.reloads = 0
+
+    # {path: (mtime, size)} of every validated image
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        for path in glob.glob(self.images_mask):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # deleted between glob and stat
+                continue
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    # The gallery passed to on_change before start() must correspond to the current files
+    def start(self) -> None:
+        self.files = self.scan()
+        self.thread = threading.Thread(target=self._run, name="gallery-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self) -> None:
+        try:
+            import inotify_simple
+        except ImportError:
+            inotify_simple = None
+        if inotify_simple is None:
+            GalleryWatcher.send_to_node("log", "Watching {} every {} s".format(self.images_dir, self.poll_interval))
+            while not self.stopped.wait(self.poll_interval):
+                self.reload_if_changed()
+        else:
+            GalleryWatcher.send_to_node("log", "Watching {} with inotify".format(self.images_dir))
+            self._watch_inotify(inotify_simple)
+
+    def _watch_inotify(self, inotify_simple) -> None:
+        flags = inotify_simple.flags
+        mask = flags.CREATE | flags.DELETE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM \
+            | flags.DELETE_SELF
+        with inotify_simple.INotify() as inotify:
+            watched = set()
+            while not self.stopped.is_set():
+                # New user folders get their own watch
+                for directory in [self.images_dir] + glob.glob(os.path.join(self.images_dir, "*", "")):
+                    directory = os.path.normpath(directory)
+                    if directory not in watched:
+                        try:
+                            inotify.add_watch(directory, mask)
+                            watched.add(directory)
+                        except OSError:
+                            continue
+                if not inotify.read(timeout=1000):
+                    continue
+                # Collect the rest of the burst (e.g. a folder of photos copied at once)
+                time.sleep(GalleryWatcher.SETTLE_TIME)
+                inotify.read(timeout=0)
+                watched = {directory for directory in watched if os.path.isdir(directory)}
+                self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        files = self.scan()
+        if files == self.files:
+            return False
+        added = len(files.keys() - self.files.keys())
+        removed = len(self.files.keys() - files.keys())
+        changed = sum(1 for path, state in files.items() if path in self.files and self.files[path] != state)
+        GalleryWatcher.send_to_node("log", "Validated images changed: {} added, {} changed, {} removed"
+                                    .format(added, changed, removed))
+        started = time.time()
+        try:
+            gallery = self.build_gallery()
+        except Exception as e:
+            # Tried again on the next change or poll, the watcher thread must not die
+            GalleryWatcher.send_to_node("log", "Cannot reload validated images: {}".format(e))
+            return False
+        self.on_change(gallery)
+        self.files = files
+        self.reloads += 1
+        GalleryWatcher.send_to_node("log", "Gallery reloaded in {:.2f} s: {} photos of {} users ({})".format(
+            time.time() - started, len(gallery), len(gallery.users), gallery.users))
+        return True
@@ -0,0 +1,63 @@
+import abc
+import hashlib
+import numpy
+from FaceDetector import print_to_console
+
+
+# Calculates FaceNet embeddings of preprocessed (resized, RGB, whitened) faces.
+# Concrete backends: NcsInferenceBackend, CvDnnInferenceBackend, FakeInferenceBackend
+class InferenceBackend(abc.ABC):
+    NCS = "ncs"
+    CV_DNN = "cv_dnn"
+    FAKE = "fake"
+
+    # Print to console from static methods by default
+    send_to_node = print_to_console
+
+    # Acquire the device/model. Raises RuntimeError when backend cannot be used
+    def open(self) -> None:
+        return
+
+    # Embedding of a single face (height x width x channels)
+    @abc.abstractmethod
+    def infer(self, face: numpy.ndarray) -> numpy.ndarray:
+        pass
+
+    # Embeddings of stacked faces (faces x height x width x channels), matrix (faces x embedding size)
+    def infer_batch(self, face_tensor: numpy.ndarray) -> numpy.ndarray:
+        return numpy.stack([self.infer(face) for face in face_tensor])
+
+    # Identifies the model, embeddings of different models are not comparable (see EmbeddingCache)
+    def model_hash(self) -> str:
+        return hashlib.sha1(type(self).__name__.encode("utf-8")).hexdigest()
+
+    def close(self) -> None:
+        return
+
+    # name is one of NCS, CV_DNN, FAKE. options are taken from the MagicMirror config
+    @staticmethod
+    def create(name: str, options: dict = None) -> 'InferenceBackend':
+        options = options or {}
+        # Backends are imported on demand, so mvnc is not required for cv_dnn and fake
+        from InferenceDevicePool import InferenceDevicePool
+        dispatch = options.get("dispatch", InferenceDevicePool.ROUND_ROBIN)
+        if name == InferenceBackend.NCS:
+            from NcsInferenceBackend import NcsInferenceBackend
+            graph_filename = options.get("graphFile", NcsInferenceBackend.GRAPH_FILENAME)
+            # By default the graph is allocated on every attached stick
+            if options.get("devices", "all") == "all":
+                return InferenceDevicePool(lambda: NcsInferenceBackend.for_all_devices(graph_filename), dispatch)
+            return NcsInferenceBackend(graph_filename)
+        if name == InferenceBackend.CV_DNN:
+            from CvDnnInferenceBackend import CvDnnInferenceBackend
+            return CvDnnInferenceBackend(options.get("modelFile", CvDnnInferenceBackend.MODEL_FILENAME),
+                                         options.get("threads", CvDnnInferenceBackend.THREADS))
+        if name == InferenceBackend.FAKE:
+            from FakeInferenceBackend import FakeInferenceBackend
+            latency = options.get("latency", 0.0)
+            # Several fake devices simulate a machine with several sticks
+            devices = options.get("devices", 1)
+            if devices > 1:
+                return InferenceDevicePool(lambda: [FakeInferenceBackend(latency) for _ in range(devices)], dispatch)
+            return FakeInferenceBackend(latency)
+        raise ValueError("Unknown inference backend \"{}\"".format(name))
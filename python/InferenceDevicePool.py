@@ -0,0 +1,125 @@
+import threading
+import numpy
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Tuple
+from InferenceBackend import InferenceBackend
+
+
+# Spreads faces over several devices (e.g. all attached NCS sticks). Every device has its own worker
+# thread, faces are dispatched round-robin or to the least busy device and results are returned in
+# submission order. A device which fails at runtime is evicted and its faces are resent to the others
+class InferenceDevicePool(InferenceBackend):
+    ROUND_ROBIN = "round_robin"
+    LEAST_BUSY = "least_busy"
+    # Errors of the device itself (NcsInferenceBackend turns mvnc errors into RuntimeError). Anything else,
+    # e.g. ValueError of a wrong tensor shape, is the fault of the input and is raised without eviction,
+    # otherwise one bad face would evict every device in turn
+    DEVICE_ERRORS = (RuntimeError, OSError)
+
+    # create_devices returns not opened backends, it is called from open() so devices are enumerated late
+    def __init__(self, create_devices: Callable[[], List[InferenceBackend]], dispatch: str = ROUND_ROBIN):
+        if dispatch not in (InferenceDevicePool.ROUND_ROBIN, InferenceDevicePool.LEAST_BUSY):
+            raise ValueError("Unknown dispatch policy \"{}\"".format(dispatch))
+        self.create_devices = create_devices
+        self.dispatch = dispatch
+        self.devices = []
+        self.executors = []
+        self.pending = []
+        self.next_device = 0
+        self.lock = threading.Lock()
+
+    def open(self) -> None:
+        for device in self.create_devices():
+            try:
+                device.open()
+            except RuntimeError as e:
+                InferenceBackend.send_to_node("log", "Device {} is skipped: {}".format(len(self.devices), e))
+                continue
+            self.devices.append(device)
+            self.executors.append(ThreadPoolExecutor(max_workers=1))
+            self.pending.append(0)
+        if not self.devices:
+            raise RuntimeError("No inference devices could be opened")
+        InferenceBackend.send_to_node("log", "Inference pool uses {} device(s)".format(len(self.devices)))
+
+    def _alive(self) -> List[int]:
+        return [i for i, device in enumerate(self.devices) if device is not None]
+
+    def _choose_device(self) -> int:
+        alive = self._alive()
+        if not alive:
+            raise RuntimeError("All inference devices failed")
+        if self.dispatch == InferenceDevicePool.LEAST_BUSY:
+            return min(alive, key=lambda i: self.pending[i])
+        # the first alive device starting from next_device
+        index = min((i for i in alive if i >= self.next_device), default=alive[0])
+        self.next_device = index + 1
+        return index
+
+    def _evict(self, index: int, error: Exception) -> None:
+        with self.lock:
+            device = self.devices[index]
+            if device is None:
+                return
+            self.devices[index] = None
+        InferenceBackend.send_to_node("log", "Inference device {} is evicted: {}".format(index, error))
+        try:
+            device.close()
+        except Exception:
+            pass
+
+    # Faces queued on a device before it was evicted fail with RuntimeError and are resent by _result
+    def _run(self, index: int, face: numpy.ndarray):
+        try:
+            with self.lock:
+                device = self.devices[index]
+            if device is None:
+                raise RuntimeError("Inference device {} is evicted".format(index))
+            return device.infer(face)
+        finally:
+            with self.lock:
+                self.pending[index] -= 1
+
+    def _submit(self, face: numpy.ndarray) -> Tuple[int, Future]:
+        with self.lock:
+            index = self._choose_device()
+            self.pending[index] += 1
+        return index, self.executors[index].submit(self._run, index, face)
+
+    # Waits for the face result. When its device failed the face is sent to another alive device,
+    # RuntimeError is raised when none is left
+    def _result(self, index: int, future: Future, face: numpy.ndarray) -> numpy.ndarray:
+        while True:
+            try:
+                return future.result()
+            except InferenceDevicePool.DEVICE_ERRORS as e:
+                self._evict(index, e)
+                index, future = self._submit(face)
+
+    def infer(self, face: numpy.ndarray) -> numpy.ndarray:
+        return self._result(*self._submit(face), face)
+
+    # All faces are submitted first, so every device works in parallel
+    def infer_batch(self, face_tensor: numpy.ndarray) -> numpy.ndarray:
+        submitted = [self._submit(face) for face in face_tensor]
+        return numpy.stack([self._result(index, future, face)
+                            for (index, future), face in zip(submitted, face_tensor)])
+
+    @property
+    def device_count(self) -> int:
+        return len(self._alive())
+
+    def model_hash(self) -> str:
+        alive = self._alive()
+        if not alive:
+            raise RuntimeError("All inference devices failed")
+        return self.devices[alive[0]].model_hash()
+
+    def close(self) -> None:
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+        for index in self._alive():
+            self.devices[index].close()
+        self.devices = []
+        self.executors = []
+        self.pending = []
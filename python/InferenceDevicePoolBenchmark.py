@@ -0,0 +1,37 @@
+import argparse
+import time
+import numpy
+from FakeInferenceBackend import FakeInferenceBackend
+from InferenceDevicePool import InferenceDevicePool
+
+# Shows how throughput of InferenceDevicePool scales with the amount of devices.
+# Fake devices sleep for --latency seconds per face, like NCS stick does.
+# Usage: python3 InferenceDevicePoolBenchmark.py --devices 1 2 4 --faces 200
+
+
+def run(device_counts, faces: int, batch: int, latency: float, dispatch: str):
+    face_tensor = numpy.random.default_rng(0).standard_normal((batch, 160, 160, 3)).astype(numpy.float16)
+    print("{:>8} {:>12} {:>10}".format("devices", "faces/s", "scaling"))
+    base = None
+    for device_count in device_counts:
+        pool = InferenceDevicePool(lambda: [FakeInferenceBackend(latency) for _ in range(device_count)], dispatch)
+        pool.open()
+        started = time.perf_counter()
+        for _ in range(faces // batch):
+            pool.infer_batch(face_tensor)
+        throughput = (faces // batch) * batch / (time.perf_counter() - started)
+        pool.close()
+        base = base or throughput
+        print("{:>8} {:12.1f} {:9.2f}x".format(device_count, throughput, throughput / base))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the inference device pool")
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument("--faces", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=12, help="faces per infer_batch call")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per face on a fake device")
+    parser.add_argument("--dispatch", default=InferenceDevicePool.ROUND_ROBIN,
+                        choices=[InferenceDevicePool.ROUND_ROBIN, InferenceDevicePool.LEAST_BUSY])
+    args = parser.parse_args()
+    run(args.devices, args.faces, args.batch, args.latency, args.dispatch)
@@ -0,0 +1,129 @@
+import numpy
+from typing import Dict, List
+from GalleryIndex import GalleryIndex
+
+
+# Approximate search for very large galleries. Embeddings are clustered by k-means into inverted lists
+# (IVF) and a probe is compared only with the rows of the `probe` lists with the closest centroids.
+# With pq_subvectors > 0 the residuals (row - centroid) are product quantized: candidates are ranked
+# by the cheap table lookup distance and only the best `rerank` of them are compared exactly.
+# Distances of the returned users are exact (the same as GalleryIndex), users without candidates
+# are left out of the result and so are not matched. More probed lists - higher recall, slower search
+class IvfGalleryIndex(GalleryIndex):
+    # Smaller galleries are searched exactly, clustering does not pay off
+    MIN_SIZE = 1000
+    PROBE = 8
+    RERANK = 64
+    # Centroids of every product quantizer subspace (codes fit uint8)
+    PQ_CENTROIDS = 256
+    KMEANS_ITERATIONS = 10
+
+    # lists - amount of k-means clusters, sqrt(gallery size) by default
+    def __init__(self, user_logins: List[str], embeddings: numpy.ndarray, lists: int = None, probe: int = PROBE,
+                 pq_subvectors: int = 0, rerank: int = RERANK, seed: int = 0):
+        super().__init__(user_logins, embeddings)
+        self.probe = probe
+        self.pq_subvectors = pq_subvectors
+        self.rerank = rerank
+        self.centroids = None
+        self.list_rows = []
+        self.codebooks = None
+        self.codes = None
+        if len(self) < IvfGalleryIndex.MIN_SIZE:
+            return
+        rnd = numpy.random.default_rng(seed)
+        lists = lists or int(numpy.sqrt(len(self)))
+        self.centroids, assignment = IvfGalleryIndex.kmeans(self.embeddings, lists, rnd)
+        # Rows of every list, in the order of the rows
+        order = numpy.argsort(assignment, kind="stable")
+        starts = numpy.searchsorted(assignment[order], numpy.arange(lists + 1))
+        self.list_rows = [order[starts[i]:starts[i + 1]] for i in range(lists)]
+        self.centroid_norms = numpy.einsum("ij,ij->i", self.centroids, self.centroids)
+        if pq_subvectors:
+            if self.dimension % pq_subvectors:
+                raise ValueError("Embedding size {} is not divisible by {} subvectors"
+                                 .format(self.dimension, pq_subvectors))
+            residuals = self.embeddings - self.centroids[assignment]
+            self.codebooks, self.codes = IvfGalleryIndex.train_pq(residuals, pq_subvectors, rnd)
+
+    # Lloyd's algorithm with random initial centroids. Returns centroids and the cluster of every row
+    @staticmethod
+    def kmeans(data: numpy.ndarray, clusters: int, rnd: numpy.random.Generator):
+        clusters = min(clusters, len(data))
+        centroids = data[rnd.choice(len(data), clusters, replace=False)].copy()
+        data_norms = numpy.einsum("ij,ij->i", data, data)
+        assignment = numpy.zeros(len(data), dtype=numpy.int64)
+        for _ in range(IvfGalleryIndex.KMEANS_ITERATIONS):
+            distances = data @ centroids.T
+            distances *= -2
+            distances += numpy.einsum("ij,ij->i", centroids, centroids)[numpy.newaxis, :]
+            distances += data_norms[:, numpy.newaxis]
+            assignment = numpy.argmin(distances, axis=1)
+            sums = numpy.zeros_like(centroids)
+            numpy.add.at(sums, assignment, data)
+            counts = numpy.bincount(assignment, minlength=clusters)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, numpy.newaxis]
+            # Empty cluster takes a random row, otherwise the list would stay empty forever
+            empty = numpy.flatnonzero(~filled)
+            if len(empty):
+                centroids[empty] = data[rnd.choice(len(data), len(empty), replace=False)]
+        return centroids.astype(numpy.float32), assignment
+
+    # Codebook (subvectors x PQ_CENTROIDS x subvector size) and codes (rows x subvectors) of the residuals
+    @staticmethod
+    def train_pq(residuals: numpy.ndarray, subvectors: int, rnd: numpy.random.Generator):
+        sub_size = residuals.shape[1] // subvectors
+        codebooks = []
+        codes = numpy.empty((len(residuals), subvectors), dtype=numpy.uint8)
+        for i in range(subvectors):
+            part = numpy.ascontiguousarray(residuals[:, i * sub_size:(i + 1) * sub_size])
+            codebook, codes[:, i] = IvfGalleryIndex.kmeans(part, IvfGalleryIndex.PQ_CENTROIDS, rnd)
+            # kmeans returns less centroids for tiny data, unused codes keep far away centroids
+            if len(codebook) < IvfGalleryIndex.PQ_CENTROIDS:
+                codebook = numpy.vstack([codebook, numpy.full((IvfGalleryIndex.PQ_CENTROIDS - len(codebook), sub_size),
+                                                              numpy.inf, dtype=numpy.float32)])
+            codebooks.append(codebook)
+        return numpy.stack(codebooks), codes
+
+    # Rows compared exactly with the probe
+    def candidates(self, probe: numpy.ndarray) -> numpy.ndarray:
+        coarse = self.centroid_norms - 2 * (self.centroids @ probe)
+        probed = numpy.argpartition(coarse, min(self.probe, len(coarse)) - 1)[:self.probe]
+        if self.codes is None:
+            return numpy.concatenate([self.list_rows[i] for i in probed])
+        sub_size = self.dimension // self.pq_subvectors
+        rows = []
+        approx = []
+        for i in probed:
+            list_rows = self.list_rows[i]
+            if not len(list_rows):
+                continue
+            residual = (probe - self.centroids[i]).reshape(self.pq_subvectors, 1, sub_size)
+            # Distance of every subvector of the residual to every codebook centroid
+            table = numpy.sum(numpy.square(self.codebooks - residual), axis=2)
+            codes = self.codes[list_rows]
+            approx.append(table[numpy.arange(self.pq_subvectors), codes].sum(axis=1))
+            rows.append(list_rows)
+        if not rows:
+            return numpy.empty(0, dtype=numpy.int64)
+        rows = numpy.concatenate(rows)
+        approx = numpy.concatenate(approx)
+        if len(rows) > self.rerank:
+            rows = rows[numpy.argpartition(approx, self.rerank - 1)[:self.rerank]]
+        return rows
+
+    def min_distances_batch(self, test_outputs: numpy.ndarray) -> List[Dict[str, float]]:
+        if self.centroids is None or numpy.shape(test_outputs)[1] != self.dimension:
+            return super().min_distances_batch(test_outputs)
+        probes = numpy.asarray(test_outputs, dtype=numpy.float32).reshape(-1, self.dimension)
+        results = []
+        for probe in probes:
+            rows = self.candidates(probe)
+            diff = self.embeddings[rows] - probe
+            distances = numpy.einsum("ij,ij->i", diff, diff)
+            user_distances = numpy.full(len(self.users), numpy.inf, dtype=numpy.float32)
+            numpy.minimum.at(user_distances, self.user_ids[rows], distances)
+            candidate_users = numpy.flatnonzero(numpy.isfinite(user_distances))
+            results.append({self.users[user_id]: float(user_distances[user_id]) for user_id in candidate_users})
+        return results
@@ -0,0 +1,81 @@
+import argparse
+import time
+import numpy
+from GalleryIndex import GalleryIndex
+from IvfGalleryIndex import IvfGalleryIndex
+
+# Recall and latency of IvfGalleryIndex against the exact GalleryIndex on a synthetic gallery.
+# Photos of every user are scattered around the user's own point, probes are new photos of random users.
+# Recall is the share of probes where the best user and the set of matched users are the same as exact.
+# Usage: python3 IvfGalleryIndexBenchmark.py --size 50000 --probes 1 4 8 16 --pq 0 16
+
+# FaceNet (facenet_celeb_ncs.graph) returns 128 floats
+EMBEDDING_SIZE = 128
+IMAGES_PER_USER = 10
+# Spread of the photos of one user around his point (embeddings are L2 normalized)
+PHOTO_NOISE = 0.05
+FACE_MATCH_THRESHOLD = 0.4
+
+
+def normalize(vectors: numpy.ndarray) -> numpy.ndarray:
+    return (vectors / numpy.linalg.norm(vectors, axis=1)[:, numpy.newaxis]).astype(numpy.float32)
+
+
+def synthetic_gallery(size: int, rnd: numpy.random.Generator):
+    users = (size + IMAGES_PER_USER - 1) // IMAGES_PER_USER
+    centers = normalize(rnd.standard_normal((users, EMBEDDING_SIZE)))
+    user_ids = numpy.arange(size) // IMAGES_PER_USER
+    embeddings = normalize(centers[user_ids] + rnd.standard_normal((size, EMBEDDING_SIZE)) * PHOTO_NOISE)
+    return ["user{}".format(i) for i in user_ids], embeddings, centers
+
+
+def matched(user_distances: dict) -> set:
+    return {user for user, distance in user_distances.items() if distance <= FACE_MATCH_THRESHOLD}
+
+
+def search(index: GalleryIndex, probes: numpy.ndarray):
+    results = []
+    started = time.perf_counter()
+    for probe in probes:
+        results.append(index.min_distances(probe))
+    return results, (time.perf_counter() - started) / len(probes) * 1000
+
+
+def run(size: int, probe_counts, pq_values, queries: int, lists: int):
+    rnd = numpy.random.default_rng(0)
+    user_logins, embeddings, centers = synthetic_gallery(size, rnd)
+    query_users = rnd.integers(0, len(centers), queries)
+    probes = normalize(centers[query_users] + rnd.standard_normal((queries, EMBEDDING_SIZE)) * PHOTO_NOISE)
+
+    exact = GalleryIndex(user_logins, embeddings)
+    exact_results, exact_ms = search(exact, probes)
+    exact_best = [min(result, key=result.get) for result in exact_results]
+    print("gallery {} photos of {} users, {} queries".format(size, len(exact.users), queries))
+    print("{:>10} {:>6} {:>10} {:>10} {:>12} {:>10}".format("index", "probe", "build s", "query ms", "best recall",
+                                                             "match rec."))
+    print("{:>10} {:>6} {:>10} {:10.3f} {:12.3f} {:10.3f}".format("exact", "-", "-", exact_ms, 1.0, 1.0))
+    for pq_subvectors in pq_values:
+        started = time.perf_counter()
+        index = IvfGalleryIndex(user_logins, embeddings, lists=lists, pq_subvectors=pq_subvectors)
+        build_s = time.perf_counter() - started
+        for probe in probe_counts:
+            index.probe = probe
+            results, query_ms = search(index, probes)
+            best_recall = numpy.mean([bool(result) and min(result, key=result.get) == best
+                                      for result, best in zip(results, exact_best)])
+            match_recall = numpy.mean([matched(result) == matched(exact_result)
+                                       for result, exact_result in zip(results, exact_results)])
+            name = "ivf+pq{}".format(pq_subvectors) if pq_subvectors else "ivf"
+            print("{:>10} {:>6} {:10.2f} {:10.3f} {:12.3f} {:10.3f}".format(name, probe, build_s, query_ms,
+                                                                            best_recall, match_recall))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency of the approximate gallery index")
+    parser.add_argument("--size", type=int, default=50000, help="photos in the gallery")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="probed lists")
+    parser.add_argument("--pq", type=int, nargs="+", default=[0, 16], help="PQ subvectors, 0 - without PQ")
+    parser.add_argument("--lists", type=int, help="k-means lists, sqrt(size) by default")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    run(args.size, args.probes, args.pq, args.queries, args.lists)
@@ -1,6 +1,5 @@
 import json
 import sys
-import Webcam
 
 
 class MMConfig:
@@ -16,6 +15,38 @@ class MMConfig:
     WELCOME_MESSAGE_ATTR = 'welcomeMessage'
     MOTION_STOP_DELAY = 'motionStopDelay'
     MOTION_DETECTION_THRESHOLD = 'motionDetectionThreshold'
+    PIPELINE_MODE_ATTR = 'pipelineMode'
+    FACE_TRACKING_ATTR = 'faceTracking'
+    ROI_DETECTION_ATTR = 'roiDetection'
+    SCHEDULER_POLICY_ATTR = 'schedulerPolicy'
+    IDLE_INTERVAL_ATTR = 'idleInterval'
+    IDLE_AFTER_ATTR = 'idleAfter'
+    CPU_CAP_ATTR = 'cpuCap'
+    ROI_FULL_SCAN_EVERY_ATTR = 'roiFullScanEvery'
+    FACE_TRACKING_MAX_FRAMES_ATTR = 'faceTrackingMaxFrames'
+    FACE_TRACKING_MAX_SECONDS_ATTR = 'faceTrackingMaxSeconds'
+    INFERENCE_BACKEND_ATTR = 'inferenceBackend'
+    INFERENCE_BACKEND_OPTIONS_ATTR = 'inferenceBackendOptions'
+    FACE_DETECTOR_ATTR = 'faceDetector'
+    FACE_DETECTOR_OPTIONS_ATTR = 'faceDetectorOptions'
+    METRICS_INTERVAL_ATTR = 'metricsInterval'
+    BATCH_IMAGES_ATTR = 'batchImages'
+    BATCH_OUTPUT_ATTR = 'batchOutput'
+    BATCH_WORKERS_ATTR = 'batchWorkers'
+    LOG_LEVEL_ATTR = 'logLevel'
+    IPC_FLUSH_INTERVAL_ATTR = 'ipcFlushInterval'
+    GALLERY_WATCH_INTERVAL_ATTR = 'galleryWatchInterval'
+    GALLERY_INDEX_ATTR = 'galleryIndex'
+    GALLERY_INDEX_OPTIONS_ATTR = 'galleryIndexOptions'
+    CAMERA_SOURCE_ATTR = 'cameraSource'
+    DETECTION_WORKERS_ATTR = 'detectionWorkers'
+    DETECTION_POOL_MODE_ATTR = 'detectionPoolMode'
+    REVERIFY_INTERVAL_ATTR = 'reverifyInterval'
+    REVERIFY_MAX_INTERVAL_ATTR = 'reverifyMaxInterval'
+    PRESENCE_CHECK_ATTR = 'presenceCheck'
+    COMPACT_GALLERY_ATTR = 'compactGallery'
+    DETECTOR_TUNING_ATTR = 'detectorTuning'
+    CAMERA_SOURCES_ATTR = 'cameraSources'
 
     @classmethod
     def to_node(cls, message_type, message):
@@ -63,14 +94,165 @@ class MMConfig:
     def get_threshold(cls):
         return cls._get(cls.THRESHOLD_ATTR)
 
+    # Seconds the face detection keeps running after the motion stopped
     @classmethod
     def get_motion_stop_delay(cls):
         return cls._get(cls.MOTION_STOP_DELAY)
 
+    # Changed area of the frame in pixels which is considered as motion. 0 disables the motion gate
     @classmethod
     def get_motion_detection_threshold(cls):
         return cls._get(cls.MOTION_DETECTION_THRESHOLD)
 
+    @classmethod
+    def get_pipeline_mode(cls):
+        return cls._get(cls.PIPELINE_MODE_ATTR, "serial")
+
+    # "fixed" - constant pause after every frame, "adaptive" - frame period follows interval/idleInterval
+    @classmethod
+    def get_scheduler_policy(cls):
+        return cls._get(cls.SCHEDULER_POLICY_ATTR, "fixed")
+
+    @classmethod
+    def get_idle_interval(cls):
+        return cls._get(cls.IDLE_INTERVAL_ATTR, 2000)
+
+    @classmethod
+    def get_idle_after(cls):
+        return cls._get(cls.IDLE_AFTER_ATTR, 10)
+
+    @classmethod
+    def get_cpu_cap(cls):
+        return cls._get(cls.CPU_CAP_ATTR, 1.0)
+
+    @classmethod
+    def get_roi_detection(cls):
+        return cls._get(cls.ROI_DETECTION_ATTR, False)
+
+    @classmethod
+    def get_roi_full_scan_every(cls):
+        return cls._get(cls.ROI_FULL_SCAN_EVERY_ATTR, 10)
+
+    @classmethod
+    def get_face_tracking(cls):
+        return cls._get(cls.FACE_TRACKING_ATTR, False)
+
+    @classmethod
+    def get_face_tracking_max_frames(cls):
+        return cls._get(cls.FACE_TRACKING_MAX_FRAMES_ATTR, 30)
+
+    @classmethod
+    def get_face_tracking_max_seconds(cls):
+        return cls._get(cls.FACE_TRACKING_MAX_SECONDS_ATTR, 5)
+
+    # One of "ncs", "cv_dnn", "fake"
+    @classmethod
+    def get_inference_backend(cls):
+        return cls._get(cls.INFERENCE_BACKEND_ATTR, "ncs")
+
+    # For example {"modelFile": "facenet.pb", "threads": 2} for cv_dnn
+    @classmethod
+    def get_inference_backend_options(cls):
+        return cls._get(cls.INFERENCE_BACKEND_OPTIONS_ATTR, {})
+
+    # One of "haar_default", "haar_alt", "haar_alt2", "lbp", "dnn_ssd"
+    @classmethod
+    def get_face_detector(cls):
+        return cls._get(cls.FACE_DETECTOR_ATTR, "haar_alt2")
+
+    # For example {"scaleFactor": 1.2, "minNeighbors": 4, "minSize": [40, 40]} for cascades
+    @classmethod
+    def get_face_detector_options(cls):
+        return cls._get(cls.FACE_DETECTOR_OPTIONS_ATTR, {})
+
+    # Seconds between metrics messages, 0 - metrics are disabled
+    @classmethod
+    def get_metrics_interval(cls):
+        return cls._get(cls.METRICS_INTERVAL_ATTR, 0)
+
+    # Directory or glob of images recognized instead of the camera frames, None - camera is used
+    @classmethod
+    def get_batch_images(cls):
+        return cls._get(cls.BATCH_IMAGES_ATTR, None)
+
+    @classmethod
+    def get_batch_output(cls):
+        return cls._get(cls.BATCH_OUTPUT_ATTR, "batch_results.jsonl")
+
+    # Processes which decode images and detect faces, 0 - one per CPU
+    @classmethod
+    def get_batch_workers(cls):
+        return cls._get(cls.BATCH_WORKERS_ATTR, 0)
+
+    # "info" or "debug" (every frame reports found faces and distances)
+    @classmethod
+    def get_log_level(cls):
+        return cls._get(cls.LOG_LEVEL_ATTR, "info")
+
+    # Seconds, messages to node are written together. 0 - every message is written immediately
+    @classmethod
+    def get_ipc_flush_interval(cls):
+        return cls._get(cls.IPC_FLUSH_INTERVAL_ATTR, 0.5)
+
+    # Seconds between checks of validated_images without inotify, 0 - photos are loaded only at startup
+    @classmethod
+    def get_gallery_watch_interval(cls):
+        return cls._get(cls.GALLERY_WATCH_INTERVAL_ATTR, 0)
+
+    # "exact" or "ivf" (approximate search for tens of thousands of photos)
+    @classmethod
+    def get_gallery_index(cls):
+        return cls._get(cls.GALLERY_INDEX_ATTR, "exact")
+
+    # For example {"lists": 200, "probe": 8, "pqSubvectors": 16, "rerank": 64} for ivf
+    @classmethod
+    def get_gallery_index_options(cls):
+        return cls._get(cls.GALLERY_INDEX_OPTIONS_ATTR, {})
+
+    # Camera index or path of a video file or a glob of images replayed instead of the camera
+    @classmethod
+    def get_camera_source(cls):
+        return cls._get(cls.CAMERA_SOURCE_ATTR, 0)
+
+    # Processes of DetectionPool, 0 - faces are detected in the main process
+    @classmethod
+    def get_detection_workers(cls):
+        return cls._get(cls.DETECTION_WORKERS_ATTR, 0)
+
+    # "alternate" or "scale_bands", see DetectionPool
+    @classmethod
+    def get_detection_pool_mode(cls):
+        return cls._get(cls.DETECTION_POOL_MODE_ATTR, "alternate")
+
+    # Seconds between re-verifications of the logged in user, 0 - every frame is inferred
+    @classmethod
+    def get_reverify_interval(cls):
+        return cls._get(cls.REVERIFY_INTERVAL_ATTR, 0)
+
+    @classmethod
+    def get_reverify_max_interval(cls):
+        return cls._get(cls.REVERIFY_MAX_INTERVAL_ATTR, 30)
+
+    # "detection" or "motion", see ReverificationSchedule
+    @classmethod
+    def get_presence_check(cls):
+        return cls._get(cls.PRESENCE_CHECK_ATTR, "detection")
+
+    # File written by GalleryCompactor.py, relative to the python folder. Empty - the validated images are used
+    @classmethod
+    def get_compact_gallery(cls):
+        return cls._get(cls.COMPACT_GALLERY_ATTR, "")
+
+    # File written by DetectorTuner.py, relative to the python folder. Ignored when it does not exist
+    @classmethod
+    def get_detector_tuning(cls):
+        return cls._get(cls.DETECTOR_TUNING_ATTR, "detector_tuning.json")
+
+    # Cameras of MultiCameraMatcher, empty - the single cameraSource is used
+    @classmethod
+    def get_camera_sources(cls):
+        return cls._get(cls.CAMERA_SOURCES_ATTR, [])
+
     @classmethod
     def _get(cls, key, default_value=None):
         if key in cls.CONFIG_DATA:
@@ -81,7 +263,8 @@ class MMConfig:
 
     @classmethod
     def get_camera(cls):
+        import Webcam
         cls.to_node("log", "-" * 20)
         cls.to_node("log", "Webcam loaded...")
         cls.to_node("log", "-" * 20)
-        return Webcam.OpenCVCapture()
+        return Webcam.create_capture(cls.get_camera_source())
@@ -0,0 +1,118 @@
+import bisect
+import threading
+import time
+from typing import Callable
+from FaceDetector import print_to_console
+
+
+# Latency histogram with fixed buckets, recording is a bisect and two additions
+class Histogram:
+    # Upper bounds of the buckets, milliseconds. The last bucket takes everything above
+    BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+    def __init__(self):
+        self.buckets = [0] * (len(Histogram.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, milliseconds: float) -> None:
+        self.buckets[bisect.bisect_left(Histogram.BOUNDS_MS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        if milliseconds > self.max:
+            self.max = milliseconds
+
+    # Upper bound of the bucket which contains the given percentile
+    def percentile(self, percent: float) -> float:
+        rank = self.count * percent / 100
+        accumulated = 0
+        for bound, amount in zip(Histogram.BOUNDS_MS, self.buckets):
+            accumulated += amount
+            if accumulated >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_message(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else 0,
+            "max": round(self.max, 3),
+            "p50": round(self.percentile(50), 3),
+            "p95": round(self.percentile(95), 3),
+            "buckets": self.buckets,
+        }
+
+
+# Counters and latency histograms of the recognition loop. Values are aggregated in process and sent to node
+# as one "metrics" message every flush_interval seconds, the aggregates are reset after every flush.
+# Disabled metrics (flush_interval 0) return from every call right away
+class Metrics:
+    CAPTURE = "capture"
+    DETECT = "detect"
+    PREPROCESS = "preprocess"
+    INFER = "infer"
+    MATCH = "match"
+    IPC = "ipc"
+
+    # Print to console from static methods by default
+    send_to_node = print_to_console
+
+    def __init__(self, flush_interval: float = 0):
+        self.enabled = flush_interval > 0
+        self.flush_interval = flush_interval
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        # Pipelined mode records from several threads
+        self.lock = threading.Lock()
+
+    def count(self, name: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # started is the time.time() when the measured step began
+    def observe(self, name: str, started: float) -> None:
+        if not self.enabled:
+            return
+        milliseconds = (time.time() - started) * 1000
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(milliseconds)
+
+    # Wraps send_to_node, so the time spent on serialization and writing to node is measured as IPC
+    def timed_sender(self, send_to_node_def: Callable[[str, object], None]) -> Callable[[str, object], None]:
+        if not self.enabled:
+            return send_to_node_def
+
+        def send_to_node(message_type: str, message):
+            started = time.time()
+            send_to_node_def(message_type, message)
+            self.observe(Metrics.IPC, started)
+            self.count("messages." + message_type)
+
+        return send_to_node
+
+    # Called once per frame, sends the metrics when the flush interval passed
+    def maybe_flush(self) -> None:
+        if self.enabled and time.time() - self.started >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            now = time.time()
+            message = {
+                "interval": round(now - self.started, 3),
+                "counters": self.counters,
+                "histograms": {name: histogram.to_message() for name, histogram in self.histograms.items()},
+            }
+            self.started = now
+            self.counters = {}
+            self.histograms = {}
+        Metrics.send_to_node("metrics", message)
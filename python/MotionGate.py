@@ -0,0 +1,53 @@
+import time
+import cv2
+import numpy
+
+
+# Cheap motion detector in front of the face detection. Compares a tiny grayscale copy of the frame
+# with a running average background. Face detection and inference run only while motion is above
+# the threshold and for stop_delay seconds after the motion stopped
+class MotionGate:
+    # Width of the downscaled frame, the height keeps aspect ratio
+    WIDTH = 64
+    BLUR_SIZE = (5, 5)
+    # Difference of gray level (0-255) which is considered as a change of the pixel
+    PIXEL_THRESHOLD = 25
+    # How fast the background adapts to the scene, 0..1
+    BACKGROUND_ALPHA = 0.05
+
+    # threshold is the changed area in pixels of the original frame (motionDetectionThreshold)
+    # stop_delay is in seconds (motionStopDelay)
+    def __init__(self, threshold: float, stop_delay: float):
+        self.threshold = threshold
+        self.stop_delay = stop_delay
+        self.background = None
+        self.last_motion = 0.0
+        self.processed_frames = 0
+        self.skipped_frames = 0
+
+    # Returns True if the frame should go to the face detection
+    def is_open(self, image: numpy.ndarray) -> bool:
+        (height, width) = image.shape[:2]
+        small_height = max(int(height * MotionGate.WIDTH / width), 1)
+        small = cv2.resize(image, (MotionGate.WIDTH, small_height), interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(small, MotionGate.BLUR_SIZE, 0)
+
+        now = time.time()
+        if self.background is None:
+            self.background = small.astype(numpy.float32)
+            self.last_motion = now
+        else:
+            diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+            changed_pixels = numpy.count_nonzero(diff > MotionGate.PIXEL_THRESHOLD)
+            # Scale the area back to the original frame, so the threshold does not depend on WIDTH
+            changed_area = changed_pixels * (width * height) / (MotionGate.WIDTH * small_height)
+            if changed_area >= self.threshold:
+                self.last_motion = now
+            cv2.accumulateWeighted(small, self.background, MotionGate.BACKGROUND_ALPHA)
+
+        if now - self.last_motion <= self.stop_delay:
+            self.processed_frames += 1
+            return True
+        self.skipped_frames += 1
+        return False
@@ -0,0 +1,110 @@
+import concurrent.futures
+import threading
+from typing import List, TYPE_CHECKING
+from FairInferenceScheduler import FairInferenceScheduler
+from GalleryIndex import GalleryIndex
+from InferenceBackend import InferenceBackend
+from VideoFaceMatcher import VideoFaceMatcher
+from VideoFaceMatcherLoggedUser import VideoFaceMatcherLoggedUser
+
+if TYPE_CHECKING:
+    from DetectionPool import DetectionPool
+    import Webcam
+
+
+# Several cameras (e.g. two doorways) in one process which share one inference backend. Every camera is
+# a VideoFaceMatcherLoggedUser with its own capture, detector state (motion gate, ROI detector, tracker,
+# re-verification) and login state, its loop runs in its own thread. Face crops of all cameras reach the
+# backend through FairInferenceScheduler. login, logout and matchResults carry the camera id as "source".
+# Cameras are taken from cameraSources: a camera index, a video file / glob of images (replayed in real
+# time), or {"id": "hall", "source": 0, "budget": 2} where budget is inferred frames per second
+class MultiCameraMatcher(VideoFaceMatcher):
+    def __init__(self, logout_delay: int, send_to_node_def=None):
+        self.logout_delay = logout_delay
+        self.cameras = []
+        # {source id: inferred frames per second}, 0 - unlimited
+        self.budgets = {}
+        self.scheduler = None
+        super().__init__(send_to_node_def)
+
+    # Every camera gets the detector settings of the config, the backend, the gallery and the metrics
+    # are configured once by configure() and shared
+    def configure_source(self, config) -> None:
+        self.pipeline_mode = config.get_pipeline_mode()
+        self.cameras = []
+        self.budgets = {}
+        for index, entry in enumerate(config.get_camera_sources()):
+            if not isinstance(entry, dict):
+                entry = {"source": entry}
+            camera = VideoFaceMatcherLoggedUser(self.logout_delay)
+            camera.configure_source(config)
+            camera.camera_source = entry.get("source", index)
+            camera.source_id = str(entry.get("id", index))
+            if camera.source_id in self.budgets:
+                raise ValueError("Duplicate camera id \"{}\"".format(camera.source_id))
+            self.budgets[camera.source_id] = entry.get("budget", 0)
+            camera.metrics = self.metrics
+            # The startup timeline is reported by the first camera
+            camera.startup = self.startup if index == 0 else None
+            self.cameras.append(camera)
+
+    # Cameras warm up in parallel. When one of them cannot be opened the others are stopped
+    def open_camera(self) -> 'Webcam.CaptureGroup':
+        import Webcam
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(self.cameras), 1),
+                                                   thread_name_prefix="camera") as executor:
+            futures = [executor.submit(camera.open_camera) for camera in self.cameras]
+        failed = [future for future in futures if future.exception() is not None]
+        if failed:
+            for future in futures:
+                if future.exception() is None:
+                    future.result().stop()
+            failed[0].result()
+        return Webcam.CaptureGroup([future.result() for future in futures])
+
+    def run_camera(self, gallery: GalleryIndex, backend: InferenceBackend, camera_device: 'Webcam.CaptureGroup'):
+        self.gallery = gallery
+        self.scheduler = FairInferenceScheduler(backend)
+        threads = [threading.Thread(target=self.run_source, name="camera-{}".format(camera.source_id),
+                                    args=(camera, self.scheduler.client(camera.source_id,
+                                                                        self.budgets[camera.source_id]), capture))
+                   for camera, capture in zip(self.cameras, camera_device.captures)]
+        VideoFaceMatcher.send_to_node("log", "Processing {} cameras with one inference backend".format(len(threads)))
+        self.scheduler.start()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.stop()
+            for thread in threads:
+                if thread.is_alive():
+                    thread.join()
+            # Cameras wait for their inference, so the scheduler stops after them
+            self.scheduler.stop()
+            self.scheduler.report()
+            camera_device.stop()
+
+    # A camera which failed (e.g. was unplugged) stops alone, the others keep running
+    def run_source(self, camera: VideoFaceMatcherLoggedUser, backend: InferenceBackend, capture) -> None:
+        try:
+            camera.run_camera(self.gallery, backend, capture)
+        except Exception as e:
+            VideoFaceMatcher.send_to_node("log", "Camera {} failed: {}".format(camera.source_id, e))
+        finally:
+            camera.stop()
+            VideoFaceMatcher.send_to_node("log", "Camera {} stopped".format(camera.source_id))
+
+    def detection_pools(self) -> List['DetectionPool']:
+        return [pool for camera in self.cameras for pool in camera.detection_pools()]
+
+    def set_gallery(self, gallery: GalleryIndex) -> None:
+        super().set_gallery(gallery)
+        for camera in self.cameras:
+            camera.set_gallery(gallery)
+
+    def stop(self):
+        super().stop()
+        for camera in self.cameras:
+            camera.stop()
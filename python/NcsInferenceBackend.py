@@ -0,0 +1,87 @@
+import hashlib
+import os
+import numpy
+from typing import List
+from InferenceBackend import InferenceBackend
+
+
+# FaceNet graph compiled by ncsdk compiler and executed on Intel Movidius NCS stick
+class NcsInferenceBackend(InferenceBackend):
+    GRAPH_FILENAME = "facenet_celeb_ncs.graph"
+
+    def __init__(self, graph_filename: str = GRAPH_FILENAME, device_index: int = 0):
+        self.graph_filename = graph_filename
+        self.device_index = device_index
+        self.graph_hash = None
+        self.device = None
+        self.graph = None
+
+    # Imported here because NCSDK is installed only on machines with the stick
+    @staticmethod
+    def _import_mvnc():
+        try:
+            from mvnc import mvncapi as mvnc
+            return mvnc
+        except ImportError as e:
+            raise RuntimeError("NCSDK is not installed: {}".format(e))
+
+    # One backend per plugged in stick, used by InferenceDevicePool
+    @staticmethod
+    def for_all_devices(graph_filename: str = GRAPH_FILENAME) -> List['NcsInferenceBackend']:
+        devices = NcsInferenceBackend._import_mvnc().EnumerateDevices()
+        return [NcsInferenceBackend(graph_filename, device_index) for device_index in range(len(devices))]
+
+    def open(self) -> None:
+        mvnc = NcsInferenceBackend._import_mvnc()
+
+        # The graph file that was created with the ncsdk compiler
+        graph_file_name = os.path.abspath(self.graph_filename)
+        if not os.path.isfile(graph_file_name):
+            raise RuntimeError('Cannot find graph file "{}"'.format(graph_file_name))
+
+        # Get a list of ALL the sticks that are plugged in
+        devices = mvnc.EnumerateDevices()
+        if len(devices) <= self.device_index:
+            raise RuntimeError("No NCS devices found")
+
+        # read in the graph file to memory buffer
+        with open(graph_file_name, mode="rb") as f:
+            graph_in_memory = f.read()
+        self.graph_hash = hashlib.sha1(graph_in_memory).hexdigest()
+
+        # Open the NCS
+        self.device = mvnc.Device(devices[self.device_index])
+        self.device.OpenDevice()
+
+        # create the NCAPI graph instance from the memory buffer containing the graph file.
+        self.graph = self.device.AllocateGraph(graph_in_memory)
+
+    # mvnc errors are raised as RuntimeError, so InferenceDevicePool can tell a failed stick from a bad input
+    def infer(self, face: numpy.ndarray) -> numpy.ndarray:
+        mvnc = NcsInferenceBackend._import_mvnc()
+        try:
+            # ***************************************************************
+            # Send the image to the NCS
+            # ***************************************************************
+            self.graph.LoadTensor(face.astype(numpy.float16), None)
+
+            # ***************************************************************
+            # Get the result from the NCS
+            # ***************************************************************
+            output, userobj = self.graph.GetResult()
+        except mvnc.MvncException as e:
+            raise RuntimeError("NCS device {} failed: {}".format(self.device_index, e))
+
+        return output
+
+    def model_hash(self) -> str:
+        return self.graph_hash
+
+    def close(self) -> None:
+        # Clean up the graph and the device
+        if self.graph is not None:
+            self.graph.DeallocateGraph()
+            self.graph = None
+        if self.device is not None:
+            self.device.CloseDevice()
+            self.device = None
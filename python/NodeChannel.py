@@ -0,0 +1,105 @@
+import json
+import sys
+import threading
+from typing import Callable
+
+
+# Channel of messages from python to node_helper (JSON lines on stdout, python-shell "json" mode).
+# - messages below log_level are dropped before they are serialized
+# - matchResults are coalesced per camera ("source" of MultiCameraMatcher): only the latest one of a flush
+#   interval is kept and it is sent only when matched users, their distances or amount of faces changed
+# - other messages are buffered and written together every flush_interval seconds with one flush
+# - login and logout are written immediately (after the buffered messages to keep the order)
+class NodeChannel:
+    DEBUG = "debug"
+    INFO = "info"
+    LEVELS = {DEBUG: 10, INFO: 20}
+    # Level of the message types, the rest is INFO
+    MESSAGE_LEVELS = {"debug": LEVELS[DEBUG]}
+    IMMEDIATE_TYPES = {"login", "logout"}
+    MATCH_RESULTS = "matchResults"
+    # Distances are compared with this precision, smaller changes are not sent
+    DISTANCE_PRECISION = 2
+    FLUSH_INTERVAL = 0.5
+
+    # write(text) writes and flushes serialized lines
+    def __init__(self, log_level: str = INFO, flush_interval: float = FLUSH_INTERVAL,
+                 write: Callable[[str], None] = None):
+        self.min_level = NodeChannel.LEVELS.get(log_level, NodeChannel.LEVELS[NodeChannel.INFO])
+        self.flush_interval = flush_interval
+        self.write = write or NodeChannel.write_to_stdout
+        self.buffer = []
+        # {source: message}, None is the source of the single camera
+        self.match_results = {}
+        self.sent_match_signatures = {}
+        self.dropped = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+        self.flusher = None
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def write_to_stdout(text: str) -> None:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    @staticmethod
+    def serialize(message_type: str, message) -> str:
+        return json.dumps({"messageType": message_type, "message": message}) + "\n"
+
+    # Identifies what node shows: matched users with rounded distances and amount of faces
+    @staticmethod
+    def match_signature(match_results: dict):
+        return (tuple((mf["user_login"], round(mf["distance"], NodeChannel.DISTANCE_PRECISION))
+                      for mf in match_results.get("matchedFaces", [])),
+                len(match_results.get("faces", [])))
+
+    # The same signature as send_to_node
+    def send(self, message_type: str, message) -> None:
+        if NodeChannel.MESSAGE_LEVELS.get(message_type, NodeChannel.LEVELS[NodeChannel.INFO]) < self.min_level:
+            self.dropped += 1
+            return
+        if message_type in NodeChannel.IMMEDIATE_TYPES:
+            self.flush(NodeChannel.serialize(message_type, message))
+            return
+        with self.lock:
+            if message_type == NodeChannel.MATCH_RESULTS:
+                source = message.get("source")
+                if source in self.match_results:
+                    self.coalesced += 1
+                self.match_results[source] = message
+            else:
+                self.buffer.append(NodeChannel.serialize(message_type, message))
+        if self.flush_interval <= 0:
+            self.flush()
+        elif self.flusher is None:
+            self.flusher = threading.Thread(target=self._flush_periodically, name="node-channel", daemon=True)
+            self.flusher.start()
+
+    # Writes buffered messages (and extra line after them) with a single write
+    def flush(self, extra: str = "") -> None:
+        with self.lock:
+            lines = self.buffer
+            self.buffer = []
+            for source, match_results in self.match_results.items():
+                signature = NodeChannel.match_signature(match_results)
+                if signature != self.sent_match_signatures.get(source):
+                    self.sent_match_signatures[source] = signature
+                    lines.append(NodeChannel.serialize(NodeChannel.MATCH_RESULTS, match_results))
+                else:
+                    self.coalesced += 1
+            self.match_results = {}
+            text = "".join(lines) + extra
+            # Writing under the lock keeps the order of immediate and buffered messages
+            if text:
+                self.write(text)
+
+    def _flush_periodically(self) -> None:
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        self.stopped.set()
+        self.send("log", "Node channel: {} message(s) dropped by log level, {} matchResults coalesced"
+                  .format(self.dropped, self.coalesced))
+        self.flush()
@@ -0,0 +1,67 @@
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+import cv2
+import imutils
+import numpy
+from FaceDetector import FaceDetector
+from PreprocessingEngine import PreprocessingEngine
+from VideoFaceMatcher import VideoFaceMatcher
+
+# Per-frame allocations and latency of the preprocessing (detector grayscale + face tensor)
+# before (allocating path) and after (PreprocessingEngine buffers). Also checks that the tensors are equal.
+# Usage: python3 PreprocessingEngineBenchmark.py --faces 2 --repeat 200
+
+
+def allocating_path(frame, face_rects):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    imutils.resize(gray, width=FaceDetector.OPTIMIZED_WIDTH)
+    # NCS backend converts to float16 right before LoadTensor
+    return VideoFaceMatcher.preprocess_faces(frame, face_rects).astype(numpy.float16)
+
+
+def engine_path(engine, frame, face_rects):
+    engine.to_detector_gray(frame)
+    return engine.preprocess_faces(frame, face_rects)
+
+
+# Returns (mean ms, bytes allocated on top of the steady state during one call)
+def measure(func, repeat: int):
+    func()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000, peak - base
+
+
+def run(face_count: int, repeat: int):
+    frame = cv2.resize(cv2.imread(sorted(glob.glob("validated_images/*/*.jpg"))[0]), (640, 480))
+    face_rects = [(40 + i * 150, 60, 40 + i * 150 + 140, 60 + 160) for i in range(face_count)]
+    engine = PreprocessingEngine(VideoFaceMatcher.NETWORK_WIDTH, VideoFaceMatcher.NETWORK_HEIGHT,
+                                 FaceDetector.OPTIMIZED_WIDTH)
+
+    equal = numpy.array_equal(allocating_path(frame, face_rects), engine_path(engine, frame, face_rects))
+    print("640x480 frame, {} face(s), tensors equal: {}".format(face_count, equal))
+    print("{:>12} {:>10} {:>16}".format("path", "ms/frame", "allocated bytes"))
+    for name, func in [("allocating", lambda: allocating_path(frame, face_rects)),
+                       ("engine", lambda: engine_path(engine, frame, face_rects))]:
+        latency, allocated = measure(func, repeat)
+        print("{:>12} {:10.3f} {:16d}".format(name, latency, allocated))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the preprocessing buffers")
+    parser.add_argument("--faces", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    run(args.faces, args.repeat)
@@ -0,0 +1,216 @@
+import argparse
+import glob
+import json
+import os
+import subprocess
+import time
+import cv2
+import numpy
+from FramePipeline import Frame
+from GalleryIndex import GalleryIndex
+from InferenceBackend import InferenceBackend
+from VideoFaceMatcher import VideoFaceMatcher
+from VideoFaceMatcherLoggedUser import VideoFaceMatcherLoggedUser
+
+# Replays recorded frames through the same detect -> infer -> match -> render chain as the camera loop
+# and reports per-stage latency percentiles, frames per second and the matching cost against synthetic
+# galleries of several sizes. Results are written as JSON, so runs of different commits can be compared.
+# Usage: python3 ReplayBenchmark.py --video frames.avi --output before.json
+#        python3 ReplayBenchmark.py --frames "recorded/*.jpg" --backend fake --gallery-sizes 100 10000
+# Without --video and --frames the validated images are replayed --count times.
+# When the inference backend cannot be opened (no NCS stick attached) the fake backend is used
+
+STAGES = ["read", "detect", "infer", "match", "render"]
+PERCENTILES = [50, 95, 99]
+# Typical amount of photos per user in validated_images
+IMAGES_PER_USER = 10
+
+
+def read_video(path: str):
+    capture = cv2.VideoCapture(path)
+    while True:
+        ret_val, frame = capture.read()
+        if not ret_val:
+            break
+        yield frame
+    capture.release()
+
+
+def read_images(paths, count: int):
+    for _ in range(count):
+        for path in paths:
+            yield cv2.imread(path)
+
+
+# {"p50": ms, "p95": ms, "p99": ms, "mean": ms, "count": n} of latencies in seconds
+def summarize(latencies) -> dict:
+    if not latencies:
+        return {"count": 0}
+    values = numpy.percentile(latencies, PERCENTILES) * 1000
+    summary = {"p{}".format(p): round(float(v), 3) for p, v in zip(PERCENTILES, values)}
+    summary["mean"] = round(float(numpy.mean(latencies)) * 1000, 3)
+    summary["count"] = len(latencies)
+    return summary
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def open_backend(name: str, options: dict) -> InferenceBackend:
+    backend = InferenceBackend.create(name, options)
+    try:
+        backend.open()
+        return backend
+    except RuntimeError as e:
+        if name == InferenceBackend.FAKE:
+            raise
+        print("Cannot open {} backend ({}), the fake backend is used".format(name, e))
+    backend = InferenceBackend.create(InferenceBackend.FAKE)
+    backend.open()
+    return backend
+
+
+# Real gallery of validated images, embedded with the same backend as the replayed frames
+def load_gallery(backend: InferenceBackend) -> GalleryIndex:
+    validated_images = VideoFaceMatcher.load_validated_image_list()
+    for img in validated_images:
+        img.inference = VideoFaceMatcher.run_inference(cv2.imread(img.image_path), backend)[0]
+    return GalleryIndex.from_validated_images(validated_images)
+
+
+def replay(matcher: VideoFaceMatcher, frames, gallery: GalleryIndex, backend: InferenceBackend):
+    latencies = {stage: [] for stage in STAGES}
+    test_outputs = []
+    sequence = 0
+    started = time.perf_counter()
+    while True:
+        stage_started = time.perf_counter()
+        image = next(frames, None)
+        if image is None:
+            break
+        latencies["read"].append(time.perf_counter() - stage_started)
+        sequence += 1
+        frame = Frame(sequence, image)
+
+        stage_started = time.perf_counter()
+        frame.face_rects = matcher.detect_faces(image)
+        latencies["detect"].append(time.perf_counter() - stage_started)
+
+        stage_started = time.perf_counter()
+        matcher.infer_frame(frame, backend)
+        latencies["infer"].append(time.perf_counter() - stage_started)
+
+        stage_started = time.perf_counter()
+        face_results = matcher.match_frame(frame, gallery)
+        latencies["match"].append(time.perf_counter() - stage_started)
+
+        stage_started = time.perf_counter()
+        matcher.render_match_results(face_results, image)
+        latencies["render"].append(time.perf_counter() - stage_started)
+        if len(frame.test_outputs):
+            test_outputs.append(frame.test_outputs)
+    elapsed = time.perf_counter() - started
+    return sequence, elapsed, latencies, test_outputs
+
+
+# Matching cost of the embeddings of the replayed faces against random galleries of the given sizes
+def synthetic_gallery_costs(sizes, test_outputs, dimension: int, repeat: int):
+    rnd = numpy.random.default_rng(0)
+    if not test_outputs:
+        test_outputs = [rnd.standard_normal((1, dimension)).astype(numpy.float32)]
+    results = []
+    for size in sizes:
+        embeddings = rnd.standard_normal((size, dimension)).astype(numpy.float32)
+        embeddings /= numpy.linalg.norm(embeddings, axis=1)[:, numpy.newaxis]
+        gallery = GalleryIndex(["user{}".format(i // IMAGES_PER_USER) for i in range(size)], embeddings)
+        latencies = []
+        for _ in range(repeat):
+            for outputs in test_outputs:
+                face_rects = [(0, 0, 1, 1)] * len(outputs)
+                started = time.perf_counter()
+                VideoFaceMatcher.faces_match_multi(gallery, outputs, face_rects)
+                latencies.append(time.perf_counter() - started)
+        result = {"size": size, "users": len(gallery.users)}
+        result.update(summarize(latencies))
+        results.append(result)
+    return results
+
+
+def print_report(report: dict):
+    print("{} frames in {:.2f} s, {:.2f} frames/s, backend {}".format(
+        report["frames"], report["elapsed"], report["fps"], report["backend"]))
+    print("{:>10} {:>10} {:>10} {:>10} {:>10}".format("stage", "p50 ms", "p95 ms", "p99 ms", "mean ms"))
+    for stage, summary in report["stages"].items():
+        if summary["count"]:
+            print("{:>10} {:10.3f} {:10.3f} {:10.3f} {:10.3f}".format(stage, summary["p50"], summary["p95"],
+                                                                      summary["p99"], summary["mean"]))
+    print("{:>10} {:>8} {:>10} {:>10} {:>10}".format("gallery", "users", "p50 ms", "p95 ms", "p99 ms"))
+    for cost in report["galleries"]:
+        print("{:>10} {:>8} {:10.3f} {:10.3f} {:10.3f}".format(cost["size"], cost["users"], cost["p50"],
+                                                                cost["p95"], cost["p99"]))
+
+
+def run(args, frames):
+    backend = open_backend(args.backend, json.loads(args.backend_options))
+    try:
+        # Messages to node are still built (their cost is a part of the render stage) but not printed
+        matcher = VideoFaceMatcherLoggedUser(10, lambda message_type, message: None)
+        if args.roi:
+            from RoiFaceDetector import RoiFaceDetector
+            matcher.roi_face_detector = RoiFaceDetector()
+        if args.tracking:
+            from FaceTracker import FaceTracker
+            matcher.face_tracker = FaceTracker()
+        gallery = load_gallery(backend)
+        frame_count, elapsed, latencies, test_outputs = replay(matcher, frames, gallery, backend)
+        dimension = test_outputs[0].shape[1] if test_outputs else gallery.dimension if len(gallery) else 128
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "source": args.video or args.frames or VideoFaceMatcher.VALIDATED_IMAGES_MASK,
+            "backend": type(backend).__name__,
+            "frames": frame_count,
+            "elapsed": round(elapsed, 3),
+            "fps": round(frame_count / elapsed, 3) if elapsed else 0.0,
+            "stages": {stage: summarize(latencies[stage]) for stage in STAGES},
+            "galleries": synthetic_gallery_costs(args.gallery_sizes, test_outputs, dimension, args.repeat),
+        }
+    finally:
+        backend.close()
+    print_report(report)
+    if args.output:
+        with open(args.output, mode="w") as f:
+            json.dump(report, f, indent=2)
+        print("Results are written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmark on recorded frames")
+    parser.add_argument("--video", help="video file with recorded frames")
+    parser.add_argument("--frames", help="glob of recorded frame images, recursive ** is supported")
+    parser.add_argument("--count", type=int, default=20, help="replays of the validated images")
+    parser.add_argument("--backend", default=InferenceBackend.NCS, help="ncs, cv_dnn or fake")
+    parser.add_argument("--backend-options", default="{}", help="backend options as JSON")
+    parser.add_argument("--roi", action="store_true", help="search faces around the previous ones")
+    parser.add_argument("--tracking", action="store_true", help="reuse embeddings of tracked faces")
+    parser.add_argument("--gallery-sizes", type=int, nargs="*", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the replayed faces per gallery")
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+    for attr in ("video", "frames", "output"):
+        if getattr(args, attr):
+            setattr(args, attr, os.path.abspath(getattr(args, attr)))
+    # Classifier, models and validated images are relative to this folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if args.video:
+        frames = read_video(args.video)
+    elif args.frames:
+        frames = (cv2.imread(path) for path in sorted(glob.glob(args.frames, recursive=True)))
+    else:
+        frames = read_images(sorted(glob.glob(VideoFaceMatcher.VALIDATED_IMAGES_MASK)), args.count)
+    run(args, frames)
@@ -0,0 +1,122 @@
+import time
+import numpy
+from typing import List, Optional, Tuple
+from FaceDetector import print_to_console
+from MatchedFace import MatchedFace
+from MotionGate import MotionGate
+
+
+# Duty cycle of the inference while a confirmed user stands in front of the mirror. After the login
+# only cheap presence checks run (the face detection or just the motion detection), the identity is
+# re-verified by a full inference after interval seconds, every successful re-verification doubles
+# the interval up to max_interval. Identity doubt, a changed face count or the logout return to full rate
+class ReverificationSchedule:
+    # Presence checks between re-verifications
+    DETECTION = "detection"
+    MOTION = "motion"
+    BACKOFF = 2.0
+    # Re-verified distance above this share of the match threshold puts the identity in doubt
+    DOUBT_RATIO = 0.9
+    # Changed area in pixels which brings the detection back in the motion mode (motionDetectionThreshold)
+    MOTION_THRESHOLD = 2000
+
+    # Print to console from static methods by default
+    send_to_node = print_to_console
+
+    def __init__(self, interval: float, max_interval: float, presence: str = DETECTION,
+                 motion_threshold: float = MOTION_THRESHOLD):
+        if presence not in (ReverificationSchedule.DETECTION, ReverificationSchedule.MOTION):
+            raise ValueError("Unknown presence check \"{}\"".format(presence))
+        self.interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.presence = presence
+        # The motion gate opens only for the frame with motion, the frames after it are still
+        self.motion_gate = MotionGate(motion_threshold, 0) if presence == ReverificationSchedule.MOTION else None
+        # None - full rate. Otherwise the verified user and what the last verification saw
+        self.user = None
+        self.face_rects = []
+        self.matched_faces = []
+        self.current_interval = interval
+        self.next_verification = 0.0
+        # Counters of the current session (login - logout)
+        self.session_user = None
+        self.session_started = 0.0
+        self.session_inferences = 0
+        self.session_saved = 0
+        self.session_verifications = 0
+        self.total_saved = 0
+
+    @property
+    def is_active(self) -> bool:
+        return self.user is not None
+
+    # In the motion mode the detection is skipped while nothing moves, the faces of the last verification
+    # are reused then. The background is updated on every frame, so the first motion is noticed
+    def needs_detection(self, image: numpy.ndarray) -> bool:
+        if self.motion_gate is None:
+            return True
+        moved = self.motion_gate.is_open(image)
+        return not self.is_active or moved or time.time() >= self.next_verification
+
+    # False - the identities of the last verification are reused for these faces
+    def needs_inference(self, face_rects: List[Tuple[int, int, int, int]]) -> bool:
+        if not self.is_active:
+            return True
+        if len(face_rects) != len(self.face_rects):
+            self.full_rate("face count changed from {} to {}".format(len(self.face_rects), len(face_rects)))
+            return True
+        if time.time() >= self.next_verification:
+            return True
+        self.saved(len(face_rects))
+        return False
+
+    def saved(self, inferences: int) -> None:
+        self.session_saved += inferences
+        self.total_saved += inferences
+
+    def inferred(self, inferences: int) -> None:
+        self.session_inferences += inferences
+
+    # Called with the result of a full inference while user is logged in. The first successful
+    # verification starts the duty cycle, every next one backs off
+    def verified(self, user: str, face_rects: List[Tuple[int, int, int, int]],
+                 matched_faces: List[List[MatchedFace]], best_match: Optional[MatchedFace],
+                 match_threshold: float) -> None:
+        if best_match is None or best_match.user_login != user \
+                or best_match.distance > match_threshold * ReverificationSchedule.DOUBT_RATIO:
+            self.full_rate("identity of {} is in doubt".format(user))
+            return
+        if self.is_active:
+            self.session_verifications += 1
+            self.current_interval = min(self.current_interval * ReverificationSchedule.BACKOFF, self.max_interval)
+        else:
+            self.current_interval = self.interval
+        self.user = user
+        self.face_rects = list(face_rects)
+        self.matched_faces = matched_faces
+        self.next_verification = time.time() + self.current_interval
+
+    def full_rate(self, reason: str) -> None:
+        if self.is_active:
+            ReverificationSchedule.send_to_node("debug", "Re-verification: full rate, {}".format(reason))
+        self.user = None
+        self.face_rects = []
+        self.matched_faces = []
+
+    def start_session(self, user: str) -> None:
+        self.session_user = user
+        self.session_started = time.time()
+        self.session_inferences = 0
+        self.session_saved = 0
+        self.session_verifications = 0
+
+    def end_session(self) -> None:
+        self.full_rate("logout")
+        if self.session_user is None:
+            return
+        total = self.session_inferences + self.session_saved
+        ReverificationSchedule.send_to_node("log", "Session of {} ({:.0f} s): {} inference(s), {} saved ({:.0f}%), "
+                                                   "{} re-verification(s)".format(
+            self.session_user, time.time() - self.session_started, self.session_inferences, self.session_saved,
+            self.session_saved / total * 100 if total else 0, self.session_verifications))
+        self.session_user = None
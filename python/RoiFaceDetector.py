@@ -0,0 +1,78 @@
+import numpy
+from typing import List, Tuple
+from FaceDetector import FaceDetector
+from FaceTracker import FaceTracker
+
+
+# Face detector with memory. When faces were found in the previous frame, only padded regions around
+# them are searched (at the camera resolution and with min/max size close to the previous face).
+# The whole frame is scanned every full_scan_every frames or when a region search finds nothing
+class RoiFaceDetector:
+    # Region is the previous face expanded by this share of its size on every side
+    ROI_MARGIN = 0.5
+    # Face in the region is searched from MIN_SIZE_RATIO to MAX_SIZE_RATIO of the previous face size
+    MIN_SIZE_RATIO = 0.7
+    MAX_SIZE_RATIO = 1.5
+    # Larger faces are downscaled to this width, there is no gain to search them at full resolution
+    ROI_FACE_WIDTH = 120
+    # Smallest size the cascade can detect (window size of haarcascade_frontalface_alt2.xml is 20)
+    MIN_CASCADE_SIZE = 24
+    FULL_SCAN_EVERY = 10
+
+    def __init__(self, full_scan_every: int = FULL_SCAN_EVERY):
+        self.full_scan_every = full_scan_every
+        # (x, y, w, h) without padding, in the source image coordinates
+        self.previous_faces = []
+        self.frames_since_full_scan = 0
+        self.full_scans = 0
+        self.roi_scans = 0
+        self.roi_misses = 0
+
+    # The same output as FaceDetector.detect_faces
+    def detect_faces(self, source_image: numpy.ndarray, preprocessing=None) -> List[Tuple[int, int, int, int]]:
+        faces = []
+        if self.previous_faces and self.frames_since_full_scan < self.full_scan_every:
+            self.roi_scans += 1
+            faces = self.find_faces_in_rois(source_image)
+            if not faces:
+                self.roi_misses += 1
+        if faces:
+            self.frames_since_full_scan += 1
+        else:
+            self.full_scans += 1
+            self.frames_since_full_scan = 0
+            faces = FaceDetector.find_faces(source_image, preprocessing)
+        self.previous_faces = faces
+
+        (source_image_height, source_image_width) = source_image.shape[:2]
+        output_face_rects = [FaceDetector.pad_face(face, source_image_width, source_image_height) for face in faces]
+        FaceDetector.send_to_node("debug", "Found {} face(s)".format(len(output_face_rects)))
+        return output_face_rects
+
+    def find_faces_in_rois(self, source_image: numpy.ndarray) -> List[Tuple[int, int, int, int]]:
+        (source_image_height, source_image_width) = source_image.shape[:2]
+        engine = FaceDetector.get_engine()
+        faces = []
+        for (x, y, w, h) in self.previous_faces:
+            margin_x = int(w * RoiFaceDetector.ROI_MARGIN)
+            margin_y = int(h * RoiFaceDetector.ROI_MARGIN)
+            x1 = max(x - margin_x, 0)
+            y1 = max(y - margin_y, 0)
+            x2 = min(x + w + margin_x, source_image_width)
+            y2 = min(y + h + margin_y, source_image_height)
+            scale = min(1.0, RoiFaceDetector.ROI_FACE_WIDTH / w)
+            min_size = max(int(w * scale * RoiFaceDetector.MIN_SIZE_RATIO), RoiFaceDetector.MIN_CASCADE_SIZE)
+            max_size = max(int(w * scale * RoiFaceDetector.MAX_SIZE_RATIO), min_size + 1)
+            found = engine.find_faces_in_region(source_image[y1:y2, x1:x2], scale, min_size, max_size)
+            for (fx, fy, fw, fh) in found:
+                face = (x1 + fx, y1 + fy, fw, fh)
+                # Regions of close faces overlap, the same face can be found twice
+                if all(FaceTracker.iou(RoiFaceDetector.to_corners(face), RoiFaceDetector.to_corners(known)) < 0.5
+                       for known in faces):
+                    faces.append(face)
+        return faces
+
+    @staticmethod
+    def to_corners(face: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        x, y, w, h = face
+        return x, y, x + w, y + h
@@ -0,0 +1,91 @@
+import argparse
+import glob
+import os
+import time
+import cv2
+import numpy
+from FaceDetector import FaceDetector
+from FaceTracker import FaceTracker
+from RoiFaceDetector import RoiFaceDetector
+
+# Compares detection time and recall of the full-frame FaceDetector and RoiFaceDetector.
+# Faces found by the full-frame scan are the reference for the recall.
+# Usage: python3 RoiFaceDetectorBenchmark.py --video frames.avi
+#        python3 RoiFaceDetectorBenchmark.py --frames "recorded/*.jpg"
+# Without arguments a synthetic sequence is made by moving validated images over a 640x480 frame
+
+# Detected face counts as the same face when IoU is at least this value
+MATCH_IOU = 0.5
+
+
+def read_video(path: str):
+    capture = cv2.VideoCapture(path)
+    while True:
+        ret_val, frame = capture.read()
+        if not ret_val:
+            break
+        yield frame
+    capture.release()
+
+
+def synthetic_frames(count: int):
+    photo = cv2.imread(sorted(glob.glob("validated_images/*/*.jpg"))[0])
+    # Crop the head with some background and make the face about 120 px wide
+    (x, y, w, h) = FaceDetector.find_faces(photo)[0]
+    head = photo[max(y - h // 2, 0):y + h + h // 2, max(x - w // 2, 0):x + w + w // 2]
+    head = cv2.resize(head, None, fx=120 / w, fy=120 / w)
+    for i in range(count):
+        frame = numpy.full((480, 640, 3), 90, dtype=numpy.uint8)
+        left = int((640 - head.shape[1]) / 2 + 150 * numpy.sin(i / 15))
+        top = int((480 - head.shape[0]) / 2 + 40 * numpy.cos(i / 20))
+        frame[top:top + head.shape[0], left:left + head.shape[1]] = head
+        yield frame
+
+
+def run(frames):
+    roi_detector = RoiFaceDetector()
+    full_ms = []
+    roi_ms = []
+    reference_faces = 0
+    found_faces = 0
+    false_faces = 0
+    for frame in frames:
+        started = time.perf_counter()
+        reference = FaceDetector.detect_faces(frame)
+        full_ms.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        detected = roi_detector.detect_faces(frame)
+        roi_ms.append((time.perf_counter() - started) * 1000)
+
+        reference_faces += len(reference)
+        matched = sum(1 for rect in reference if any(FaceTracker.iou(rect, d) >= MATCH_IOU for d in detected))
+        found_faces += matched
+        false_faces += len(detected) - matched
+
+    print("frames: {}, reference faces: {}".format(len(full_ms), reference_faces))
+    print("{:>10} {:>10} {:>10} {:>10}".format("mode", "mean ms", "p95 ms", "recall"))
+    print("{:>10} {:10.2f} {:10.2f} {:>10}".format("full", numpy.mean(full_ms), numpy.percentile(full_ms, 95), "1.000"))
+    print("{:>10} {:10.2f} {:10.2f} {:10.3f}".format("roi", numpy.mean(roi_ms), numpy.percentile(roi_ms, 95),
+                                                       found_faces / max(reference_faces, 1)))
+    print("roi: {} full scans, {} region scans ({} missed), {} faces not found by the full scan".format(
+        roi_detector.full_scans, roi_detector.roi_scans, roi_detector.roi_misses, false_faces))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full-frame vs region of interest face detection")
+    parser.add_argument("--video", help="video file with recorded frames")
+    parser.add_argument("--frames", help="glob of recorded frame images")
+    parser.add_argument("--count", type=int, default=200, help="amount of synthetic frames")
+    args = parser.parse_args()
+    video = os.path.abspath(args.video) if args.video else None
+    frames = os.path.abspath(args.frames) if args.frames else None
+    # Classifier and validated images are relative to this folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    FaceDetector.send_to_node = lambda message_type, message: None
+    if video:
+        run(read_video(video))
+    elif frames:
+        run(cv2.imread(path) for path in sorted(glob.glob(frames)))
+    else:
+        run(synthetic_frames(args.count))
@@ -0,0 +1,53 @@
+import threading
+import time
+# Taken before the heavy imports, FacialRecognition.py imports this module first
+PROCESS_STARTED = time.time()
+from FaceDetector import print_to_console  # noqa: E402
+
+
+# Milestones of the startup in milliseconds since the process start. Sent to node as a "startup" message
+# when the first frame was processed and again when the first face was recognized
+class StartupTimeline:
+    FIRST_FRAME = "firstFrame"
+    FIRST_RECOGNITION = "firstRecognition"
+
+    # Print to console from static methods by default
+    send_to_node = print_to_console
+
+    def __init__(self, started: float = None):
+        self.started = started or PROCESS_STARTED
+        # {milestone: ms}, in the order they were reached
+        self.milestones = {}
+        # Initialization steps run in parallel threads
+        self.lock = threading.Lock()
+
+    def mark(self, milestone: str) -> None:
+        with self.lock:
+            if milestone not in self.milestones:
+                self.milestones[milestone] = round((time.time() - self.started) * 1000, 1)
+
+    # Runs func and marks the milestone when it finished, for steps submitted to an executor
+    def timed(self, milestone: str, func, *args):
+        result = func(*args)
+        self.mark(milestone)
+        return result
+
+    # Returns True when the timeline is complete and does not need more frames
+    def frame_processed(self, recognized: bool) -> bool:
+        if StartupTimeline.FIRST_FRAME not in self.milestones:
+            self.mark(StartupTimeline.FIRST_FRAME)
+            self.report()
+        if recognized:
+            self.mark(StartupTimeline.FIRST_RECOGNITION)
+            self.report()
+            return True
+        return False
+
+    def report(self) -> None:
+        with self.lock:
+            message = {
+                "milestones": dict(self.milestones),
+                "timeToFirstFrame": self.milestones.get(StartupTimeline.FIRST_FRAME),
+                "timeToFirstRecognition": self.milestones.get(StartupTimeline.FIRST_RECOGNITION),
+            }
+        StartupTimeline.send_to_node("startup", message)
@@ -0,0 +1,29 @@
+import threading
+import numpy
+from InferenceBackend import InferenceBackend
+
+
+# Lets several threads share one backend (e.g. the camera loop and GalleryWatcher), calls are serialized.
+# A device (NCS graph, cv2.dnn net) must not be used by two threads at the same time
+class SynchronizedInferenceBackend(InferenceBackend):
+    def __init__(self, backend: InferenceBackend):
+        self.backend = backend
+        self.lock = threading.Lock()
+
+    def open(self) -> None:
+        self.backend.open()
+
+    def infer(self, face: numpy.ndarray) -> numpy.ndarray:
+        with self.lock:
+            return self.backend.infer(face)
+
+    def infer_batch(self, face_tensor: numpy.ndarray) -> numpy.ndarray:
+        with self.lock:
+            return self.backend.infer_batch(face_tensor)
+
+    def model_hash(self) -> str:
+        return self.backend.model_hash()
+
+    def close(self) -> None:
+        with self.lock:
+            self.backend.close()
@@ -2,30 +2,61 @@
 # License: MIT See LICENSE file in root directory.
 
 
-from mvnc import mvncapi as mvnc
+import concurrent.futures
 import numpy
 import cv2
 import os
 import glob
 import time
-from typing import List
-from imutils.video import FPS
-from imutils.video import VideoStream
+from typing import List, Tuple, TYPE_CHECKING
+from EmbeddingCache import EmbeddingCache
 from FaceDetector import FaceDetector
 from FaceDetector import print_to_console
+from FaceTracker import FaceTracker
+from FairInferenceScheduler import FairInferenceScheduler
+from FramePipeline import Frame, FramePipeline, PipelineStats
+from FrameScheduler import FrameScheduler, FixedRateScheduler, AdaptiveScheduler
+from GalleryCompactor import GalleryCompactor
+from GalleryWatcher import GalleryWatcher
+from GalleryIndex import GalleryIndex
+from InferenceBackend import InferenceBackend
 from MatchedFace import MatchedFace
+from Metrics import Metrics
+from MotionGate import MotionGate
+from PreprocessingEngine import PreprocessingEngine
+from ReverificationSchedule import ReverificationSchedule
+from RoiFaceDetector import RoiFaceDetector
+from StartupTimeline import StartupTimeline
+from SynchronizedInferenceBackend import SynchronizedInferenceBackend
 from ValidatedImage import ValidatedImage
 
+# imutils (urllib, etc.), Webcam and the batch mode (multiprocessing) are imported only when they are used
+if TYPE_CHECKING:
+    from imutils.video import FPS
+    from DetectionPool import DetectionPool
+    import Webcam
+
+# left, top, right, bottom
+FaceRect = Tuple[int, int, int, int]
+# Detected face and users it was matched with
+FaceResult = Tuple[FaceRect, List[MatchedFace]]
+
 
 class VideoFaceMatcher:
-    IMAGES_DIR = "./"
     VALIDATED_IMAGES_MASK = "validated_images/*/*.jpg"
-
-    GRAPH_FILENAME = "facenet_celeb_ncs.graph"
+    # Inference results of validated images are cached here between runs
+    EMBEDDING_CACHE_DIR = "validated_images"
 
     CAMERA_INDEX = 0
+    # Seconds the camera sensor needs to adjust the exposure
+    CAMERA_WARM_UP = 1.0
     REQUEST_CAMERA_WIDTH = 640
     REQUEST_CAMERA_HEIGHT = 480
+    REQUEST_CAMERA_FPS = 30
+    # serial - read, detect, infer, match and render one after another in a single loop
+    # pipelined - every step runs in its own thread, so detection of the next frame overlaps inference
+    SERIAL_MODE = "serial"
+    PIPELINED_MODE = "pipelined"
 
     NETWORK_WIDTH = 160
     NETWORK_HEIGHT = 160
@@ -41,9 +72,108 @@ class VideoFaceMatcher:
     def __init__(self, send_to_node_def=None):
         # Flag that loop should be interrupted
         self.stopped = False
+        self.pipeline_mode = VideoFaceMatcher.SERIAL_MODE
+        # Camera index or a video file/glob of images replayed instead of the camera
+        self.camera_source = VideoFaceMatcher.CAMERA_INDEX
+        self.inference_backend = InferenceBackend.create(InferenceBackend.NCS)
+        # None - every frame goes to the face detection
+        self.motion_gate = None
+        # None - every detected face is sent to inference on every frame
+        self.face_tracker = None
+        # None - the whole frame is scanned by FaceDetector every time
+        self.roi_face_detector = None
+        # None - faces are detected in this process. Otherwise DetectionPool of worker processes
+        self.detection_pool = None
+        self.frame_scheduler = FixedRateScheduler()
+        # Reusable buffers for the camera frames
+        self.preprocessing_engine = PreprocessingEngine(VideoFaceMatcher.NETWORK_WIDTH, VideoFaceMatcher.NETWORK_HEIGHT,
+                                                        FaceDetector.OPTIMIZED_WIDTH)
+        # Disabled until configure()
+        self.metrics = Metrics()
+        # Directory or glob of images to recognize instead of the camera frames
+        self.batch_images = None
+        self.batch_recognizer = None
+        # None when the first recognition was reported
+        self.startup = StartupTimeline()
+        # Gallery used by the camera loop, GalleryWatcher replaces it when validated images change
+        self.gallery = None
+        self.gallery_watch_interval = 0
+        # Gallery the identities cached by face_tracker were matched against
+        self.tracked_gallery = None
+        # Exact search by default, IvfGalleryIndex for very large galleries
+        self.gallery_index_class = GalleryIndex
+        self.gallery_index_options = {}
+        # Gallery written by GalleryCompactor, loaded instead of the validated images. None - not used
+        self.compact_gallery = None
         if send_to_node_def is not None:
-            VideoFaceMatcher.send_to_node = send_to_node_def
-            FaceDetector.send_to_node = send_to_node_def
+            Metrics.send_to_node = send_to_node_def
+            VideoFaceMatcher.set_send_to_node(send_to_node_def)
+
+    # All classes which talk to node use the same function
+    @staticmethod
+    def set_send_to_node(send_to_node_def) -> None:
+        VideoFaceMatcher.send_to_node = send_to_node_def
+        FairInferenceScheduler.send_to_node = send_to_node_def
+        FaceDetector.send_to_node = send_to_node_def
+        EmbeddingCache.send_to_node = send_to_node_def
+        FramePipeline.send_to_node = send_to_node_def
+        FaceTracker.send_to_node = send_to_node_def
+        InferenceBackend.send_to_node = send_to_node_def
+        StartupTimeline.send_to_node = send_to_node_def
+        GalleryWatcher.send_to_node = send_to_node_def
+        GalleryCompactor.send_to_node = send_to_node_def
+        ReverificationSchedule.send_to_node = send_to_node_def
+
+    # Apply settings from the MagicMirror config (see MMConfig)
+    def configure(self, config) -> None:
+        FaceDetector.configure(config.get_face_detector(), config.get_face_detector_options())
+        if FaceDetector.load_tuning(config.get_detector_tuning()):
+            # The detection width could change
+            self.preprocessing_engine = PreprocessingEngine(
+                VideoFaceMatcher.NETWORK_WIDTH, VideoFaceMatcher.NETWORK_HEIGHT, FaceDetector.OPTIMIZED_WIDTH)
+        self.metrics = Metrics(config.get_metrics_interval())
+        # Time of every message to node is measured as IPC (except the metrics message itself)
+        VideoFaceMatcher.set_send_to_node(self.metrics.timed_sender(VideoFaceMatcher.send_to_node))
+        self.inference_backend = InferenceBackend.create(config.get_inference_backend(),
+                                                         config.get_inference_backend_options())
+        self.batch_images = config.get_batch_images()
+        self.gallery_watch_interval = config.get_gallery_watch_interval()
+        self.compact_gallery = config.get_compact_gallery()
+        if config.get_gallery_index() == "ivf":
+            from IvfGalleryIndex import IvfGalleryIndex
+            options = config.get_gallery_index_options()
+            self.gallery_index_class = IvfGalleryIndex
+            self.gallery_index_options = {
+                "lists": options.get("lists"),
+                "probe": options.get("probe", IvfGalleryIndex.PROBE),
+                "pq_subvectors": options.get("pqSubvectors", 0),
+                "rerank": options.get("rerank", IvfGalleryIndex.RERANK),
+            }
+        if self.batch_images:
+            from BatchRecognizer import BatchRecognizer
+            self.batch_recognizer = BatchRecognizer(config.get_batch_output(), config.get_batch_workers())
+        self.configure_source(config)
+
+    # State of one camera: the capture, detection and tracking of its frames. MultiCameraMatcher
+    # configures every camera with it
+    def configure_source(self, config) -> None:
+        self.pipeline_mode = config.get_pipeline_mode()
+        self.camera_source = config.get_camera_source()
+        motion_threshold = config.get_motion_detection_threshold()
+        if motion_threshold:
+            self.motion_gate = MotionGate(motion_threshold, config.get_motion_stop_delay() or 0)
+        if config.get_scheduler_policy() == FrameScheduler.ADAPTIVE:
+            # interval and idleInterval are in milliseconds as other MagicMirror intervals
+            self.frame_scheduler = AdaptiveScheduler(config.get_interval() / 1000, config.get_idle_interval() / 1000,
+                                                     config.get_idle_after(), config.get_cpu_cap())
+        if config.get_roi_detection():
+            self.roi_face_detector = RoiFaceDetector(config.get_roi_full_scan_every())
+        elif config.get_detection_workers():
+            from DetectionPool import DetectionPool
+            self.detection_pool = DetectionPool(config.get_detection_workers(), config.get_detection_pool_mode())
+        if config.get_face_tracking():
+            self.face_tracker = FaceTracker(config.get_face_tracking_max_frames(),
+                                            config.get_face_tracking_max_seconds())
 
     def timeit(method):
         def timed(*args, **kw):
@@ -68,50 +198,66 @@ class VideoFaceMatcher:
                                       .format(len(validated_images), len(users_list), users_list))
         return validated_images
 
+    # Everything that affects inference result of a validated image. Used as a key of the embedding cache
+    @staticmethod
+    def embedding_settings(model_hash: str) -> dict:
+        return {
+            "model": model_hash,
+            "detector": FaceDetector.settings(),
+            "network_size": [VideoFaceMatcher.NETWORK_WIDTH, VideoFaceMatcher.NETWORK_HEIGHT],
+        }
+
     # Run an inference on the passed image
     # image_to_classify is the image on which an inference will be performed
     #    upon successful return this image will be overlayed with boxes
     #    and labels identifying the found objects within the image.
-    # ssd_mobilenet_graph is the Graph object from the NCAPI which will
+    # backend is the InferenceBackend which will
     #    be used to peform the inference.
     @staticmethod
     # @timeit
-    def run_inference(image_to_classify, facenet_graph):
+    def run_inference(image_to_classify, backend: InferenceBackend):
         # get a resized version of the image that is the dimensions
         # SSD Mobile net expects
         resized_image, face_rects = VideoFaceMatcher.preprocess_image(image_to_classify)
 
-        output = VideoFaceMatcher.calculate_vector_on_ncs(resized_image, facenet_graph)
+        output = backend.infer(resized_image)
 
         return output, face_rects
 
+    # Detects every face on the image and calculates embedding for each of them.
+    # Returns matrix (faces x embedding size) and the face rects. When there is no face
+    # the inference is skipped completely
     @staticmethod
     # @timeit
-    def calculate_vector_on_ncs(image_to_classify, facenet_graph):
-        # ***************************************************************
-        # Send the image to the NCS
-        # ***************************************************************
-        facenet_graph.LoadTensor(image_to_classify.astype(numpy.float16), None)
+    def run_inference_multi(image_to_classify, backend: InferenceBackend):
+        face_rects = FaceDetector.detect_faces(image_to_classify)
+
+        return VideoFaceMatcher.infer_faces(image_to_classify, face_rects, backend), face_rects
 
-        # ***************************************************************
-        # Get the result from the NCS
-        # ***************************************************************
-        output, userobj = facenet_graph.GetResult()
+    # Embeddings of the already detected faces, matrix (faces x embedding size)
+    # engine is an optional PreprocessingEngine which reuses buffers instead of allocating them
+    @staticmethod
+    # @timeit
+    def infer_faces(image_to_classify, face_rects: List[FaceRect], backend: InferenceBackend,
+                    engine: PreprocessingEngine = None) -> numpy.ndarray:
+        if not face_rects:
+            return numpy.empty((0, 0), dtype=numpy.float32)
 
-        return output
+        if engine is not None:
+            face_tensor = engine.preprocess_faces(image_to_classify, face_rects)
+        else:
+            face_tensor = VideoFaceMatcher.preprocess_faces(image_to_classify, face_rects)
+        return backend.infer_batch(face_tensor)
 
     # overlays the boxes and labels onto the display image.
     # display_image is the image on which to overlay to
-    # image info is a text string to overlay onto the image.
-    # matching is a Boolean specifying if the image was a match.
+    # face_results are detected faces with users they were matched with
     # returns None
     @staticmethod
-    def overlay_on_image(display_image, matched_faces: List[MatchedFace], face_rects: []):
+    def overlay_on_image(display_image, face_results: List[FaceResult]):
         rect_width = 10
         offset = int(rect_width / 2)
-        if matched_faces:
-            display_text = ",\n".join(map(lambda x: "{}={}".format(x.user_login, x.distance), matched_faces))
-            cv2.putText(display_image, display_text, (30, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
+        if VideoFaceMatcher.best_matched_faces(face_results):
             # match, green rectangle
             cv2.rectangle(display_image, (0 + offset, 0 + offset),
                           (display_image.shape[1] - offset - 1, display_image.shape[0] - offset - 1),
@@ -123,10 +269,14 @@ class VideoFaceMatcher:
                           (0, 0, 255), 10)
 
         # loop over the recognized faces
-        for (left, top, right, bottom) in face_rects:
+        for (left, top, right, bottom), matched_faces in face_results:
             # draw the predicted face name on the image
-            cv2.rectangle(display_image, (left, top), (right, bottom),
-                          (0, 255, 0), 2)
+            color = (0, 255, 0) if matched_faces else (0, 0, 255)
+            cv2.rectangle(display_image, (left, top), (right, bottom), color, 2)
+            if matched_faces:
+                display_text = ", ".join(map(lambda x: "{}={}".format(x.user_login, x.distance), matched_faces))
+                cv2.putText(display_image, display_text, (left, max(top - 5, 10)),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
 
     # whiten an image
     @staticmethod
@@ -150,6 +300,19 @@ class VideoFaceMatcher:
             (x1, y1, x2, y2) = face_rects[0]
             src = src[y1:y2, x1:x2]
 
+        # return the preprocessed image
+        return VideoFaceMatcher.preprocess_face(src), face_rects
+
+    # crop every face and stack preprocessed faces into one tensor (faces x height x width x channels)
+    @staticmethod
+    # @timeit
+    def preprocess_faces(src, face_rects: List[FaceRect]) -> numpy.ndarray:
+        return numpy.stack([VideoFaceMatcher.preprocess_face(src[y1:y2, x1:x2])
+                            for (x1, y1, x2, y2) in face_rects])
+
+    # scale, convert and whiten a single face image as the network expects
+    @staticmethod
+    def preprocess_face(src):
         # scale the image
         preprocessed_image = cv2.resize(src, (VideoFaceMatcher.NETWORK_WIDTH, VideoFaceMatcher.NETWORK_HEIGHT))
 
@@ -157,10 +320,7 @@ class VideoFaceMatcher:
         preprocessed_image = cv2.cvtColor(preprocessed_image, cv2.COLOR_BGR2RGB)
 
         # whiten
-        preprocessed_image = VideoFaceMatcher.whiten_image(preprocessed_image)
-
-        # return the preprocessed image
-        return preprocessed_image, face_rects
+        return VideoFaceMatcher.whiten_image(preprocessed_image)
 
     # determine if two images are of matching faces based on the
     # the network output for both images.
@@ -170,143 +330,403 @@ class VideoFaceMatcher:
         if len(face1_output) != len(face2_output):
             VideoFaceMatcher.send_to_node("log", "length mismatch in face_match. {} against {}"
                                           .format(len(face1_output), len(face2_output)))
-            return 100
-        total_diff = 0
-        for output_index in range(0, len(face1_output)):
-            this_diff = numpy.square(face1_output[output_index] - face2_output[output_index])
-            total_diff += this_diff
-        return total_diff
-
-    # compare all outputs in loop. Return list of matched user logins and their distances
+            return GalleryIndex.NO_MATCH_DISTANCE
+        diff = numpy.subtract(face1_output, face2_output, dtype=numpy.float32)
+        return float(numpy.dot(diff, diff))
+
+    # compare output against the whole gallery at once. Return list of matched user logins and their distances
     @staticmethod
     # @timeit
-    def faces_match(validated_image_list: List[ValidatedImage], test_output: numpy.ndarray) -> List[MatchedFace]:
+    def faces_match(gallery: GalleryIndex, test_output: numpy.ndarray) -> List[MatchedFace]:
+        if gallery.users and numpy.size(test_output) != gallery.dimension:
+            VideoFaceMatcher.send_to_node("log", "length mismatch in faces_match. {} against {}"
+                                          .format(gallery.dimension, numpy.size(test_output)))
+        return VideoFaceMatcher.select_matched_faces(gallery.min_distances(test_output))
 
-        user_distances = {}
-        for validated_image in validated_image_list:
-            distance = VideoFaceMatcher.face_match(validated_image.inference, test_output)
-            # Set default distance
-            if validated_image.user_login not in user_distances:
-                user_distances[validated_image.user_login] = 100
-            if distance < user_distances[validated_image.user_login]:
-                user_distances[validated_image.user_login] = distance
-
-        VideoFaceMatcher.send_to_node("log", "Min distances are: {}".format(user_distances))
+    # match every face against the gallery, distances for all faces are calculated in one call
+    @staticmethod
+    # @timeit
+    def faces_match_multi(gallery: GalleryIndex, test_outputs: numpy.ndarray,
+                          face_rects: List[FaceRect]) -> List[FaceResult]:
+        if not face_rects:
+            return []
+        return [(face_rect, VideoFaceMatcher.select_matched_faces(user_distances))
+                for face_rect, user_distances in zip(face_rects, gallery.min_distances_batch(test_outputs))]
+
+    # apply FACE_MATCH_THRESHOLD to {user_login: min distance}
+    @staticmethod
+    def select_matched_faces(user_distances) -> List[MatchedFace]:
+        VideoFaceMatcher.send_to_node("debug", "Min distances are: {}".format(user_distances))
 
         matched_faces = []
         for k, v in user_distances.items():
             if v <= VideoFaceMatcher.FACE_MATCH_THRESHOLD:
                 matched_faces.append(MatchedFace(k, v))
-                
+
         if matched_faces:
-            VideoFaceMatcher.send_to_node("log", "PASS!  Matched faces: {}".format(matched_faces))
+            VideoFaceMatcher.send_to_node("debug", "PASS!  Matched faces: {}".format(matched_faces))
 
         else:
-            VideoFaceMatcher.send_to_node("log", "FAIL!  File does not match any image.")
+            VideoFaceMatcher.send_to_node("debug", "FAIL!  File does not match any image.")
 
         return matched_faces
 
+    # All users matched on any face, every user once with his best distance. The best match goes first
+    @staticmethod
+    def best_matched_faces(face_results: List[FaceResult]) -> List[MatchedFace]:
+        best = {}
+        for _, matched_faces in face_results:
+            for matched_face in matched_faces:
+                known = best.get(matched_face.user_login)
+                if known is None or matched_face.distance < known.distance:
+                    best[matched_face.user_login] = matched_face
+        return sorted(best.values(), key=lambda x: x.distance)
+
     # start the opencv webcam streaming and pass each frame
     # from the camera to the facenet network for an inference
     # Continue looping until the result of the camera frame inference
     # matches the valid face output and then return.
-    # valid_output is inference result for the valid image
-    # validated image filename is the name of the valid image file
-    # graph is the ncsdk Graph object initialized with the facenet graph file
+    # gallery is the index built from inference results of the validated images
+    # backend is the opened InferenceBackend
     #   which we will run the inference on.
+    # camera_device is the started capture returned by open_camera
     # returns None
-    def run_camera(self, validated_image_list: List[ValidatedImage], graph):
-        VideoFaceMatcher.send_to_node("log", "Starting video stream...")
-        camera_device = VideoStream(VideoFaceMatcher.CAMERA_INDEX)
-        camera_device.stream.stream.set(cv2.CAP_PROP_FRAME_WIDTH, VideoFaceMatcher.REQUEST_CAMERA_WIDTH)
-        camera_device.stream.stream.set(cv2.CAP_PROP_FRAME_HEIGHT, VideoFaceMatcher.REQUEST_CAMERA_HEIGHT)
-        camera_device.start()
+    def run_camera(self, gallery: GalleryIndex, backend: InferenceBackend, camera_device: 'Webcam.OpenCVCapture'):
+        from imutils.video import FPS
+        self.gallery = gallery
         try:
-            # Allow the camera sensor to warm up
-            time.sleep(1.0)
-
-            actual_camera_width = camera_device.stream.stream.get(cv2.CAP_PROP_FRAME_WIDTH)
-            actual_camera_height = camera_device.stream.stream.get(cv2.CAP_PROP_FRAME_HEIGHT)
-            VideoFaceMatcher.send_to_node("log", "actual camera resolution: {} x {}"
-                                          .format(actual_camera_width, actual_camera_height))
-
+            VideoFaceMatcher.send_to_node("log", "Processing frames in {} mode".format(self.pipeline_mode))
             fps = FPS().start()
-            while not self.stopped:
-                # Read image from camera,
-                # ret_val, vid_image = camera_device.read()
-                vid_image = camera_device.read()
-                # if not ret_val:
-                #     VideoFaceMatcher.send_to_node("log", "No image from camera, exiting")
-                #     self.stop()
-                #     break
-
-                fps.update()
-                # run a single inference on the image and overwrite the
-                # boxes and labels
-                test_output, face_rects = VideoFaceMatcher.run_inference(vid_image, graph)
-
-                matched_faces = VideoFaceMatcher.faces_match(validated_image_list, test_output)
-
-                self.render_match_results(matched_faces, face_rects, vid_image)
-                time.sleep(0.2)
+            if self.pipeline_mode == VideoFaceMatcher.PIPELINED_MODE:
+                self.run_pipelined(camera_device, backend, fps)
+            else:
+                self.run_serial(camera_device, backend, fps)
 
             fps.stop()
+            self.metrics.flush()
+            if self.detection_pool is not None:
+                VideoFaceMatcher.send_to_node("log", "Detection pool: {} frames on {} workers ({})".format(
+                    self.detection_pool.frames, self.detection_pool.workers, self.detection_pool.mode))
             VideoFaceMatcher.send_to_node("log", "Elapsed time: {:.2f}".format(fps.elapsed()))
             VideoFaceMatcher.send_to_node("log", "Approx. FPS: {:.2f}".format(fps.fps()))
+            if self.face_tracker is not None:
+                self.face_tracker.report()
+            if self.roi_face_detector is not None:
+                VideoFaceMatcher.send_to_node("log", "ROI detector: {} full scans, {} region scans ({} missed)".format(
+                    self.roi_face_detector.full_scans, self.roi_face_detector.roi_scans,
+                    self.roi_face_detector.roi_misses))
+            if self.motion_gate is not None:
+                VideoFaceMatcher.send_to_node("log", "Motion gate skipped {} of {} frames".format(
+                    self.motion_gate.skipped_frames,
+                    self.motion_gate.skipped_frames + self.motion_gate.processed_frames))
         finally:
             camera_device.stop()
-
-    def render_match_results(self, matched_faces: List[MatchedFace], face_rects: [], vid_image: numpy.ndarray) -> None:
+            if self.detection_pool is not None:
+                self.detection_pool.close()
+
+    # Starts the capture and waits until the camera sensor warmed up. Runs in parallel with other initialization
+    def open_camera(self) -> 'Webcam.OpenCVCapture':
+        import Webcam
+        VideoFaceMatcher.send_to_node("log", "Starting video stream {}...".format(self.camera_source))
+        camera_device = Webcam.create_capture(self.camera_source, VideoFaceMatcher.REQUEST_CAMERA_WIDTH,
+                                              VideoFaceMatcher.REQUEST_CAMERA_HEIGHT,
+                                              VideoFaceMatcher.REQUEST_CAMERA_FPS)
+        # Allow the camera sensor to warm up
+        camera_device.start(VideoFaceMatcher.CAMERA_WARM_UP)
+
+        (actual_camera_width, actual_camera_height) = camera_device.resolution
+        VideoFaceMatcher.send_to_node("log", "actual camera resolution: {} x {}, {} FPS"
+                                      .format(actual_camera_width, actual_camera_height, camera_device.fps))
+        return camera_device
+
+    # Original loop, every frame goes through all steps before the next one is read
+    def run_serial(self, camera_device, backend: InferenceBackend, fps: 'FPS'):
+        stats = PipelineStats()
+        sequence = 0
+        while not self.stopped:
+            # Read image from camera,
+            started = time.time()
+            vid_image = camera_device.read()
+            if vid_image is None:
+                VideoFaceMatcher.send_to_node("log", "No image from camera, exiting")
+                self.stop()
+                break
+            sequence += 1
+            frame = Frame(sequence, vid_image)
+            stats.record("capture", time.time() - started)
+            self.metrics.observe(Metrics.CAPTURE, started)
+
+            fps.update()
+            # run inference for every face on the image and match them
+            started = time.time()
+            frame.face_rects = self.detect_faces(vid_image)
+            stats.record("detect", time.time() - started)
+            self.metrics.observe(Metrics.DETECT, started)
+
+            started = time.time()
+            self.infer_frame(frame, backend)
+            stats.record("infer", time.time() - started)
+
+            started = time.time()
+            face_results = self.match_frame(frame, self.gallery)
+            self.metrics.observe(Metrics.MATCH, started)
+            self.render_match_results(face_results, vid_image)
+            stats.record("match", time.time() - started)
+            stats.record_latency(frame)
+            self.record_frame_metrics(frame)
+            self.record_startup(face_results)
+
+            self.frame_scheduler.notify(bool(frame.face_rects), self.is_login_pending())
+            self.frame_scheduler.wait(time.time() - frame.timestamp)
+        stats.report(VideoFaceMatcher.send_to_node)
+
+    # Capture, detection and inference run in their own threads connected by bounded queues
+    # which drop the oldest frame. Matching and rendering stay in the calling thread
+    def run_pipelined(self, camera_device, backend: InferenceBackend, fps: 'FPS'):
+        def capture():
+            started = time.time()
+            vid_image = camera_device.read()
+            self.metrics.observe(Metrics.CAPTURE, started)
+            if vid_image is None and not self.stopped:
+                VideoFaceMatcher.send_to_node("log", "No image from camera, exiting")
+                self.stop()
+            return vid_image
+
+        def detect(frame: Frame):
+            if self.detection_pool is not None:
+                # Does not wait, the next frames are submitted while the workers detect this one
+                frame.detection = self.submit_detection(frame.image)
+                return
+            started = time.time()
+            frame.face_rects = self.detect_faces(frame.image)
+            self.metrics.observe(Metrics.DETECT, started)
+
+        def infer(frame: Frame):
+            if frame.detection is not None:
+                # Frames arrive in the capture order, so the rects are taken in the submission order.
+                # Only the time the inference waited for the workers is measured
+                started = time.time()
+                frame.face_rects = frame.detection.result()
+                self.metrics.observe(Metrics.DETECT, started)
+            self.infer_frame(frame, backend)
+
+        def match(frame: Frame):
+            fps.update()
+            started = time.time()
+            face_results = self.match_frame(frame, self.gallery)
+            self.metrics.observe(Metrics.MATCH, started)
+            self.render_match_results(face_results, frame.image)
+            self.record_frame_metrics(frame)
+            self.record_startup(face_results)
+            self.frame_scheduler.notify(bool(frame.face_rects), self.is_login_pending())
+
+        pipeline = FramePipeline(capture, [("detect", detect), ("infer", infer)], ("match", match),
+                                 self.frame_scheduler.next_delay)
+        pipeline.run(lambda: self.stopped)
+
+    # Faces on the camera frame. While the motion gate is closed the detection
+    # and so the inference are skipped
+    def detect_faces(self, vid_image: numpy.ndarray) -> List[FaceRect]:
+        if self.motion_gate is not None and not self.motion_gate.is_open(vid_image):
+            return []
+        if self.roi_face_detector is not None:
+            return self.roi_face_detector.detect_faces(vid_image, self.preprocessing_engine)
+        if self.detection_pool is not None:
+            return self.detection_pool.submit(vid_image).result()
+        return FaceDetector.detect_faces(vid_image, self.preprocessing_engine)
+
+    # Starts the detection of the frame in DetectionPool, frames skipped by the motion gate have no faces
+    def submit_detection(self, vid_image: numpy.ndarray) -> concurrent.futures.Future:
+        if self.motion_gate is not None and not self.motion_gate.is_open(vid_image):
+            no_faces = concurrent.futures.Future()
+            no_faces.set_result([])
+            return no_faces
+        return self.detection_pool.submit(vid_image)
+
+    # Calculates embeddings of the detected faces. With the face tracker only new, moved
+    # or not verified for a long time faces are sent to the inference backend
+    def infer_frame(self, frame: Frame, backend: InferenceBackend) -> None:
+        if self.face_tracker is None:
+            frame.embed_indexes = list(range(len(frame.face_rects)))
+            frame.test_outputs = self.embed_faces(frame.image, frame.face_rects, backend)
+            return
+        frame.tracks = self.face_tracker.update(frame.face_rects)
+        frame.embed_indexes = [i for i, track in enumerate(frame.tracks) if self.face_tracker.needs_embedding(track)]
+        frame.test_outputs = self.embed_faces(frame.image, [frame.face_rects[i] for i in frame.embed_indexes], backend)
+
+    # The same as infer_faces with reusable buffers, preprocessing and inference are measured separately
+    def embed_faces(self, vid_image: numpy.ndarray, face_rects: List[FaceRect],
+                    backend: InferenceBackend) -> numpy.ndarray:
+        if not face_rects:
+            return numpy.empty((0, 0), dtype=numpy.float32)
+        started = time.time()
+        face_tensor = self.preprocessing_engine.preprocess_faces(vid_image, face_rects)
+        self.metrics.observe(Metrics.PREPROCESS, started)
+        started = time.time()
+        test_outputs = backend.infer_batch(face_tensor)
+        self.metrics.observe(Metrics.INFER, started)
+        return test_outputs
+
+    # Per-frame counters, the metrics are sent to node when the flush interval passed
+    def record_frame_metrics(self, frame: Frame) -> None:
+        if not self.metrics.enabled:
+            return
+        self.metrics.count("frames")
+        self.metrics.count("faces", len(frame.face_rects))
+        self.metrics.count("inferences", len(frame.embed_indexes))
+        self.metrics.maybe_flush()
+
+    # Matches embeddings calculated by infer_frame, tracked faces reuse their cached identity
+    def match_frame(self, frame: Frame, gallery: GalleryIndex) -> List[FaceResult]:
+        if self.face_tracker is None:
+            return VideoFaceMatcher.faces_match_multi(gallery, frame.test_outputs, frame.face_rects)
+        if gallery is not self.tracked_gallery:
+            self.tracked_gallery = gallery
+            self.rematch_tracks(gallery)
+        embedded_rects = [frame.face_rects[i] for i in frame.embed_indexes]
+        embedded_results = VideoFaceMatcher.faces_match_multi(gallery, frame.test_outputs, embedded_rects)
+        for i, (face_rect, matched_faces), test_output in zip(frame.embed_indexes, embedded_results,
+                                                              frame.test_outputs):
+            self.face_tracker.store(frame.tracks[i], test_output, matched_faces, face_rect)
+        return [(face_rect, track.matched_faces) for face_rect, track in zip(frame.face_rects, frame.tracks)]
+
+    # Identities cached by the tracker were matched against another gallery (e.g. a user was deleted).
+    # Their embeddings are still valid, so they are matched again without inference
+    def rematch_tracks(self, gallery: GalleryIndex) -> None:
+        # The infer stage must not add or remove tracks meanwhile
+        with self.face_tracker.lock:
+            tracks = [track for track in self.face_tracker.tracks if track.embedding is not None]
+            if not tracks:
+                return
+            results = VideoFaceMatcher.faces_match_multi(gallery, numpy.stack([track.embedding for track in tracks]),
+                                                         [track.rect for track in tracks])
+            for track, (_, matched_faces) in zip(tracks, results):
+                track.matched_faces = matched_faces
+
+    # Reports the startup timeline on the first frame and on the first recognized face
+    def record_startup(self, face_results: List[FaceResult]) -> None:
+        if self.startup is not None and self.startup.frame_processed(
+                bool(VideoFaceMatcher.best_matched_faces(face_results))):
+            self.startup = None
+
+    # Successor classes with login state report when a user was matched but not logged in yet,
+    # the scheduler keeps the full frame rate then
+    def is_login_pending(self) -> bool:
+        return False
+
+    def render_match_results(self, face_results: List[FaceResult], vid_image: numpy.ndarray) -> None:
         # Actual implementation in successor classes
         return
 
     def stop(self):
         self.stopped = True
 
+    # Recognizes every image of batch_images, results are written by BatchRecognizer as JSON lines
+    def run_images(self, gallery: GalleryIndex, backend: InferenceBackend):
+        VideoFaceMatcher.send_to_node("log", "Recognizing images {} into {}".format(
+            self.batch_images, self.batch_recognizer.output_path))
+        self.batch_recognizer.run(self.batch_recognizer.iter_image_paths(self.batch_images), gallery, backend)
+
+    # Inference results of the validated images, only new or changed photos are sent to the backend
+    def embed_gallery(self, validated_image_list: List[ValidatedImage], backend: InferenceBackend) -> GalleryIndex:
+        if self.compact_gallery:
+            settings = VideoFaceMatcher.embedding_settings(backend.model_hash())
+            gallery = GalleryCompactor.load(self.compact_gallery, validated_image_list, settings,
+                                            VideoFaceMatcher.FACE_MATCH_THRESHOLD, self.gallery_index_class,
+                                            self.gallery_index_options)
+            # The full gallery is used when the compacted one is missing or outdated
+            if gallery is not None:
+                return gallery
+        embedding_cache = EmbeddingCache(VideoFaceMatcher.EMBEDDING_CACHE_DIR,
+                                         VideoFaceMatcher.embedding_settings(backend.model_hash()))
+        embedding_cache.fill(validated_image_list, lambda img: VideoFaceMatcher.embed_image(img, backend))
+        # Photos which could not be read are left out of the gallery
+        validated_image_list = [img for img in validated_image_list if img.inference is not None]
+        return self.gallery_index_class.from_validated_images(validated_image_list, **self.gallery_index_options)
+
+    # Embedding of a validated image, None when the file cannot be read (half-copied or corrupt jpg)
+    @staticmethod
+    def embed_image(validated_image: ValidatedImage, backend: InferenceBackend):
+        image = cv2.imread(validated_image.image_path)
+        if image is None:
+            VideoFaceMatcher.send_to_node("log", "Cannot read {}, skipped".format(validated_image.image_path))
+            return None
+        return VideoFaceMatcher.run_inference(image, backend)[0]
+
+    # Returns False and logs the error when the initialization step failed
+    @staticmethod
+    def wait_ready(future: concurrent.futures.Future, error_message: str) -> bool:
+        try:
+            future.result()
+            return True
+        except RuntimeError as e:
+            VideoFaceMatcher.send_to_node("log", "{}: {}".format(error_message, e))
+            return False
+
+    # Rebuilds the gallery in a background thread when validated images change, None when disabled.
+    # The watcher thread detects faces with its own FaceDetector engine, the inference device is shared
+    # through SynchronizedInferenceBackend
+    def create_gallery_watcher(self, backend: InferenceBackend) -> GalleryWatcher:
+        if not self.gallery_watch_interval:
+            return None
+
+        def build_gallery() -> GalleryIndex:
+            return self.embed_gallery(VideoFaceMatcher.load_validated_image_list(), backend)
+
+        return GalleryWatcher(VideoFaceMatcher.EMBEDDING_CACHE_DIR, VideoFaceMatcher.VALIDATED_IMAGES_MASK,
+                              build_gallery, self.set_gallery, self.gallery_watch_interval)
+
+    # Started by initialize() before any other thread
+    def detection_pools(self) -> List['DetectionPool']:
+        return [self.detection_pool] if self.detection_pool is not None else []
+
+    # The camera loop takes the new gallery on the next frame
+    def set_gallery(self, gallery: GalleryIndex) -> None:
+        self.gallery = gallery
+
+    # Camera warm-up, classifier loading and device/graph allocation do not depend on each other and run
+    # in parallel. The gallery is embedded as soon as the detector and the backend are ready, while
+    # the camera may still be warming up
     def initialize(self):
-        use_camera = True
-
-        # Get a list of ALL the sticks that are plugged in
-        # we need at least one
-        devices = mvnc.EnumerateDevices()
-        if len(devices) == 0:
-            VideoFaceMatcher.send_to_node("log", "No NCS devices found")
-            quit()
-
-        # Pick the first stick to run the network
-        device = mvnc.Device(devices[0])
-
-        # Open the NCS
-        device.OpenDevice()
-
-        # The graph file that was created with the ncsdk compiler
-        graph_file_name = os.path.abspath(VideoFaceMatcher.GRAPH_FILENAME)
-        if not os.path.isfile(graph_file_name):
-            VideoFaceMatcher.send_to_node("log", 'Cannot find graph file "{}"'.format(graph_file_name))
-            return
-
-        # read in the graph file to memory buffer
-        with open(graph_file_name, mode="rb") as f:
-            graph_in_memory = f.read()
-
-        # create the NCAPI graph instance from the memory buffer containing the graph file.
-        graph = device.AllocateGraph(graph_in_memory)
-
+        use_camera = not self.batch_images
+        backend = self.inference_backend
+        gallery_watcher = None
+        if use_camera and self.gallery_watch_interval:
+            # New photos are embedded by the watcher thread while the camera loop uses the same device
+            backend = SynchronizedInferenceBackend(backend)
+        startup = self.startup
+        camera_future = None
         try:
-            validated_image_list = VideoFaceMatcher.load_validated_image_list()
-            for img in validated_image_list:
-                validated_image = cv2.imread(img.image_path)
-                img.inference, _ = VideoFaceMatcher.run_inference(validated_image, graph)
+            # Worker processes are forked while this is the only thread
+            for detection_pool in self.detection_pools():
+                detection_pool.start()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3, thread_name_prefix="startup") as executor:
+                if use_camera:
+                    camera_future = executor.submit(startup.timed, "cameraReady", self.open_camera)
+                detector_future = executor.submit(startup.timed, "detectorReady", FaceDetector.preload_engine)
+                backend_future = executor.submit(startup.timed, "backendReady", backend.open)
+                validated_image_list = VideoFaceMatcher.load_validated_image_list()
+                if not VideoFaceMatcher.wait_ready(detector_future, "Cannot create face detector") \
+                        or not VideoFaceMatcher.wait_ready(backend_future, "Cannot open inference backend"):
+                    return
+                gallery = startup.timed("galleryReady", self.embed_gallery, validated_image_list, backend)
             if use_camera:
-                self.run_camera(validated_image_list, graph)
+                camera_device = camera_future.result()
+                camera_future = None
+                gallery_watcher = self.create_gallery_watcher(backend)
+                if gallery_watcher is not None:
+                    gallery_watcher.start()
+                self.run_camera(gallery, backend, camera_device)
             else:
-                input_image_filename_list = os.listdir(VideoFaceMatcher.IMAGES_DIR)
-                input_image_filename_list = [i for i in input_image_filename_list if i.endswith(".jpg")]
-                if len(input_image_filename_list) < 1:
-                    VideoFaceMatcher.send_to_node("log", "No .jpg files found")
-                    return 1
-                # self.run_images(valid_output, self.validated_image_list, graph, input_image_filename_list)
+                self.run_images(gallery, backend)
         finally:
+            if gallery_watcher is not None:
+                gallery_watcher.stop()
+            # The camera was started but the loop did not run
+            if camera_future is not None and camera_future.exception() is None:
+                camera_future.result().stop()
+            # The loop did not run or did not close them
+            for detection_pool in self.detection_pools():
+                detection_pool.close()
             # Clean up the graph and the device
-            graph.DeallocateGraph()
-            device.CloseDevice()
+            backend.close()
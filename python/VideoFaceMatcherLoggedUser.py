@@ -1,8 +1,13 @@
+import concurrent.futures
 import numpy
 import time
 from typing import List
-from VideoFaceMatcher import VideoFaceMatcher
+from FramePipeline import Frame
+from GalleryIndex import GalleryIndex
+from InferenceBackend import InferenceBackend
 from MatchedFace import MatchedFace
+from ReverificationSchedule import ReverificationSchedule
+from VideoFaceMatcher import VideoFaceMatcher, FaceRect, FaceResult
 
 
 # Class converts all events to one of 3 states:
@@ -21,24 +26,116 @@ class VideoFaceMatcherLoggedUser(VideoFaceMatcher):
         self.login_timestamp = 0
         self.last_match = None
         self.same_user_detected_in_row = 0
+        # None - every frame is inferred. Otherwise the inference is duty cycled while a user is logged in
+        self.reverification = None
+        self.last_frame_inferred = True
+        # Set for the cameras of MultiCameraMatcher, events sent to node carry it as "source"
+        self.source_id = None
 
         super().__init__(send_to_node_def)
 
+    def configure_source(self, config) -> None:
+        super().configure_source(config)
+        if config.get_reverify_interval():
+            self.reverification = ReverificationSchedule(
+                config.get_reverify_interval(), config.get_reverify_max_interval(), config.get_presence_check(),
+                config.get_motion_detection_threshold() or ReverificationSchedule.MOTION_THRESHOLD)
+
+    # Between re-verifications in the motion mode the faces of the last verification are reused while
+    # nothing moves
+    def detect_faces(self, vid_image: numpy.ndarray) -> List[FaceRect]:
+        if self.reverification is not None and not self.reverification.needs_detection(vid_image):
+            return self.reverification.face_rects
+        return super().detect_faces(vid_image)
+
+    def submit_detection(self, vid_image: numpy.ndarray) -> concurrent.futures.Future:
+        if self.reverification is not None and not self.reverification.needs_detection(vid_image):
+            reused_faces = concurrent.futures.Future()
+            reused_faces.set_result(self.reverification.face_rects)
+            return reused_faces
+        return super().submit_detection(vid_image)
+
+    # While the logged in user is not due for re-verification the faces are not sent to the inference
+    def infer_frame(self, frame: Frame, backend: InferenceBackend) -> None:
+        if self.reverification is None:
+            super().infer_frame(frame, backend)
+            return
+        if self.reverification.needs_inference(frame.face_rects):
+            super().infer_frame(frame, backend)
+            self.reverification.inferred(len(frame.embed_indexes))
+            return
+        frame.reused_identity = True
+        frame.embed_indexes = []
+        frame.test_outputs = numpy.empty((0, 0), dtype=numpy.float32)
+        if self.face_tracker is not None:
+            # Tracks follow the faces, so their cached identities stay attached to the right rects
+            frame.tracks = self.face_tracker.update(frame.face_rects)
+        self.metrics.count("inferencesSaved", len(frame.face_rects))
+
+    def match_frame(self, frame: Frame, gallery: GalleryIndex) -> List[FaceResult]:
+        self.last_frame_inferred = not frame.reused_identity
+        if frame.reused_identity and self.face_tracker is None:
+            return list(zip(frame.face_rects, self.reverification.matched_faces))
+        return super().match_frame(frame, gallery)
+
+    # A full inference of the logged in user starts or backs off the duty cycle, anything else
+    # returns to full rate
+    def update_reverification(self, face_results: List[FaceResult], matched_faces: List[MatchedFace]) -> None:
+        if self.reverification is None or not self.last_frame_inferred:
+            return
+        if self.current_user in (VideoFaceMatcherLoggedUser.NO_USER, VideoFaceMatcherLoggedUser.UNKNOWN_USER):
+            self.reverification.full_rate("no user is logged in")
+            return
+        self.reverification.verified(self.current_user, [face_rect for face_rect, _ in face_results],
+                                     [face_matches for _, face_matches in face_results],
+                                     matched_faces[0] if matched_faces else None,
+                                     VideoFaceMatcher.FACE_MATCH_THRESHOLD)
+
+    # Inferences saved by the re-verification duty cycle are reported per session (login - logout)
+    def end_session(self) -> None:
+        if self.reverification is not None:
+            self.reverification.end_session()
+
+    def start_session(self) -> None:
+        if self.reverification is not None:
+            self.reverification.start_session(self.current_user)
+
+    def stop(self):
+        self.end_session()
+        super().stop()
+
+    def send_event(self, message_type: str, message: dict) -> None:
+        if self.source_id is not None:
+            message["source"] = self.source_id
+        VideoFaceMatcher.send_to_node(message_type, message)
+
+    # Someone was matched recently but is not logged in yet
+    def is_login_pending(self) -> bool:
+        return self.last_match is not None and self.last_match != self.current_user \
+            and time.time() - self.login_timestamp <= self.logout_delay
+
     # Analyzes what we matched or didn't match and sends one of 2 jsons
     # login  - {"user": "<user name>", "distance": 0.0}
     # logout - {"user": "<user name>"}
     # Where <user name> can be: None; Stranger; real user login
     # Also, send debug information who was matched for every video frame
-    # matchResults - {"matchedFaces": [{}]}
-    def render_match_results(self, matched_faces: List[MatchedFace], face_rects: [], vid_image: numpy.ndarray) -> None:
-        VideoFaceMatcher.send_to_node("matchResults", {"matchedFaces": [mf.__dict__ for mf in matched_faces]})
+    # matchResults - {"matchedFaces": [{}], "faces": [{"rect": [], "matchedFaces": [{}]}]}
+    # When several faces are in the frame the login is decided by the best matched user
+    def render_match_results(self, face_results: List[FaceResult], vid_image: numpy.ndarray) -> None:
+        matched_faces = VideoFaceMatcher.best_matched_faces(face_results)
+        self.send_event("matchResults", {
+            "matchedFaces": [mf.__dict__ for mf in matched_faces],
+            "faces": [{"rect": list(face_rect), "matchedFaces": [mf.__dict__ for mf in face_matches]}
+                      for face_rect, face_matches in face_results]
+        })
         # No face found (none face rect was found), logout user?
-        if not face_rects:
+        if not face_results:
             # if last detection exceeds timeout and there is someone logged in -> logout!
             if self.current_user != VideoFaceMatcherLoggedUser.NO_USER \
                     and time.time() - self.login_timestamp > self.logout_delay:
                 # callback logout to node helper
-                VideoFaceMatcher.send_to_node("logout", {"user": self.current_user})
+                self.send_event("logout", {"user": self.current_user})
+                self.end_session()
                 self.same_user_detected_in_row = 0
                 self.current_user = VideoFaceMatcherLoggedUser.NO_USER
             return
@@ -56,9 +153,11 @@ class VideoFaceMatcherLoggedUser(VideoFaceMatcher):
                 self.same_user_detected_in_row = 0
             # A user only gets logged in if he is predicted twice in a row minimizing prediction errors.
             if matched_faces[0].user_login != self.current_user and self.same_user_detected_in_row > 1:
+                self.end_session()
                 self.current_user = matched_faces[0].user_login
                 # Callback current user to node helper
-                VideoFaceMatcher.send_to_node("login", {"user": self.current_user, "distance": matched_faces[0].distance})
+                self.send_event("login", {"user": self.current_user, "distance": matched_faces[0].distance})
+                self.start_session()
             # set last_match to current prediction
             self.last_match = matched_faces[0].user_login
         # If we didn't match any face and current_user is not already set to unknown and last prediction match
@@ -68,9 +167,10 @@ class VideoFaceMatcherLoggedUser(VideoFaceMatcher):
                 and time.time() - self.login_timestamp > 5:
             # Set login time
             self.login_timestamp = time.time()
+            self.end_session()
             # set current_user to unknown
             self.current_user = VideoFaceMatcherLoggedUser.UNKNOWN_USER
             # callback to node helper
-            VideoFaceMatcher.send_to_node("login", {"user": self.current_user, "distance": 0})
+            self.send_event("login", {"user": self.current_user, "distance": 0})
 
-        return
+        self.update_reverification(face_results, matched_faces)
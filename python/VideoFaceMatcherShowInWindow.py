@@ -1,9 +1,12 @@
 import cv2
 import numpy
-from typing import List
-from MatchedFace import MatchedFace
-from ValidatedImage import ValidatedImage
-from VideoFaceMatcher import VideoFaceMatcher
+from typing import List, TYPE_CHECKING
+from GalleryIndex import GalleryIndex
+from InferenceBackend import InferenceBackend
+from VideoFaceMatcher import VideoFaceMatcher, FaceResult
+
+if TYPE_CHECKING:
+    import Webcam
 
 
 class VideoFaceMatcherShowInWindow(VideoFaceMatcher):
@@ -12,13 +15,13 @@ class VideoFaceMatcherShowInWindow(VideoFaceMatcher):
     # name of the opencv window
     CV_WINDOW_NAME = "FaceNet- Multiple people"
 
-    def run_camera(self, validated_image_list: List[ValidatedImage], graph):
+    def run_camera(self, gallery: GalleryIndex, backend: InferenceBackend, camera_device: 'Webcam.OpenCVCapture'):
         cv2.namedWindow(VideoFaceMatcherShowInWindow.CV_WINDOW_NAME)
 
-        super().run_camera(validated_image_list, graph)
+        super().run_camera(gallery, backend, camera_device)
 
-    def render_match_results(self, matched_faces: List[MatchedFace], face_rects: [], vid_image: numpy.ndarray) -> None:
-        VideoFaceMatcher.overlay_on_image(vid_image, matched_faces, face_rects)
+    def render_match_results(self, face_results: List[FaceResult], vid_image: numpy.ndarray) -> None:
+        VideoFaceMatcher.overlay_on_image(vid_image, face_results)
         # check if the window is visible, this means the user hasn't closed
         # the window via the X button
         prop_val = cv2.getWindowProperty(VideoFaceMatcherShowInWindow.CV_WINDOW_NAME, cv2.WND_PROP_ASPECT_RATIO)
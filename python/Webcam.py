@@ -1,30 +1,230 @@
-from imutils.video import VideoStream
-from imutils.video import FPS
-# import cv2
+import glob
+import os
+import threading
+import time
+import cv2
+import numpy
+from typing import List, Optional, Union
 
-# Rate at which the webcam will be polled for new images.
-CAPTURE_HZ = 2.0
+# Frames returned by read() are decoded into a ring of preallocated images and stay valid for this many
+# reads. The pipelined mode keeps up to 3 queues x 2 frames plus one frame in every stage in flight
+RING_SIZE = 12
 
 
+# Webcam read by a background thread which only grab()s frames, so the driver buffer never holds stale
+# images. A frame is retrieve()d (decoded) only when read() asks for it, frames skipped between
+# two reads are never decoded. MJPG, resolution and FPS are requested explicitly
 class OpenCVCapture:
-    def __init__(self, device_id=0):
-        # initialize the video stream and allow the camera sensor to warm up
-        print("[INFO] starting video stream...")
-        # self.vs = VideoStream(device_id).start()
-        # self.vs = cv2.VideoCapture(device_id)
-        # # self.vs = VideoStream(usePiCamera=True).start()
-        # time.sleep(2.0)
-
-        # start the FPS counter
-        self.fps = FPS().start()
-
-    def read(self):
-        # frame = self.vs.read()
-        self.fps.update()
-        return None
-
-    def stop(self):
-        print('{"log":"Terminating..."}')
-        self.fps.stop()
-        print("[INFO] elapsed time: {:.2f}".format(self.fps.elapsed()))
-        print("[INFO] approx. FPS: {:.2f}".format(self.fps.fps()))
+    FOURCC = "MJPG"
+    # Seconds before read() gives up waiting for the camera
+    READ_TIMEOUT = 2.0
+
+    def __init__(self, device_id: int = 0, width: int = 640, height: int = 480, fps: int = 30,
+                 fourcc: str = FOURCC, ring_size: int = RING_SIZE):
+        self.device_id = device_id
+        self.requested = (width, height, fps, fourcc)
+        self.ring_size = ring_size
+        self.capture = None
+        self.ring = []
+        self.ring_index = 0
+        self.latest = None
+        self.retrieve_requested = False
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+        self.grabbed = 0
+        self.retrieved = 0
+
+    # Opens the camera, frames grabbed during warm_up seconds are dropped while the sensor adjusts exposure
+    def start(self, warm_up: float = 0.0) -> 'OpenCVCapture':
+        width, height, fps, fourcc = self.requested
+        self.capture = cv2.VideoCapture(self.device_id)
+        if not self.capture.isOpened():
+            raise RuntimeError("Cannot open camera {}".format(self.device_id))
+        # FOURCC goes first, some drivers reset the resolution when the format changes
+        self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.capture.set(cv2.CAP_PROP_FPS, fps)
+        # Only the latest frame is interesting, the rest is skipped by grab() anyway
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.thread = threading.Thread(target=self._grab_frames, name="capture", daemon=True)
+        self.thread.start()
+        if warm_up:
+            time.sleep(warm_up)
+        return self
+
+    @property
+    def resolution(self):
+        return int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    @property
+    def fps(self) -> float:
+        return self.capture.get(cv2.CAP_PROP_FPS)
+
+    # The next slot of the ring, reused after ring_size reads
+    def _next_buffer(self) -> Optional[numpy.ndarray]:
+        if len(self.ring) < self.ring_size:
+            return None
+        buffer = self.ring[self.ring_index]
+        self.ring_index = (self.ring_index + 1) % self.ring_size
+        return buffer
+
+    def _grab_frames(self) -> None:
+        while not self.stopped:
+            if not self.capture.grab():
+                with self.condition:
+                    self.latest = None
+                    self.retrieve_requested = False
+                    self.condition.notify_all()
+                # Camera disconnected, do not spin
+                time.sleep(0.1)
+                continue
+            with self.condition:
+                self.grabbed += 1
+                if self.retrieve_requested:
+                    buffer = self._next_buffer()
+                    ok, image = self.capture.retrieve(buffer) if buffer is not None else self.capture.retrieve()
+                    if ok and image is not buffer:
+                        # The first frames or the resolution changed, the ring is (re)filled
+                        if len(self.ring) >= self.ring_size:
+                            self.ring = []
+                            self.ring_index = 0
+                        self.ring.append(image)
+                    self.latest = image if ok else None
+                    self.retrieved += 1
+                    self.retrieve_requested = False
+                    self.condition.notify_all()
+
+    # The next frame from the camera (decoded only now) or None when the camera does not respond
+    def read(self) -> Optional[numpy.ndarray]:
+        with self.condition:
+            if self.stopped:
+                return None
+            self.retrieve_requested = True
+            if not self.condition.wait_for(lambda: not self.retrieve_requested or self.stopped,
+                                           OpenCVCapture.READ_TIMEOUT):
+                return None
+            return self.latest
+
+    def stop(self) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.capture is not None:
+            self.capture.release()
+
+
+# Video file or image sequence (glob) with the same interface as OpenCVCapture, for running the pipeline
+# without a webcam. realtime=True behaves like a camera: frames which passed while the previous one was
+# processed are skipped (grabbed without decoding). Otherwise every frame is returned.
+# read() returns None at the end unless loop is set
+class FileCapture:
+    # Frame rate of image sequences in realtime mode
+    SEQUENCE_FPS = 10.0
+
+    def __init__(self, source: str, realtime: bool = False, loop: bool = False):
+        self.source = source
+        self.realtime = realtime
+        self.loop = loop
+        self.capture = None
+        self.image_paths = None
+        self.frame_rate = FileCapture.SEQUENCE_FPS
+        self.position = 0
+        self.started = 0.0
+        self.grabbed = 0
+        self.retrieved = 0
+
+    @staticmethod
+    def is_file_source(source: Union[int, str]) -> bool:
+        return isinstance(source, str) and not source.isdigit()
+
+    def start(self, warm_up: float = 0.0) -> 'FileCapture':
+        if os.path.isfile(self.source):
+            self.capture = cv2.VideoCapture(self.source)
+            if not self.capture.isOpened():
+                raise RuntimeError("Cannot open video file {}".format(self.source))
+            self.frame_rate = self.capture.get(cv2.CAP_PROP_FPS) or FileCapture.SEQUENCE_FPS
+        else:
+            self.image_paths = sorted(glob.glob(self.source, recursive=True))
+            if not self.image_paths:
+                raise RuntimeError("No images found by {}".format(self.source))
+        return self
+
+    @property
+    def resolution(self):
+        if self.capture is not None:
+            return int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        image = cv2.imread(self.image_paths[0])
+        return (image.shape[1], image.shape[0]) if image is not None else (0, 0)
+
+    @property
+    def fps(self) -> float:
+        return self.frame_rate
+
+    def _rewind(self) -> bool:
+        if not self.loop:
+            return False
+        self.position = 0
+        self.started = time.time()
+        if self.capture is not None:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return True
+
+    def _read_video(self) -> Optional[numpy.ndarray]:
+        target = int((time.time() - self.started) * self.frame_rate) if self.realtime else self.position
+        # Frames which passed are grabbed without decoding
+        while self.position < target:
+            if not self.capture.grab():
+                return self._read_video() if self._rewind() else None
+            self.grabbed += 1
+            self.position += 1
+        ok, image = self.capture.read()
+        if not ok:
+            return self._read_video() if self._rewind() else None
+        self.position += 1
+        self.retrieved += 1
+        return image
+
+    def _read_image(self) -> Optional[numpy.ndarray]:
+        if self.realtime:
+            self.position = max(self.position, int((time.time() - self.started) * self.frame_rate))
+        if self.position >= len(self.image_paths):
+            return self._read_image() if self._rewind() else None
+        image = cv2.imread(self.image_paths[self.position])
+        self.position += 1
+        self.retrieved += 1
+        return image
+
+    def read(self) -> Optional[numpy.ndarray]:
+        # Replay clock starts with the first read, not while the gallery is loaded
+        if not self.started:
+            self.started = time.time()
+        if self.capture is not None:
+            return self._read_video()
+        return self._read_image()
+
+    def stop(self) -> None:
+        if self.capture is not None:
+            self.capture.release()
+
+
+# source is a camera index or a path of a video file or a glob of images
+def create_capture(source: Union[int, str], width: int = 640, height: int = 480,
+                   fps: int = 30) -> Union[OpenCVCapture, FileCapture]:
+    if FileCapture.is_file_source(source):
+        return FileCapture(source, realtime=True)
+    return OpenCVCapture(int(source), width, height, fps)
+
+
+# Started captures of MultiCameraMatcher, stopped together
+class CaptureGroup:
+    def __init__(self, captures: List[Union[OpenCVCapture, FileCapture]]):
+        self.captures = captures
+
+    def stop(self) -> None:
+        for capture in self.captures:
+            capture.stop()
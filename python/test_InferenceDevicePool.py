@@ -0,0 +1,61 @@
+import unittest
+import numpy
+from FakeInferenceBackend import FakeInferenceBackend
+from InferenceBackend import InferenceBackend
+from InferenceDevicePool import InferenceDevicePool
+
+
+# A stick which was unplugged: every face fails with a device error
+class FailingBackend(FakeInferenceBackend):
+    def infer(self, face: numpy.ndarray) -> numpy.ndarray:
+        raise RuntimeError("Device is unplugged")
+
+
+# Accepts only faces of one shape, like a compiled graph
+class StrictBackend(FakeInferenceBackend):
+    def infer(self, face: numpy.ndarray) -> numpy.ndarray:
+        if face.shape != (4, 4, 3):
+            raise ValueError("Wrong tensor shape {}".format(face.shape))
+        return super().infer(face)
+
+
+# Run from the python directory: python -m unittest test_InferenceDevicePool
+class InferenceDevicePoolTest(unittest.TestCase):
+    def setUp(self):
+        send_to_node = InferenceBackend.send_to_node
+        InferenceBackend.send_to_node = lambda message_type, message: None
+        self.addCleanup(setattr, InferenceBackend, "send_to_node", send_to_node)
+        self.faces = numpy.random.default_rng(0).standard_normal((6, 4, 4, 3)).astype(numpy.float16)
+
+    def open_pool(self, devices, dispatch: str = InferenceDevicePool.ROUND_ROBIN) -> InferenceDevicePool:
+        pool = InferenceDevicePool(lambda: devices, dispatch)
+        pool.open()
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_failed_device_faces_are_resent(self):
+        for dispatch in (InferenceDevicePool.ROUND_ROBIN, InferenceDevicePool.LEAST_BUSY):
+            pool = self.open_pool([FailingBackend(latency=0.01), FakeInferenceBackend()], dispatch)
+            embeddings = pool.infer_batch(self.faces)
+            expected = numpy.stack([FakeInferenceBackend().infer(face) for face in self.faces])
+            numpy.testing.assert_array_equal(embeddings, expected)
+            self.assertEqual(pool.device_count, 1)
+
+    def test_input_error_does_not_evict(self):
+        pool = self.open_pool([StrictBackend(), StrictBackend()])
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                pool.infer(numpy.zeros((5, 5, 3)))
+        self.assertEqual(pool.device_count, 2)
+        self.assertEqual(pool.infer_batch(self.faces).shape, (6, FakeInferenceBackend.EMBEDDING_SIZE))
+
+    def test_all_devices_failed(self):
+        pool = self.open_pool([FailingBackend(), FailingBackend()])
+        with self.assertRaisesRegex(RuntimeError, "All inference devices failed"):
+            pool.infer_batch(self.faces)
+        with self.assertRaisesRegex(RuntimeError, "All inference devices failed"):
+            pool.model_hash()
+
+
+if __name__ == "__main__":
+    unittest.main()